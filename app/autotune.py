@@ -0,0 +1,175 @@
+import os
+import json
+import time
+import threading
+from pathlib import Path
+from typing import Optional, Dict, Any
+
+DEFAULT_PROFILE_PATH = os.path.join('data', 'host_profiles.json')
+
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+DEFAULT_RTT = 0.1
+
+
+class AutoTuner:
+    """根据实测吞吐量调整连接数和读取块大小
+
+    爬山法：从少量连接开始，每个采样周期比较总吞吐量，明显提升就再加一个连接，
+    不再提升时退回到最佳连接数并保持；吞吐量大幅下降 (例如服务器开始限流) 时减少连接。
+    稳定一段时间后重新尝试增加，以适应网络变化。
+
+    读取块大小取单连接带宽时延积 (单连接吞吐量 x 往返时间)，向上取 2 的幂。
+    """
+
+    def __init__(self, max_connections: int,
+                 initial_connections: int = 2,
+                 chunk_size: int = 256 * 1024,
+                 improve_ratio: float = 1.1,
+                 drop_ratio: float = 0.7,
+                 reprobe_periods: int = 10):
+        """
+        初始化调优器
+
+        Args:
+            max_connections: 连接数上限
+            initial_connections: 初始连接数
+            chunk_size: 初始读取块大小
+            improve_ratio: 吞吐量超过最佳值的这一倍数才算有提升
+            drop_ratio: 吞吐量低于最佳值的这一倍数时减少连接
+            reprobe_periods: 稳定多少个采样周期后重新尝试增加连接
+        """
+        self.max_connections = max(1, max_connections)
+        self.connections = max(1, min(initial_connections, self.max_connections))
+        self.chunk_size = chunk_size
+        self.improve_ratio = improve_ratio
+        self.drop_ratio = drop_ratio
+        self.reprobe_periods = reprobe_periods
+
+        self.rtt: Optional[float] = None
+        self.best_throughput = 0.0
+        self.best_connections = self.connections
+        self.samples = 0
+        self._probing = True
+        self._stable_periods = 0
+        self._warming_up = True  # 连接数刚变化，本周期的数据不可信
+
+    def record_rtt(self, seconds: float):
+        """记录一次请求到收到响应头的耗时，取最小值作为往返时间"""
+        if seconds > 0 and (self.rtt is None or seconds < self.rtt):
+            self.rtt = seconds
+
+    def update(self, throughput: float) -> int:
+        """每个采样周期调用一次，传入这一周期的总吞吐量 (bytes/s)，返回新的连接数"""
+        self.samples += 1
+        if self._warming_up:
+            self._warming_up = False
+            return self.connections
+        self._update_chunk_size(throughput)
+
+        if throughput > self.best_throughput * self.improve_ratio:
+            self.best_throughput = throughput
+            self.best_connections = self.connections
+            if self._probing and self.connections < self.max_connections:
+                self._set_connections(self.connections + 1)
+            else:
+                self._probing = False
+        elif self._probing:
+            # 增加连接没有带来提升，退回到最佳连接数
+            self._probing = False
+            self._stable_periods = 0
+            self._set_connections(self.best_connections)
+        elif throughput < self.best_throughput * self.drop_ratio:
+            # 吞吐量大幅下降，减少连接并以当前吞吐量为新的基准
+            self.best_throughput = throughput
+            self.best_connections = max(1, self.connections - 1)
+            self._stable_periods = 0
+            self._set_connections(self.best_connections)
+        else:
+            self._stable_periods += 1
+            if self._stable_periods >= self.reprobe_periods and self.connections < self.max_connections:
+                self._probing = True
+                self._stable_periods = 0
+                self._set_connections(self.connections + 1)
+        return self.connections
+
+    def _set_connections(self, connections: int):
+        if connections != self.connections:
+            self.connections = connections
+            self._warming_up = True
+
+    def _update_chunk_size(self, throughput: float):
+        per_connection = throughput / self.connections
+        bdp = per_connection * (self.rtt or DEFAULT_RTT)
+        size = MIN_CHUNK_SIZE
+        while size < bdp and size < MAX_CHUNK_SIZE:
+            size *= 2
+        self.chunk_size = size
+
+
+class HostProfiles:
+    """按主机记录调优结果，下一次下载从上次的最佳设置开始"""
+
+    def __init__(self, path: str = DEFAULT_PROFILE_PATH):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._profiles: Dict[str, Dict[str, Any]] = {}
+        self._load()
+
+    def get(self, host: str) -> Optional[Dict[str, Any]]:
+        """读取主机的调优记录 {'connections', 'chunk_size', 'throughput', 'updated_at'}"""
+        with self._lock:
+            profile = self._profiles.get(host)
+            return dict(profile) if profile else None
+
+    def create_tuner(self, host: str, max_connections: int) -> AutoTuner:
+        """按主机记录创建调优器，没有记录时使用默认初始值"""
+        profile = self.get(host)
+        if profile is None:
+            return AutoTuner(max_connections)
+        return AutoTuner(max_connections,
+                         initial_connections=profile['connections'],
+                         chunk_size=profile['chunk_size'])
+
+    def update(self, host: str, tuner: AutoTuner):
+        """保存调优结果"""
+        with self._lock:
+            self._profiles[host] = {
+                'connections': tuner.best_connections,
+                'chunk_size': tuner.chunk_size,
+                'throughput': tuner.best_throughput,
+                'updated_at': time.time(),
+            }
+            self._save()
+
+    def _load(self):
+        try:
+            if self.path.exists():
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self._profiles = json.load(f)
+        except Exception as e:
+            print(f"读取主机调优记录失败: {e}")
+
+    def _save(self):
+        """原子写入 (调用方持有锁)"""
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_name(self.path.name + '.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._profiles, f, indent=2)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"写入主机调优记录失败: {e}")
+
+
+_profiles: Optional[HostProfiles] = None
+_profiles_lock = threading.Lock()
+
+
+def get_host_profiles() -> HostProfiles:
+    """获取进程内共享的主机调优记录"""
+    global _profiles
+    with _profiles_lock:
+        if _profiles is None:
+            _profiles = HostProfiles()
+        return _profiles
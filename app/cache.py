@@ -0,0 +1,280 @@
+import os
+import json
+import time
+import atexit
+import shutil
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from typing import Optional, Dict, Any
+
+from app.integrity import file_digest, parse_checksum
+
+DEFAULT_CACHE_DIR = os.path.join('data', 'cache')
+DEFAULT_MAX_SIZE = 20 * 1024 ** 3  # 20GB
+# 只更新了访问时间时，距上次写入索引超过该间隔 (秒) 才写入
+SAVE_INTERVAL = 60
+
+
+class ArtifactCache:
+    """按内容寻址的下载制品缓存
+
+    目录结构::
+
+        <root>/objects/<sha256 前两位>/<sha256>/<原文件名>   制品内容
+        <root>/downloads/                                   正在下载的文件
+        <root>/index.json                                   索引
+
+    索引按 SHA-256 和 URL 两个键查找，都是字典查询；条目按最近使用顺序保存，
+    超出容量上限时从最久未使用的条目开始淘汰。相同内容只保存一份。
+    命中只在内存中更新访问顺序，随下一次存储、淘汰或 flush() 一起写入索引，
+    或在距上次写入超过 SAVE_INTERVAL 后的命中时写入。
+    """
+
+    INDEX_VERSION = 1
+
+    def __init__(self, root: str = DEFAULT_CACHE_DIR, max_size: int = DEFAULT_MAX_SIZE):
+        """
+        初始化缓存
+
+        Args:
+            root: 缓存目录
+            max_size: 缓存容量上限 (bytes)
+        """
+        self._lock = threading.RLock()
+        self.max_size = max_size
+        self.root = Path(root)
+        self._objects: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self._urls: Dict[str, str] = {}
+        self.total_size = 0
+        self._load()
+
+    # ---- 配置 ----
+
+    def set_root(self, root: str):
+        """切换缓存目录"""
+        with self._lock:
+            if Path(root) == self.root:
+                return
+            self.flush()
+            self.root = Path(root)
+            self._load()
+
+    def set_max_size(self, max_size: int):
+        """修改容量上限并立即淘汰超出部分"""
+        with self._lock:
+            self.max_size = max_size
+            self._evict()
+            self._save()
+
+    @property
+    def index_path(self) -> Path:
+        return self.root / 'index.json'
+
+    def download_path(self, filename: str) -> str:
+        """正在下载的文件的存放位置"""
+        path = self.root / 'downloads'
+        path.mkdir(parents=True, exist_ok=True)
+        return str(path / filename)
+
+    # ---- 查询与存储 ----
+
+    def lookup(self, url: Optional[str] = None, checksum: Optional[str] = None) -> Optional[Path]:
+        """按校验和或 URL 查找缓存，命中时返回制品路径"""
+        with self._lock:
+            digest = self.sha256_of(checksum)
+            if digest is None and url:
+                digest = self._urls.get(url)
+            if digest is None:
+                return None
+            entry = self._objects.get(digest)
+            if entry is None:
+                return None
+            path = self._object_path(digest, entry['name'])
+            if not path.exists() or path.stat().st_size != entry['size']:
+                # 文件被外部删除或改动，清除失效条目
+                self._remove(digest)
+                self._save()
+                return None
+            entry['last_access'] = time.time()
+            self._objects.move_to_end(digest)
+            if url and self._urls.get(url) != digest:
+                # 按校验和命中时记下新的 URL，下次可以直接按 URL 命中
+                entry.setdefault('urls', []).append(url)
+                self._urls[url] = digest
+                self._save()
+            else:
+                # 访问顺序只影响淘汰，不必每次命中都重写索引
+                self._dirty = True
+                if time.time() - self._saved_at >= SAVE_INTERVAL:
+                    self._save()
+            return path
+
+    def store(self, url: Optional[str], path, checksum: Optional[str] = None,
+              etag: Optional[str] = None, last_modified: Optional[str] = None) -> Path:
+        """把下载完成的文件移入缓存，返回缓存中的路径
+
+        checksum 为已校验过的 SHA-256 时直接使用，否则读取文件计算摘要。
+        etag/last_modified 是下载时服务器返回的校验信息，之后按 URL 命中时用来确认远端文件未变。
+        """
+        path = Path(path)
+        digest = self.sha256_of(checksum) or file_digest(path, 'sha256')
+        with self._lock:
+            entry = self._objects.get(digest)
+            if entry is not None and self._object_path(digest, entry['name']).exists():
+                # 内容已存在，丢弃重复文件
+                path.unlink()
+            else:
+                entry = dict(entry or {}, name=path.name, size=path.stat().st_size)
+                target = self._object_path(digest, entry['name'])
+                target.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(path, target)
+                if digest not in self._objects:
+                    self.total_size += entry['size']
+                self._objects[digest] = entry
+            entry['last_access'] = time.time()
+            if url:
+                entry.setdefault('urls', [])
+                if url not in entry['urls']:
+                    entry['urls'].append(url)
+                self._urls[url] = digest
+                entry.setdefault('validators', {})[url] = {
+                    'etag': etag,
+                    'last_modified': last_modified,
+                }
+            self._objects.move_to_end(digest)
+            self._evict(keep=digest)
+            self._save()
+            return self._object_path(digest, entry['name'])
+
+    def flush(self):
+        """写入尚未保存的访问记录"""
+        with self._lock:
+            if self._dirty:
+                self._save()
+
+    def validators(self, url: str) -> Optional[Dict[str, Any]]:
+        """按 URL 缓存的制品在下载时的校验信息 {'etag', 'last_modified', 'size'}"""
+        with self._lock:
+            digest = self._urls.get(url)
+            if digest is None or digest not in self._objects:
+                return None
+            entry = self._objects[digest]
+            validators = entry.get('validators', {}).get(url, {})
+            return {
+                'etag': validators.get('etag'),
+                'last_modified': validators.get('last_modified'),
+                'size': entry['size'],
+            }
+
+    def forget_url(self, url: str):
+        """远端文件已更新时解除 URL 与旧内容的关联，内容本身仍可按校验和命中"""
+        with self._lock:
+            digest = self._urls.pop(url, None)
+            entry = self._objects.get(digest) if digest else None
+            if entry is None:
+                return
+            if url in entry.get('urls', []):
+                entry['urls'].remove(url)
+            entry.get('validators', {}).pop(url, None)
+            self._save()
+
+    def remove(self, digest: str):
+        """删除一个缓存条目"""
+        with self._lock:
+            self._remove(digest)
+            self._save()
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计"""
+        with self._lock:
+            return {
+                'root': str(self.root),
+                'entries': len(self._objects),
+                'total_size': self.total_size,
+                'max_size': self.max_size,
+            }
+
+    # ---- 内部实现 ----
+
+    @staticmethod
+    def sha256_of(checksum: Optional[str]) -> Optional[str]:
+        parsed = parse_checksum(checksum)
+        if parsed and parsed[0] == 'sha256':
+            return parsed[1]
+        return None
+
+    def _object_path(self, digest: str, name: str) -> Path:
+        return self.root / 'objects' / digest[:2] / digest / name
+
+    def _remove(self, digest: str):
+        entry = self._objects.pop(digest, None)
+        if entry is None:
+            return
+        self.total_size -= entry['size']
+        for url in entry.get('urls', []):
+            if self._urls.get(url) == digest:
+                del self._urls[url]
+        shutil.rmtree(self.root / 'objects' / digest[:2] / digest, ignore_errors=True)
+
+    def _evict(self, keep: Optional[str] = None):
+        """按最近最少使用顺序淘汰，直到总大小不超过上限"""
+        for digest in list(self._objects):
+            if self.total_size <= self.max_size:
+                break
+            if digest != keep:
+                print(f"缓存超出上限，淘汰: {self._objects[digest]['name']}")
+                self._remove(digest)
+
+    def _load(self):
+        """读取索引，索引损坏时视为空缓存"""
+        self._objects = OrderedDict()
+        self._urls = {}
+        self.total_size = 0
+        self._dirty = False
+        self._saved_at = time.time()
+        try:
+            if self.index_path.exists():
+                with open(self.index_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('version') == self.INDEX_VERSION:
+                    # 文件中按最近使用顺序保存
+                    for item in data.get('objects', []):
+                        digest = item.pop('sha256')
+                        self._objects[digest] = item
+                        self.total_size += item['size']
+                        for url in item.get('urls', []):
+                            self._urls[url] = digest
+        except Exception as e:
+            print(f"读取缓存索引失败: {e}")
+
+    def _save(self):
+        """原子写入索引"""
+        data = {
+            'version': self.INDEX_VERSION,
+            'objects': [dict(entry, sha256=digest) for digest, entry in self._objects.items()],
+        }
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.index_path.with_name('index.json.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.index_path)
+            self._dirty = False
+            self._saved_at = time.time()
+        except Exception as e:
+            print(f"写入缓存索引失败: {e}")
+
+
+_cache: Optional[ArtifactCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> ArtifactCache:
+    """获取进程内共享的制品缓存"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ArtifactCache()
+            atexit.register(_cache.flush)
+        return _cache
@@ -0,0 +1,109 @@
+import fnmatch
+from typing import Dict, Any, List, Iterable
+
+import yaml
+
+from app.integrity import checksum_from_entry
+
+CONFIG_PATH = 'resource/link_config.yaml'
+
+_GLOB_CHARS = set('*?[')
+
+
+class CatalogEntry:
+    """软件目录中的一个版本"""
+
+    def __init__(self, category: str, name: str, version: str, entry: Dict[str, Any]):
+        self.category = category
+        self.name = name
+        self.version = version
+        self.entry = entry
+        self.url = entry.get('url')
+        self.mirrors = entry.get('mirrors') or []
+        self.checksum = checksum_from_entry(entry)
+
+    @property
+    def key(self) -> str:
+        """'分类/名称/版本'，用于按通配符选择"""
+        return f"{self.category}/{self.name}/{self.version}"
+
+    @property
+    def filename(self) -> str:
+        """下载保存的文件名，与界面下载使用同一个名字"""
+        return save_name(self.name, self.version)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'category': self.category,
+            'name': self.name,
+            'version': self.version,
+            'url': self.url,
+            'mirrors': self.mirrors,
+            'checksum': self.checksum,
+        }
+
+    def __repr__(self):
+        return f"CatalogEntry({self.key!r})"
+
+
+def save_name(name: str, version: str) -> str:
+    return f"{name}_{version}.exe"
+
+
+def load_catalog(path: str = CONFIG_PATH) -> Dict[str, List[Dict[str, Any]]]:
+    """读取软件目录 {分类: [软件, ...]}，不依赖 Qt"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return yaml.safe_load(f) or {}
+
+
+def iter_entries(catalog: Dict[str, List[Dict[str, Any]]]) -> Iterable[CatalogEntry]:
+    """按目录顺序列出所有版本"""
+    for category, softwares in catalog.items():
+        for software in softwares or []:
+            name = str(software.get('name', ''))
+            for version in software.get('versions') or []:
+                yield CatalogEntry(str(category), name, str(version.get('version', '')), version)
+
+
+def _matches(selector: str, entry: CatalogEntry) -> bool:
+    """单个选择条件是否选中 entry (不区分大小写)
+
+    支持的写法：
+        all / *            全部
+        Java / all Java    整个分类
+        OpenJDK            某个软件的所有版本
+        OpenJDK 17         某个软件的指定版本
+        Java/OpenJDK/1*    通配符，对 '分类/名称/版本'、'名称 版本' 和名称匹配
+    """
+    selector = selector.strip().lower()
+    if selector.startswith('all '):
+        selector = selector[4:].strip()
+    if selector in ('all', '*'):
+        return True
+    category, name, version = entry.category.lower(), entry.name.lower(), entry.version.lower()
+    candidates = (entry.key.lower(), f"{name} {version}", name)
+    if _GLOB_CHARS & set(selector):
+        return any(fnmatch.fnmatchcase(candidate, selector) for candidate in candidates)
+    return selector in (category, name, f"{name} {version}")
+
+
+def select(catalog: Dict[str, List[Dict[str, Any]]], selectors: Iterable[str]) -> List[CatalogEntry]:
+    """按选择条件挑出版本，保持目录顺序，没有条件时返回全部"""
+    selectors = [s for s in selectors if s and s.strip()]
+    entries = list(iter_entries(catalog))
+    if not selectors:
+        return entries
+    return [entry for entry in entries if any(_matches(s, entry) for s in selectors)]
+
+
+def unmatched(catalog: Dict[str, List[Dict[str, Any]]], selectors: Iterable[str]) -> List[str]:
+    """没有选中任何版本的选择条件"""
+    entries = list(iter_entries(catalog))
+    return [s for s in selectors if not any(_matches(s, entry) for entry in entries)]
+
+
+def read_selectors(path: str) -> List[str]:
+    """从文件读取选择条件，每行一个，# 开头的行为注释"""
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = (line.strip() for line in f)
+        return [line for line in lines if line and not line.startswith('#')]
@@ -0,0 +1,345 @@
+"""命令行批量下载 (不依赖 Qt，可在没有显示器的构建机上使用)
+
+示例::
+
+    python -m app.cli list Java
+    python -m app.cli download "all Java" "Node.js 18*" -o tools --summary summary.json
+    python -m app.cli download "OpenJDK 17" --jobs 2 --speed-limit 4096
+    python -m app.cli prefetch --speed-limit 1024
+
+下载经过共享的调度器和制品缓存，进度输出到 stderr，结束后把 JSON 摘要写到
+stdout (或 --summary 指定的文件)。全部成功时退出码为 0，有失败时为 1。
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import contextlib
+from pathlib import Path
+from typing import Optional, Dict, Any, List
+
+from app import catalog, metrics, trace, prefetch
+from app.cache import get_cache
+from app.engine import get_engine
+from app.limiter import set_global_speed_limit
+from app.scheduler import DownloadScheduler, DownloadTask
+from app.diskspace import format_size
+
+# 下载过程中输出汇总进度的间隔 (秒)
+STATUS_INTERVAL = 5.0
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_INTERRUPTED = 130
+
+
+def _log(message: str):
+    print(message, file=sys.stderr, flush=True)
+
+
+def _export_file(source: str, target: Path, link: bool = False) -> str:
+    """把缓存中的制品复制到输出目录
+
+    link 为 True 时改用硬链接 (跨磁盘时仍然复制)，不占额外空间，但导出的文件与缓存共用内容，
+    修改它会损坏缓存。缓存按内容去重，制品的文件名可能来自另一个条目，所以由调用方给出目标文件名。
+    """
+    if target.exists():
+        if link and os.path.samefile(source, target):
+            return str(target)
+        target.unlink()
+    if link:
+        try:
+            os.link(source, target)
+            return str(target)
+        except OSError:
+            pass
+    shutil.copy2(source, target)
+    return str(target)
+
+
+def _status_line(tasks: List[DownloadTask]) -> str:
+    snapshots = [task.to_dict() for task in tasks]
+    running = [t for t in snapshots if t['state'] == DownloadTask.RUNNING]
+    finished = sum(t['state'] in (DownloadTask.COMPLETED, DownloadTask.FAILED, DownloadTask.CANCELLED)
+                   for t in snapshots)
+    speed = sum(t['speed'] for t in running)
+    downloaded = sum(t['downloaded'] for t in snapshots)
+    return (f"已结束 {finished}/{len(tasks)}，下载中 {len(running)} 个，"
+            f"已下载 {format_size(downloaded)}，总速度 {format_size(speed)}/s")
+
+
+def run_downloads(entries: List[catalog.CatalogEntry], scheduler: DownloadScheduler,
+                  output_dir: Optional[Path] = None,
+                  status_interval: float = STATUS_INTERVAL,
+                  link: bool = False) -> Dict[str, Any]:
+    """下载选中的版本并等待全部结束，返回摘要
+
+    使用缓存时文件先存入缓存，再复制 (link 为 True 时硬链接) 到 output_dir；
+    不使用缓存时直接下载到 output_dir。
+    按 Ctrl+C 时取消未结束的任务，这些任务在摘要中记为已取消，摘要带 interrupted 标记。
+    """
+    started_at = time.time()
+    if output_dir is not None:
+        output_dir.mkdir(parents=True, exist_ok=True)
+    items = []
+    tasks: List[DownloadTask] = []
+    for entry in entries:
+        item = dict(entry.to_dict(), state=None, path=None, error=None)
+        item['filename'] = entry.filename
+        items.append(item)
+        if not entry.url:
+            item.update(state=DownloadTask.FAILED, error='未找到下载链接')
+            continue
+        if scheduler.cache:
+            save_path = scheduler.cache.download_path(entry.filename)
+        else:
+            save_path = str((output_dir or Path('.')) / entry.filename)
+        task = scheduler.submit(entry.url, save_path, mirrors=entry.mirrors,
+                                name=f"{entry.name} {entry.version}", checksum=entry.checksum,
+                                progress_callback=lambda progress: None)
+        item['task'] = task
+        tasks.append(task)
+
+    interrupted = False
+    try:
+        last_status = time.monotonic()
+        while not all(task.finished for task in tasks):
+            time.sleep(0.2)
+            if time.monotonic() - last_status >= status_interval:
+                last_status = time.monotonic()
+                _log(_status_line(tasks))
+    except KeyboardInterrupt:
+        interrupted = True
+        _log("正在取消未完成的下载...")
+        for task in tasks:
+            scheduler.cancel(task.id)
+        for task in tasks:
+            task.wait(10)
+
+    for item in items:
+        task = item.pop('task', None)
+        if task is None:
+            continue
+        snapshot = task.to_dict()
+        item.update(state=snapshot['state'], error=snapshot['error'],
+                    cache_hit=snapshot['cache_hit'], size=snapshot['total'],
+                    duration=round((task.finished_at or time.time()) - (task.started_at or task.created_at), 3))
+        if task.state == DownloadTask.COMPLETED:
+            path = task.result_path
+            if output_dir is not None and scheduler.cache:
+                try:
+                    path = _export_file(path, output_dir / item['filename'], link)
+                except OSError as e:
+                    item.update(state=DownloadTask.FAILED, error=f"复制到输出目录失败: {e}")
+            item['path'] = os.path.abspath(path)
+            if not item['size'] and os.path.exists(path):
+                item['size'] = os.path.getsize(path)
+        _log(f"[{DownloadTask.STATE_NAMES[item['state']]}] {item['name']} {item['version']}"
+             + (f": {item['error']}" if item['error'] else f" -> {item['path']}"))
+
+    summary = {
+        'started_at': started_at,
+        'duration': round(time.time() - started_at, 3),
+        'total': len(items),
+        'completed': sum(item['state'] == DownloadTask.COMPLETED for item in items),
+        'failed': sum(item['state'] == DownloadTask.FAILED for item in items),
+        'cancelled': sum(item['state'] == DownloadTask.CANCELLED for item in items),
+        'items': items,
+    }
+    if interrupted:
+        summary['interrupted'] = True
+    return summary
+
+
+def _write_json(data: Any, path: Optional[str]):
+    """写到文件 (原子替换) 或 stdout"""
+    text = json.dumps(data, ensure_ascii=False, indent=2)
+    if not path or path == '-':
+        print(text, flush=True)
+        return
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text + '\n')
+    os.replace(tmp_path, path)
+
+
+def _write_metrics(path: str):
+    """.jsonl / .json 结尾时追加 JSON lines，否则写 Prometheus 文本格式"""
+    registry = metrics.get_metrics()
+    if path.endswith(('.jsonl', '.json')):
+        registry.append_json_lines(path)
+    else:
+        registry.write_prometheus(path)
+
+
+def cmd_list(args) -> int:
+    entries = catalog.select(catalog.load_catalog(args.config), args.selectors)
+    if args.json:
+        _write_json([entry.to_dict() for entry in entries], None)
+    else:
+        for entry in entries:
+            print(f"{entry.key}\t{entry.url or ''}")
+    return EXIT_OK
+
+
+def cmd_download(args) -> int:
+    software = catalog.load_catalog(args.config)
+    missing = catalog.unmatched(software, args.selectors)
+    if missing:
+        _log(f"没有匹配的软件: {', '.join(missing)}")
+        return EXIT_USAGE
+    entries = catalog.select(software, args.selectors)
+
+    # 跟踪要在引擎创建会话之前开启
+    if args.trace:
+        trace.enable(args.trace)
+    if args.cache_dir:
+        get_cache().set_root(args.cache_dir)
+    if args.speed_limit:
+        set_global_speed_limit(args.speed_limit * 1024)
+    scheduler = DownloadScheduler(max_concurrent=args.jobs,
+                                  connections_per_download=args.connections,
+                                  max_connections_per_host=max(args.connections, args.connections_per_host),
+                                  cache=False if args.no_cache else None,
+                                  http2=not args.no_http2)
+    output_dir = Path(args.output_dir) if args.output_dir else None
+    if args.no_cache and output_dir is None:
+        output_dir = Path('.')
+
+    _log(f"共 {len(entries)} 个下载，同时下载 {args.jobs} 个")
+    # 下载模块用 print 输出日志，这期间转到 stderr，stdout 只留给摘要
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            try:
+                summary = run_downloads(entries, scheduler, output_dir, link=args.link)
+            finally:
+                if args.trace:
+                    trace.disable()
+                if args.metrics:
+                    _write_metrics(args.metrics)
+                get_engine().shutdown()
+    except KeyboardInterrupt:
+        return EXIT_INTERRUPTED
+
+    _write_json(summary, args.summary)
+    code = EXIT_OK
+    if summary.get('interrupted'):
+        code = EXIT_INTERRUPTED
+    elif summary['completed'] != summary['total']:
+        code = EXIT_FAILED
+    _log(f"完成 {summary['completed']}/{summary['total']}，用时 {summary['duration']:.1f} 秒")
+    return code
+
+
+def cmd_prefetch(args) -> int:
+    software = catalog.load_catalog(args.config)
+    if args.selectors:
+        missing = catalog.unmatched(software, args.selectors)
+        if missing:
+            _log(f"没有匹配的软件: {', '.join(missing)}")
+            return EXIT_USAGE
+        entries = catalog.select(software, args.selectors)
+    else:
+        entries = prefetch.pinned_entries(software, args.pins)
+
+    if args.cache_dir:
+        get_cache().set_root(args.cache_dir)
+    scheduler = DownloadScheduler(max_concurrent=args.jobs, http2=not args.no_http2)
+
+    def on_progress(done, total, entry, record):
+        state = '已缓存' if record['state'] == 'warm' else DownloadTask.STATE_NAMES[record['state']]
+        detail = ('下载' if record.get('fetched') else '已是最新') if record['state'] == 'warm' else record.get('error')
+        _log(f"[{done}/{total}] {state} {entry.key}: {detail}")
+
+    prefetcher = prefetch.Prefetcher(scheduler, speed_limit=args.speed_limit * 1024,
+                                     max_parallel=args.jobs, manifest_path=args.manifest,
+                                     progress_callback=on_progress)
+    _log(f"预取 {len(entries)} 个版本，限速 {args.speed_limit} KB/s")
+    interrupted = False
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            results = prefetcher.run(entries)
+        except KeyboardInterrupt:
+            interrupted = True
+            prefetcher.stop()
+            results = {}
+        finally:
+            get_engine().shutdown()
+
+    warm = [record for record in results.values() if record['state'] == 'warm']
+    summary = {
+        'manifest': str(prefetcher.manifest_path),
+        'total': len(entries),
+        'warm': len(warm),
+        'fetched': sum(bool(record.get('fetched')) for record in warm),
+        'failed': len(results) - len(warm),
+        'entries': results,
+    }
+    _write_json(summary, args.summary)
+    if interrupted:
+        return EXIT_INTERRUPTED
+    return EXIT_OK if summary['failed'] == 0 else EXIT_FAILED
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='python -m app.cli', description='软件目录命令行下载')
+    parser.add_argument('--config', default=catalog.CONFIG_PATH, help='软件目录文件')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    selector_help = ('选择条件：all、分类 (Java / "all Java")、软件名 (OpenJDK)、'
+                     '软件名加版本 ("OpenJDK 17") 或通配符 ("Java/*/1*")')
+
+    list_parser = sub.add_parser('list', help='列出目录中的软件版本')
+    list_parser.add_argument('selectors', nargs='*', help=selector_help)
+    list_parser.add_argument('--json', action='store_true', help='输出 JSON')
+    list_parser.set_defaults(func=cmd_list)
+
+    download = sub.add_parser('download', help='并行下载选中的软件版本')
+    download.add_argument('selectors', nargs='+', help=selector_help)
+    download.add_argument('-o', '--output-dir', help='把下载好的文件放到该目录')
+    download.add_argument('-j', '--jobs', type=int, default=4, help='同时下载数 (默认 4)')
+    download.add_argument('--connections', type=int, default=8, help='单个下载的最大连接数 (默认 8)')
+    download.add_argument('--connections-per-host', type=int, default=16,
+                          help='同一主机的连接总数上限 (默认 16)')
+    download.add_argument('--speed-limit', type=int, default=0, help='总速度限制 (KB/s)，0 表示不限')
+    download.add_argument('--cache-dir', help='制品缓存目录')
+    download.add_argument('--no-cache', action='store_true', help='不使用制品缓存，直接下载到输出目录')
+    download.add_argument('--link', action='store_true',
+                          help='从缓存硬链接到输出目录而不是复制 (不占额外空间，修改导出的文件会损坏缓存)')
+    download.add_argument('--no-http2', action='store_true', help='只使用 HTTP/1.1')
+    download.add_argument('--summary', help='摘要 JSON 的输出文件，默认输出到 stdout')
+    download.add_argument('--metrics', help='结束时写出下载指标 (.prom 为 Prometheus 文本格式，.jsonl 为 JSON lines)')
+    download.add_argument('--trace', help='记录下载时间线 (Chrome trace JSON，可用 Perfetto 打开)')
+    download.set_defaults(func=cmd_download)
+
+    warm = sub.add_parser('prefetch', help='低优先级预取到制品缓存，跳过缓存中已是最新的版本')
+    warm.add_argument('selectors', nargs='*',
+                      help=selector_help + f'；不指定时使用 {prefetch.PINS_PATH} (不存在时为整个目录)')
+    warm.add_argument('--pins', default=prefetch.PINS_PATH, help='固定预取清单，每行一个选择条件')
+    warm.add_argument('-j', '--jobs', type=int, default=1, help='同时预取数 (默认 1)')
+    warm.add_argument('--speed-limit', type=int, default=prefetch.DEFAULT_SPEED_LIMIT // 1024,
+                      help=f'预取的总速度上限 (KB/s，默认 {prefetch.DEFAULT_SPEED_LIMIT // 1024})，0 表示不限')
+    warm.add_argument('--cache-dir', help='制品缓存目录')
+    warm.add_argument('--manifest', help=f'预取清单文件，默认为缓存目录下的 {prefetch.MANIFEST_NAME}')
+    warm.add_argument('--no-http2', action='store_true', help='只使用 HTTP/1.1')
+    warm.add_argument('--summary', help='摘要 JSON 的输出文件，默认输出到 stdout')
+    warm.set_defaults(func=cmd_prefetch)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    try:
+        return args.func(args)
+    except FileNotFoundError as e:
+        _log(f"文件不存在: {e.filename}")
+        return EXIT_USAGE
+    except KeyboardInterrupt:
+        return EXIT_INTERRUPTED
+
+
+if __name__ == '__main__':
+    sys.exit(main())
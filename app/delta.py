@@ -0,0 +1,349 @@
+"""
+块级增量更新 (zsync 方式)
+
+发布方为新文件生成块索引，写入更新清单的 blocks 字段:
+
+    "blocks": {
+        "size": 65536,              块大小
+        "length": 123456789,        文件长度
+        "algorithm": "sha256",      强校验算法
+        "weak": [...],              每块的 rsync 滚动校验和 (32 位整数)
+        "hashes": [...],            每块的强校验摘要
+        "checksum": "sha256:..."    整文件校验和
+    }
+
+客户端用滚动校验和在本地旧文件的任意偏移查找与新文件相同的块 (插入或删除内容
+导致数据整体偏移也能找到)，命中的块从旧文件复制，其余区间按 HTTP Range 下载，
+最后按整文件校验和 (更新清单的 checksum 或索引的 checksum 字段) 确认结果，两者都没有时
+不使用增量。需要下载的数据超过一定比例时不值得增量，由调用方改为完整下载。
+
+生成索引:
+    python -m app.delta index <文件> [--block-size 65536]
+"""
+import os
+import sys
+import json
+import mmap
+import asyncio
+import hashlib
+from itertools import accumulate, count
+from pathlib import Path
+from typing import Optional, Callable, Dict, Any, List, Tuple
+
+from app.engine import get_engine
+from app.integrity import verify_file, parse_checksum
+from app.retry import RetryPolicy
+from app.transport import HTTP11
+from app.writer import FileWriter
+
+DEFAULT_BLOCK_SIZE = 64 * 1024
+# 相邻缺失区间之间的空隙小于该值时合并成一个请求，少发请求比少传几个块更划算
+MERGE_GAP = 256 * 1024
+MAX_CONCURRENT = 8
+MAX_ATTEMPTS = 3
+
+
+def weak_checksum(data: bytes) -> int:
+    """rsync 滚动校验和: 低 16 位为字节和，高 16 位为按位置加权的和"""
+    # 加权和 sum((n - i) * x[i]) 等于各前缀和之和
+    a = sum(data)
+    b = sum(accumulate(data))
+    return (a & 0xffff) | ((b & 0xffff) << 16)
+
+
+def build_index(path, block_size: int = DEFAULT_BLOCK_SIZE,
+                algorithm: str = 'sha256') -> Dict[str, Any]:
+    """为文件生成块索引 (发布更新时使用)"""
+    weak, hashes = [], []
+    whole = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            weak.append(weak_checksum(block))
+            hashes.append(hashlib.new(algorithm, block).hexdigest())
+            whole.update(block)
+    return {
+        'size': block_size,
+        'length': os.path.getsize(path),
+        'algorithm': algorithm,
+        'weak': weak,
+        'hashes': hashes,
+        'checksum': f"{algorithm}:{whole.hexdigest()}",
+    }
+
+
+def index_usable(index: Optional[Dict[str, Any]]) -> bool:
+    """清单中的块索引是否完整可用"""
+    return bool(index and index.get('size') and index.get('length') and index.get('hashes')
+                and len(index.get('weak') or []) == len(index['hashes']))
+
+
+class DeltaPlan:
+    """新文件每个块的来源: 旧文件中的偏移，或 None 表示需要下载"""
+
+    def __init__(self, index: Dict[str, Any]):
+        self.block_size = int(index['size'])
+        self.total_size = int(index['length'])
+        self.algorithm = index.get('algorithm', 'sha256')
+        self.hashes = [h.lower() for h in index['hashes']]
+        self.sources: List[Optional[int]] = [None] * len(self.hashes)
+
+    def block_range(self, index: int) -> Tuple[int, int]:
+        start = index * self.block_size
+        return start, min(start + self.block_size, self.total_size) - 1
+
+    @property
+    def reused_bytes(self) -> int:
+        return sum(self.block_range(i)[1] - self.block_range(i)[0] + 1
+                   for i, source in enumerate(self.sources) if source is not None)
+
+    @property
+    def missing_bytes(self) -> int:
+        return self.total_size - self.reused_bytes
+
+    def missing_ranges(self, merge_gap: int = MERGE_GAP) -> List[Tuple[int, int]]:
+        """需要下载的区间，相邻或间隔很小的块合并成一个请求"""
+        ranges = []
+        for i, source in enumerate(self.sources):
+            if source is not None:
+                continue
+            start, end = self.block_range(i)
+            if ranges and start - ranges[-1][1] - 1 <= merge_gap:
+                ranges[-1] = (ranges[-1][0], end)
+            else:
+                ranges.append((start, end))
+        return ranges
+
+
+def plan_delta(seed_path, index: Dict[str, Any], max_ratio: float = 1.0) -> DeltaPlan:
+    """在旧文件中查找新文件已有的块
+
+    逐字节滚动查找较慢，旧文件剩余部分即使全部命中也无法使需要下载的比例
+    降到 max_ratio 以内时提前结束。
+    """
+    plan = DeltaPlan(index)
+    size = plan.block_size
+    # 只有完整大小的块参与滚动查找，长度不足的末块单独比对
+    wanted: Dict[int, List[int]] = {}
+    for i, weak in enumerate(index['weak']):
+        if plan.block_range(i)[1] - plan.block_range(i)[0] + 1 == size:
+            wanted.setdefault(int(weak), []).append(i)
+
+    with open(seed_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return plan
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            with memoryview(data) as view:
+                _scan(view, plan, wanted, plan.total_size * (1 - max_ratio))
+            _match_tail(data, plan)
+    return plan
+
+
+def _strong(plan: DeltaPlan, data) -> str:
+    return hashlib.new(plan.algorithm, data).hexdigest()
+
+
+def _scan(view: memoryview, plan: DeltaPlan, wanted: Dict[int, List[int]], min_reuse: float):
+    """滚动校验和扫描旧文件，命中一块后跳过整块继续"""
+    size = plan.block_size
+    length = len(view)
+    reused = 0
+    pos = 0
+    while wanted and pos + size <= length:
+        # 窗口起点超过 stop 后，剩余部分即使全部命中也达不到 min_reuse
+        stop = int(length + reused - min_reuse)
+        if pos > stop:
+            return
+        last = min(length - size, stop)
+        a = sum(view[pos:pos + size]) & 0xffff
+        b = sum(accumulate(view[pos:pos + size])) & 0xffff
+        # 依次检查到 last 为止的每个窗口，未命中时滚动到下一个字节；last 处的窗口单独检查
+        windows = zip(count(pos), view[pos:last], view[pos + size:last + size])
+        for pos, out, new in windows:
+            if (a | (b << 16)) in wanted and _take(view, plan, wanted, pos, a | (b << 16)):
+                break
+            a = (a - out + new) & 0xffff
+            b = (b - size * out + a) & 0xffff
+        else:
+            # 已到旧文件末尾或提前结束的位置
+            pos = last
+            if not ((a | (b << 16)) in wanted and _take(view, plan, wanted, pos, a | (b << 16))):
+                return
+        reused += size
+        pos += size
+
+
+def _take(view: memoryview, plan: DeltaPlan, wanted: Dict[int, List[int]], pos: int, weak: int) -> bool:
+    """弱校验命中后比对强校验，确认的块记录来源并不再查找"""
+    strong = _strong(plan, view[pos:pos + plan.block_size])
+    candidates = wanted[weak]
+    matched = [i for i in candidates if plan.hashes[i] == strong]
+    for i in matched:
+        plan.sources[i] = pos
+        candidates.remove(i)
+    if not candidates:
+        del wanted[weak]
+    return bool(matched)
+
+
+def _match_tail(data, plan: DeltaPlan):
+    """长度不足一块的末块：比对旧文件相同位置和旧文件末尾"""
+    last = len(plan.hashes) - 1
+    if last < 0 or plan.sources[last] is not None:
+        return
+    start, end = plan.block_range(last)
+    length = end - start + 1
+    for offset in (start, len(data) - length):
+        if 0 <= offset and offset + length <= len(data) and \
+                _strong(plan, data[offset:offset + length]) == plan.hashes[last]:
+            plan.sources[last] = offset
+            return
+
+
+async def _fetch(url: str, plan: DeltaPlan, ranges: List[Tuple[int, int]], writer: FileWriter,
+                 proxy: Optional[str], timeout: float, on_bytes: Callable[[int], None],
+                 should_stop: Callable[[], bool]):
+    """并发下载缺失的区间并写入新文件，每块按强校验确认"""
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT)
+    policy = RetryPolicy()
+
+    async def fetch_range(start: int, end: int):
+        async with semaphore:
+            for attempt in range(1, MAX_ATTEMPTS + 1):
+                if should_stop():
+                    raise Exception("下载已取消")
+                try:
+                    headers = {'Range': f'bytes={start}-{end}'}
+                    async with HTTP11.get(url, headers, proxy, timeout) as response:
+                        response.raise_for_status()
+                        if response.status != 206:
+                            raise Exception(f"服务器不支持分段下载 (HTTP {response.status})")
+                        body = bytearray()
+                        async for chunk in response.iter_chunks(plan.block_size):
+                            body += chunk
+                            on_bytes(len(chunk))
+                            if should_stop():
+                                raise Exception("下载已取消")
+                    if len(body) != end - start + 1:
+                        raise Exception("分段数据不完整")
+                    _check_blocks(plan, start, body)
+                    writer.write(start, bytes(body))
+                    return
+                except Exception as e:
+                    if should_stop() or attempt == MAX_ATTEMPTS:
+                        raise
+                    print(f"增量更新下载区间 {start}-{end} 失败，重试: {e}")
+                    await asyncio.sleep(policy.delay(attempt, getattr(e, 'retry_after', None)))
+
+    await asyncio.gather(*(fetch_range(start, end) for start, end in ranges))
+
+
+def _check_blocks(plan: DeltaPlan, start: int, body: bytes):
+    """下载区间内的每一块都必须与索引一致
+
+    合并进来的已有块也要检查：整个区间会写入新文件，覆盖从旧文件复制的内容。
+    """
+    first = start // plan.block_size
+    for i in range(first, first + (len(body) + plan.block_size - 1) // plan.block_size):
+        block_start, block_end = plan.block_range(i)
+        data = body[block_start - start:block_end - start + 1]
+        if _strong(plan, data) != plan.hashes[i]:
+            raise Exception(f"块 {i} 校验失败")
+
+
+def apply_delta(url: str, seed_path, index: Dict[str, Any], save_path,
+                checksum: Optional[str] = None,
+                max_ratio: float = 0.7,
+                proxy: Optional[str] = None,
+                timeout: float = 30,
+                progress_callback: Optional[Callable[[int], None]] = None,
+                should_stop: Optional[Callable[[], bool]] = None) -> bool:
+    """
+    用旧文件和块索引重建新文件
+
+    Args:
+        url: 新文件的下载地址 (需支持 Range 请求)
+        seed_path: 本地旧文件
+        index: 新文件的块索引
+        save_path: 新文件保存路径
+        checksum: 新文件的整文件校验和，重建后确认，默认使用索引中的 checksum
+        max_ratio: 需要下载的数据超过文件大小的该比例时放弃增量
+        proxy: 代理地址
+        timeout: 连接和读取超时 (秒)
+        progress_callback: 进度回调，参数为进度百分比
+        should_stop: 返回 True 时中止 (如用户取消)
+
+    Returns:
+        是否已通过增量方式得到新文件；返回 False 时调用方应完整下载
+    """
+    should_stop = should_stop or (lambda: False)
+    if not index_usable(index) or not Path(seed_path).is_file():
+        return False
+    # 复用的块和合并下载的区间都要由整文件校验和最终确认，没有时完整下载
+    checksum = checksum or index.get('checksum')
+    if parse_checksum(checksum) is None:
+        print("增量更新缺少整文件校验和，改为完整下载")
+        return False
+
+    plan = plan_delta(seed_path, index, max_ratio)
+    total = plan.total_size
+    missing = plan.missing_bytes
+    print(f"增量更新: 可复用 {plan.reused_bytes} 字节，需下载 {missing} 字节")
+    if missing > total * max_ratio:
+        return False
+
+    save_path = Path(save_path)
+    tmp_path = save_path.with_name(save_path.name + '.delta')
+    done = [plan.reused_bytes]
+
+    def on_bytes(nbytes: int):
+        done[0] += nbytes
+        if progress_callback and total:
+            progress_callback(min(100, int(done[0] * 100 / total)))
+
+    writer = FileWriter(tmp_path, coalesce_size=1024 * 1024)
+    try:
+        writer.preallocate(total)
+        # 复用的块从旧文件复制
+        with open(seed_path, 'rb') as seed:
+            for i, source in enumerate(plan.sources):
+                if source is None:
+                    continue
+                start, end = plan.block_range(i)
+                seed.seek(source)
+                writer.write(start, seed.read(end - start + 1))
+        on_bytes(0)
+        ranges = plan.missing_ranges()
+        if ranges:
+            get_engine().run(_fetch(url, plan, ranges, writer, proxy, timeout, on_bytes, should_stop))
+        writer.close()
+        if not verify_file(tmp_path, checksum):
+            raise Exception("增量更新结果与校验和不一致")
+        os.replace(tmp_path, save_path)
+    except BaseException:
+        writer.close()
+        tmp_path.unlink(missing_ok=True)
+        raise
+    if progress_callback:
+        progress_callback(100)
+    return True
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='生成增量更新的块索引')
+    sub = parser.add_subparsers(dest='command', required=True)
+    index_parser = sub.add_parser('index', help='为文件生成块索引 (JSON)，写入更新清单的 blocks 字段')
+    index_parser.add_argument('path')
+    index_parser.add_argument('--block-size', type=int, default=DEFAULT_BLOCK_SIZE)
+    index_parser.add_argument('--algorithm', default='sha256')
+    args = parser.parse_args(argv)
+    if args.command == 'index':
+        json.dump(build_index(args.path, args.block_size, args.algorithm), sys.stdout)
+        print()
+
+
+if __name__ == '__main__':
+    main()
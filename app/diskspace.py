@@ -0,0 +1,47 @@
+import os
+import shutil
+from pathlib import Path
+from typing import Optional
+
+
+def _existing(path) -> Path:
+    """路径本身或最近一级已存在的父目录 (文件可能还没创建)"""
+    path = Path(path).absolute()
+    while not path.exists() and path != path.parent:
+        path = path.parent
+    return path
+
+
+def free_space(path) -> int:
+    """path 所在磁盘的可用空间 (bytes)"""
+    return shutil.disk_usage(_existing(path)).free
+
+
+def device_of(path) -> Optional[int]:
+    """path 所在设备的标识，同一设备上的下载共享可用空间"""
+    try:
+        return os.stat(_existing(path)).st_dev
+    except OSError:
+        return None
+
+
+def allocated_size(path) -> int:
+    """文件已实际占用的磁盘空间 (bytes)，稀疏文件中的空洞不计入"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return 0
+    blocks = getattr(stat, 'st_blocks', None)
+    if blocks is None:
+        # Windows 没有 st_blocks，文件长度即占用空间
+        return stat.st_size
+    return min(stat.st_size, blocks * 512)
+
+
+def format_size(size: float) -> str:
+    """格式化字节数"""
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
@@ -1,16 +1,30 @@
-import os
 import asyncio
 import aiohttp
-import aiofiles
 import threading
 import time
 import urllib.request
 import platform
+import contextlib
 from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional, Callable, Dict, Any, Union
+from urllib.parse import urlparse
+from typing import Optional, Callable, Dict, Any, Union, List
 import httpx
 from tqdm import tqdm
+from app.journal import DownloadJournal, Segment
+from app.mirrors import Mirror, MirrorPool, validators_agree
+from app.limiter import TokenBucket, get_global_limiter, throttle
+from app.engine import get_engine
+from app.integrity import IntegrityChecker, verify_file, parse_checksum, file_digest
+from app.probe import get_probe_cache
+from app.autotune import AutoTuner, get_host_profiles
+from app.writer import FileWriter
+from app.progress import ProgressStream, ProgressEvent
+from app.stats import RateMeter, LatencyStats
+from app.transport import HTTP11, select_transport
+from app.retry import RetryPolicy, RetryBudget, retry_cause
+from app import metrics, trace
+from app.diskspace import allocated_size
 
 class Downloader:
     """高级多线程下载器，支持断点续传、进度监控、速度限制等功能"""
@@ -20,10 +34,22 @@ class Downloader:
                  chunk_size: int = 1024 * 1024,  # 1MB
                  timeout: int = 30,
                  max_retries: int = 3,
+                 min_split_size: int = 1024 * 1024,  # 1MB
                  speed_limit: Optional[int] = None,  # bytes per second
+                 limiter: Optional[TokenBucket] = None,
                  progress_callback: Optional[Callable] = None,
                  proxy: Optional[Union[str, Dict[str, str]]] = None,
-                 use_system_proxy: bool = True):
+                 use_system_proxy: bool = True,
+                 mirrors: Optional[List[str]] = None,
+                 checksum: Optional[str] = None,
+                 blocks: Optional[Dict[str, Any]] = None,
+                 compute_digest: Optional[str] = None,
+                 auto_tune: bool = False,
+                 write_coalesce: int = 1024 * 1024,
+                 progress_interval: float = 0.2,
+                 http2: bool = False,
+                 retry_budget: Optional[int] = None,
+                 retry_backoff: float = 0.5):
         """
         初始化下载器
         
@@ -33,11 +59,23 @@ class Downloader:
             max_workers: 最大并发数
             chunk_size: 块大小
             timeout: 超时时间
-            max_retries: 最大重试次数
-            speed_limit: 速度限制 (bytes/s)
-            progress_callback: 进度回调函数
+            max_retries: 同一分段没有任何进展时的最大连续尝试次数
+            min_split_size: 空闲连接拆分其他分段时，拆出部分的最小字节数
+            speed_limit: 本下载的速度限制 (bytes/s)，同时受全局限速器约束
+            limiter: 与其他下载共享的限速器 (如所有预取下载共用一个)，同时生效
+            progress_callback: 进度回调函数，参数为进度百分比，按 progress_interval 的频率调用
             proxy: 代理设置 (字符串或字典格式)
             use_system_proxy: 是否使用系统代理
+            mirrors: 备用镜像地址列表，内容与主地址一致时并行从多个镜像下载
+            checksum: 整文件校验和 ('sha256:<hex>' 或裸摘要)，下载过程中边写边算
+            blocks: 块哈希 {'size', 'algorithm', 'hashes'}，校验失败时只重新下载出错的块
+            compute_digest: 没有校验和时也边下载边计算摘要的算法 (如 'sha256')，结果保存在 digest
+            auto_tune: 按实测吞吐量自动调整连接数 (max_workers 为上限) 和块大小，结果按主机保存
+            write_coalesce: 同一分段的连续数据累计到该大小后再写入文件，0 表示每块直接写入
+            progress_interval: 进度事件的间隔 (秒)，事件通过 events 订阅
+            http2: 服务器支持 HTTP/2 时所有分段作为流复用一个连接，不支持时使用 HTTP/1.1
+            retry_budget: 整个下载共享的重试次数，收到数据后逐步返还，默认 max_retries * max_workers
+            retry_backoff: 指数退避的初始等待上限 (秒)，服务器返回 Retry-After 时以其为准
         """
         self.url = url
         self.save_path = Path(save_path)
@@ -45,10 +83,30 @@ class Downloader:
         self.chunk_size = chunk_size
         self.timeout = timeout
         self.max_retries = max_retries
+        self.min_split_size = max(1, min_split_size)
         self.speed_limit = speed_limit
+        self._limiter = TokenBucket(speed_limit)
+        self._shared_limiter = limiter
         self.progress_callback = progress_callback
+        self.events = ProgressStream(progress_interval)
+        self.events.subscribe(self._relay_progress)
         self.proxy = proxy
         self.use_system_proxy = use_system_proxy
+        self.mirrors = [m for m in (mirrors or []) if m and m != url]
+        self.checksum = checksum
+        self.blocks = blocks
+        self.compute_digest = compute_digest
+        self.digest = None
+        self.auto_tune = auto_tune
+        self._tuner: Optional[AutoTuner] = None
+        self._live_workers = 0
+        self.write_coalesce = write_coalesce
+        self._writer: Optional[FileWriter] = None
+        self.http2 = http2
+        self._transports: Dict[str, Any] = {}  # 镜像地址 -> 传输方式
+        self.retry_budget = retry_budget
+        self._retry_policy = RetryPolicy(retry_backoff)
+        self._retry_budget = self._new_retry_budget()
         
         # 状态控制
         self._is_running = False
@@ -61,8 +119,27 @@ class Downloader:
         self.downloaded_size = 0
         self.download_speed = 0
         self.start_time = 0
+        # 本次实际收到的数据的吞吐量统计，续传前已下载的部分不计入
+        self._meter = RateMeter()
+        self._segment_meters: Dict[Segment, RateMeter] = {}
+        self._segment_sources: Dict[Segment, str] = {}
+        self._ttfb = LatencyStats()
         self.ranges = []
+        self.segments = []
+        self._active_segments = set()
         self.support_range = True
+        self.etag = None
+        self.last_modified = None
+        self.mirror_pool = MirrorPool([Mirror(url)])
+        
+        # 分段续传日志
+        self._journal = DownloadJournal(self.save_path)
+        self._journal_enabled = False
+        self._checkpointing = False
+        
+        # 完整性校验
+        self._checker: Optional[IntegrityChecker] = None
+        self._catch_up_future = None
         
         # 线程安全
         self._lock = threading.Lock()
@@ -72,6 +149,11 @@ class Downloader:
         # 进度条
         self.progress_bar = None
         
+        # 时间线跟踪，未开启时为 None
+        self._tracer = trace.active()
+        self._trace_tid = self._tracer.track(self.save_path.name) if self._tracer else 0
+        self._trace_tracks: Dict[int, int] = {}
+        
         # 代理配置
         self.proxy_config = self._setup_proxy()
         
@@ -147,25 +229,23 @@ class Downloader:
         
         return None
 
+    def _proxy_for(self, url: str) -> Optional[str]:
+        """按协议选择代理地址"""
+        if not self.proxy_config:
+            return None
+        scheme = 'https' if url.lower().startswith('https') else 'http'
+        return self.proxy_config.get(scheme) or self.proxy_config.get('http')
+
+    def _client_timeout(self) -> aiohttp.ClientTimeout:
+        """单次请求超时：限制连接和读取间隔，不限制大分段的总耗时"""
+        return aiohttp.ClientTimeout(total=None, connect=self.timeout, sock_read=self.timeout)
+
     def _init_download(self):
         """初始化下载信息"""
         try:
-            # 获取文件信息
-            client_kwargs = {'timeout': self.timeout}
-            if self.proxy_config:
-                client_kwargs['proxies'] = self.proxy_config
-                
-            with httpx.Client(**client_kwargs) as client:
-                response = client.head(self.url, follow_redirects=True)
-                response.raise_for_status()
-                
-                self.total_size = int(response.headers.get('content-length', 0))
-                accept_ranges = response.headers.get('accept-ranges', '').lower()
-                
-                if 'bytes' not in accept_ranges or self.total_size == 0:
-                    self.support_range = False
-                    self.max_workers = 1
-                    
+            # 获取文件信息，与下载共用引擎的连接池
+            with self._trace_span('probe', url=self.url):
+                get_engine().run(self._probe())
         except Exception as e:
             print(f"获取文件信息失败: {e}")
             self.support_range = False
@@ -177,10 +257,82 @@ class Downloader:
         # 检查已下载部分
         self._check_existing_file()
 
+    async def _probe(self):
+        """HEAD 探测文件大小、分段支持和校验信息"""
+        # TTL 内复用上次的探测结果，过期后发条件请求，文件未变时只需一次 304
+        probe = await get_probe_cache().probe(self.url, proxy=self._proxy_for(self.url),
+                                              timeout=self.timeout)
+        
+        self.total_size = probe.total_size
+        self.etag = probe.etag
+        self.last_modified = probe.last_modified
+        
+        if not probe.accept_ranges or self.total_size == 0:
+            self.support_range = False
+            self.max_workers = 1
+            
+        self.mirror_pool = MirrorPool(await self._probe_mirrors())
+        
+        # 按镜像协商传输协议
+        if self.http2 and self.support_range:
+            for mirror in self.mirror_pool.mirrors:
+                self._transports[mirror.url] = await select_transport(
+                    mirror.url, self._proxy_for(mirror.url), self.timeout)
+
+    async def _probe_mirrors(self) -> List[Mirror]:
+        """探测备用镜像，只保留与主地址内容一致的镜像"""
+        primary = Mirror(self.url, self.etag, self.last_modified)
+        mirrors = [primary]
+        if not self.support_range:
+            return mirrors
+            
+        for url in self.mirrors:
+            try:
+                probe = await get_probe_cache().probe(url, proxy=self._proxy_for(url),
+                                                      timeout=self.timeout)
+                if probe.total_size != self.total_size or not probe.accept_ranges:
+                    print(f"镜像文件大小不一致或不支持分段下载，已忽略: {url}")
+                    continue
+                    
+                mirror = Mirror(url, probe.etag, probe.last_modified)
+                # 不同服务器的校验信息通常不同，此时抽样比对实际内容
+                if not validators_agree(primary, mirror) and not await self._sample_matches(mirror):
+                    print(f"镜像内容与主地址不一致，已忽略: {url}")
+                    continue
+                mirrors.append(mirror)
+            except Exception as e:
+                print(f"探测镜像失败 {url}: {e}")
+                
+        return mirrors
+
+    async def _fetch_range(self, url: str, start: int, end: int) -> Optional[bytes]:
+        """读取一小段内容，服务器未返回 206 时返回 None"""
+        session = await get_engine().get_session()
+        headers = {'Range': f'bytes={start}-{end}'}
+        async with session.get(url, headers=headers, proxy=self._proxy_for(url),
+                               timeout=self._client_timeout()) as response:
+            if response.status != 206:
+                return None
+            return await response.read()
+
+    async def _sample_matches(self, mirror: Mirror, sample_size: int = 4096) -> bool:
+        """抽样比对主地址与镜像的文件首尾内容"""
+        size = min(sample_size, self.total_size)
+        for start in sorted({0, self.total_size - size}):
+            end = start + size - 1
+            expected = await self._fetch_range(self.url, start, end)
+            actual = await self._fetch_range(mirror.url, start, end)
+            if expected is None or expected != actual:
+                return False
+        return True
+
     def _calculate_ranges(self):
         """计算下载范围"""
         if not self.support_range or self.total_size == 0:
             self.ranges = [(0, self.total_size - 1 if self.total_size > 0 else 0)]
+            # 长度未知时一直读到流结束
+            end = self.total_size - 1 if self.total_size > 0 else None
+            self.segments = [Segment(0, end)]
             return
             
         chunk_size = self.total_size // self.max_workers
@@ -193,85 +345,478 @@ class Downloader:
             else:
                 end = start + chunk_size - 1
             self.ranges.append((start, end))
+        self.segments = [Segment(start, end) for start, end in self.ranges]
 
     def _check_existing_file(self):
         """检查已存在的文件"""
-        if self.save_path.exists():
-            existing_size = self.save_path.stat().st_size
-            if existing_size == self.total_size:
+        if not self.save_path.exists():
+            # 没有数据文件时遗留的日志没有意义
+            self._journal.remove()
+            return
+            
+        existing_size = self.save_path.stat().st_size
+        has_journal = self._journal.load()
+        
+        if has_journal:
+            if (existing_size == self.total_size and
+                    self._journal.completed(self.url, self.total_size, self.etag, self.last_modified)):
+                # 上次已下载完成，日志保留为完成标记
+                self.segments = self._journal.segments
                 self.downloaded_size = self.total_size
                 self._download_complete = True
-            elif existing_size < self.total_size and self.support_range:
-                self.downloaded_size = existing_size
-            else:
-                # 文件大小不匹配，重新下载
-                self.save_path.unlink()
-                self.downloaded_size = 0
-
-    async def _download_chunk(self, session: aiohttp.ClientSession, 
-                            start: int, end: int, 
-                            chunk_id: int) -> bool:
-        """下载单个块"""
+                return
+            if (self.support_range and existing_size == self.total_size and
+                    self._journal.matches(self.url, self.total_size, self.etag, self.last_modified)):
+                # 按日志恢复每个分段的写入位置
+                self.segments = self._journal.segments
+                self.downloaded_size = sum(s.written for s in self.segments)
+                return
+        elif existing_size == self.total_size and self.total_size > 0 and parse_checksum(self.checksum):
+            # 没有日志且大小一致：文件已预分配到完整大小，只有校验和通过才能视为已下载完成
+            if verify_file(self.save_path, self.checksum):
+                self.downloaded_size = self.total_size
+                self._download_complete = True
+                return
+            print(f"已有文件校验失败，重新下载: {self.save_path}")
+            
+        # 日志缺失或与服务器文件不一致，重新下载
+        self.save_path.unlink()
+        self._journal.remove()
+        self.downloaded_size = 0
+
+    def required_space(self) -> int:
+        """完成下载还需要占用的磁盘空间 (bytes)，文件大小未知时返回 0
+
+        已预分配或已写入的部分不再计入。
+        """
+        if self.total_size <= 0 or self._download_complete:
+            return 0
+        return max(0, self.total_size - allocated_size(self.save_path))
+
+    def _range_headers(self, segment: Segment, mirror: Mirror) -> Dict[str, str]:
+        """构造分段请求头"""
         headers = {}
         if self.support_range:
-            headers['Range'] = f'bytes={start}-{end}'
-            
-        retries = 0
-        while retries < self.max_retries:
+            headers['Range'] = f'bytes={segment.offset}-{segment.end}'
+            # 远端文件变更时服务器会返回完整内容而不是 206
+            validator = mirror.etag or mirror.last_modified
+            if validator:
+                headers['If-Range'] = validator
+        return headers
+
+    def _transport_for(self, url: str):
+        """镜像使用的传输方式，默认 HTTP/1.1"""
+        return self._transports.get(url, HTTP11)
+
+    @property
+    def multiplexed(self) -> bool:
+        """主地址是否使用 HTTP/2 复用连接 (所有分段只占一个连接)"""
+        return self._transport_for(self.url).multiplexed
+
+    def _new_retry_budget(self) -> RetryBudget:
+        tokens = self.retry_budget
+        if tokens is None:
+            tokens = self.max_retries * max(1, self.max_workers)
+        return RetryBudget(tokens)
+
+    async def _backoff(self, delay: float):
+        """重试前等待，取消下载时立即返回"""
+        deadline = time.monotonic() + delay
+        while not self._is_cancelled:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(min(remaining, 0.1))
+
+    def _trace_span(self, name: str, **args):
+        """下载轨道上的跟踪区间，未开启跟踪时什么也不做"""
+        if self._tracer is None:
+            return contextlib.nullcontext()
+        return self._tracer.span(name, self._trace_tid, **args)
+
+    def _worker_track(self, worker_id: int) -> Optional[int]:
+        """连接的跟踪轨道，未开启跟踪时为 None"""
+        if self._tracer is None:
+            return None
+        tid = self._trace_tracks.get(worker_id)
+        if tid is None:
+            tid = self._trace_tracks[worker_id] = self._tracer.track(
+                f"{self.save_path.name} 连接 {worker_id}")
+        return tid
+
+    async def _download_chunk(self, segment: Segment, chunk_id: int) -> bool:
+        """下载单个块，连接中断后从分段已写入的位置继续"""
+        failures = 0  # 没有任何进展的连续失败次数
+        tracer = self._tracer
+        tid = self._worker_track(chunk_id)
+        while not self._is_cancelled:
+            # 每次发起请求前检查：自动调优减少了连接数时 (如重试退避期间)，多余的连接让出分段，
+            # 不再为它打开新的连接
+            if self._over_connection_limit():
+                return True
+            if not self.support_range and segment.written:
+                # 不支持断点续传时只能从头下载
+                with self._lock:
+                    self.downloaded_size -= segment.written
+                segment.offset = segment.start
+            resume_from = segment.offset
+            delay = None
+            mirror = self.mirror_pool.acquire()
+            headers = self._range_headers(segment, mirror)
+            host = urlparse(mirror.url).netloc.lower()
+            received = 0
+            status = None
+            request_time = time.monotonic()
+            metrics.ACTIVE_CONNECTIONS.inc(1, host)
             try:
-                async with session.get(self.url, headers=headers) as response:
+                transport = self._transport_for(mirror.url)
+                async with transport.get(mirror.url, headers, self._proxy_for(mirror.url),
+                                         self.timeout, tid) as response:
+                    status = response.status
+                    if self._tuner:
+                        self._tuner.record_rtt(time.monotonic() - request_time)
                     response.raise_for_status()
+                    if self.support_range and response.status != 206:
+                        # 缓存的探测结果已过时，下次重新探测
+                        get_probe_cache().invalidate(mirror.url)
+                        raise Exception(f"服务器未返回分段内容 (HTTP {response.status})，文件可能已变更")
                     
-                    # 打开文件进行写入
-                    async with aiofiles.open(self.save_path, 'r+b') as f:
-                        await f.seek(start)
+                    meter = self._segment_meters.setdefault(segment, RateMeter())
+                    self._segment_sources[segment] = mirror.url
+                    first_chunk = True
+                    last_time = time.monotonic()
+                    async for chunk in response.iter_chunks(self.chunk_size):
+                        # 只统计等待网络数据的时间，用于镜像评分
+                        now = time.monotonic()
+                        mirror.record_bytes(len(chunk), now - last_time)
+                        if first_chunk:
+                            first_chunk = False
+                            self._ttfb.record(now - request_time)
+                            mirror.record_ttfb(now - request_time)
+                            metrics.TTFB_SECONDS.observe(now - request_time, host)
+                            if tracer is not None:
+                                tracer.complete('first byte', request_time, now, tid,
+                                                status=response.status)
                         
-                        async for chunk in response.content.iter_chunked(self.chunk_size):
-                            # 检查暂停和停止状态
-                            if self._is_cancelled:
-                                return False
-                                
-                            while self._is_paused and not self._is_cancelled:
-                                await asyncio.sleep(0.1)
-                                
-                            if self._is_cancelled:
-                                return False
-                                
-                            # 写入数据
-                            await f.write(chunk)
+                        # 检查暂停和停止状态
+                        if self._is_cancelled:
+                            return False
                             
-                            # 更新进度
-                            with self._lock:
-                                self.downloaded_size += len(chunk)
-                                
-                            # 速度限制
-                            if self.speed_limit:
-                                await asyncio.sleep(len(chunk) / self.speed_limit)
-                                
-                            # 更新进度回调
-                            if self.progress_callback:
-                                self.progress_callback(self.get_progress())
+                        while self._is_paused and not self._is_cancelled:
+                            await asyncio.sleep(0.1)
+                            
+                        if self._is_cancelled:
+                            return False
+                            
+                        # 分段可能已被空闲连接拆走后半部分，只写到当前结束位置
+                        if segment.end is not None:
+                            limit = segment.end - segment.offset + 1
+                            if limit <= 0:
+                                break
+                            if len(chunk) > limit:
+                                chunk = chunk[:limit]
                                 
+                        # 按偏移直接写入，校验器在数据真正写出后收到回调
+                        if tracer is not None:
+                            with tracer.span('write', tid, offset=segment.offset, size=len(chunk)):
+                                self._writer.write(segment.offset, chunk)
+                        else:
+                            self._writer.write(segment.offset, chunk)
+                        segment.offset += len(chunk)
+                        received += len(chunk)
+                        
+                        # 更新进度
+                        with self._lock:
+                            self.downloaded_size += len(chunk)
+                        self._meter.add(len(chunk), now)
+                        meter.add(len(chunk), now)
+                        self._retry_budget.deposit(len(chunk))
+                            
+                        # 定期记录分段进度，数据先于日志落盘
+                        if self._journal_enabled and self._journal.due() and not self._checkpointing:
+                            await self._checkpoint()
+                            
+                        # 速度限制
+                        if tracer is not None:
+                            throttle_start = time.monotonic()
+                            if await throttle(len(chunk), get_global_limiter(), self._limiter,
+                                              self._shared_limiter):
+                                tracer.complete('throttle', throttle_start, tid=tid)
+                        else:
+                            await throttle(len(chunk), get_global_limiter(), self._limiter,
+                                           self._shared_limiter)
+                            
+                        if segment.done:
+                            break
+                            
+                        # 镜像明显变慢或被停用时让出分段，由其他镜像继续下载
+                        if self.mirror_pool.should_leave(mirror):
+                            return True
+                            
+                        # 自动调优减少了连接数，多余的连接让出分段后退出
+                        if self._over_connection_limit():
+                            return True
+                            
+                        last_time = time.monotonic()
+                            
+                if segment.end is None:
+                    # 长度未知的流读到结束即完成
+                    segment.end = segment.offset - 1
+                elif not segment.done:
+                    raise Exception("连接提前关闭，分段数据不完整")
                 return True
                 
             except Exception as e:
-                retries += 1
-                print(f"块 {chunk_id} 下载失败 (重试 {retries}/{self.max_retries}): {e}")
-                if retries < self.max_retries:
-                    await asyncio.sleep(1)
+                self.mirror_pool.report_error(mirror)
+                metrics.RETRIES.inc(1, host, retry_cause(e))
+                # 本次连接收到过数据就不算连续失败，下次从新的位置继续
+                failures = 1 if segment.offset > resume_from else failures + 1
+                if failures >= self.max_retries:
+                    print(f"块 {chunk_id} 下载失败 (连续失败 {failures} 次): {e}")
+                    return False
+                if not self._retry_budget.acquire():
+                    print(f"块 {chunk_id} 下载失败 (重试次数已用完): {e}")
+                    return False
+                delay = self._retry_policy.delay(failures, getattr(e, 'retry_after', None))
+                print(f"块 {chunk_id} 下载失败，{delay:.1f} 秒后从 {segment.offset} 继续: {e}")
+                if tracer is not None:
+                    tracer.instant('retry', tid, cause=retry_cause(e), error=str(e),
+                                   failures=failures)
+            finally:
+                self.mirror_pool.release(mirror)
+                # 按请求汇总后再更新指标，不在每个数据块上加锁
+                metrics.ACTIVE_CONNECTIONS.dec(1, host)
+                metrics.BYTES_DOWNLOADED.inc(received, host)
+                metrics.SEGMENT_SECONDS.observe(time.monotonic() - request_time, host)
+                if tracer is not None:
+                    tracer.complete('range', request_time, tid=tid, host=host, status=status,
+                                    offset=resume_from, last_byte=segment.end, bytes=received)
+                
+            if tracer is not None and delay:
+                with tracer.span('backoff', tid, delay=round(delay, 3)):
+                    await self._backoff(delay)
+            else:
+                await self._backoff(delay)
                     
         return False
 
+    def _next_segment(self) -> Optional[Segment]:
+        """为空闲连接分配分段：优先领取无人负责的分段，否则拆分剩余最多的活动分段"""
+        for segment in self.segments:
+            if not segment.done and segment not in self._active_segments:
+                self._active_segments.add(segment)
+                return segment
+                
+        if not self.support_range:
+            return None
+            
+        # 工作窃取：把最慢 (剩余最多) 的分段从中间一分为二
+        victim = max(self._active_segments, key=lambda s: s.remaining, default=None)
+        if victim is None or victim.remaining < 2 * self.min_split_size:
+            return None
+        split_at = victim.offset + victim.remaining // 2
+        stolen = Segment(split_at, victim.end)
+        victim.end = split_at - 1
+        self.segments.append(stolen)
+        self._active_segments.add(stolen)
+        return stolen
+
+    async def _segment_worker(self, worker_id: int) -> bool:
+        """下载连接：不断领取分段直到没有可分配的工作，超过自动调优的目标连接数时退出"""
+        self._live_workers += 1
+        try:
+            while not self._is_cancelled:
+                # 领取 (或拆分) 下一个分段之前检查，避免多余的连接再打开新请求
+                if self._over_connection_limit():
+                    return True
+                segment = self._next_segment()
+                if segment is None:
+                    return True
+                try:
+                    ok = await self._download_chunk(segment, worker_id)
+                finally:
+                    self._active_segments.discard(segment)
+                if not ok:
+                    return False
+            return False
+        finally:
+            self._live_workers -= 1
+
+    def _over_connection_limit(self) -> bool:
+        """活动连接数是否超过自动调优的目标"""
+        return self._tuner is not None and self._live_workers > self._tuner.connections
+
+    async def _tune_loop(self, tasks: List[asyncio.Task],
+                         interval: float = 1.0):
+        """定期采样总吞吐量，按调优结果增加连接或让多余的连接退出"""
+        last_size = self.downloaded_size
+        last_time = time.monotonic()
+        while True:
+            await asyncio.sleep(interval)
+            if self._is_paused:
+                last_size = self.downloaded_size
+                last_time = time.monotonic()
+                continue
+            now = time.monotonic()
+            throughput = (self.downloaded_size - last_size) / (now - last_time)
+            last_size, last_time = self.downloaded_size, now
+            
+            target = self._tuner.update(throughput)
+            self.chunk_size = self._tuner.chunk_size
+            # 新连接通过工作窃取拆分剩余最多的分段
+            for _ in range(target - self._live_workers):
+                tasks.append(asyncio.create_task(self._segment_worker(len(tasks))))
+
+    def _feed_checker(self, offset: int, data: bytes):
+        """把刚写入的数据交给校验器，必要时在线程池中补读文件"""
+        self._checker.feed(offset, data)
+        if self._checker.needs_catch_up() and (
+                self._catch_up_future is None or self._catch_up_future.done()):
+            loop = asyncio.get_running_loop()
+            self._catch_up_future = loop.run_in_executor(None, self._checker.catch_up)
+
+    def _refetch(self, ranges):
+        """把校验失败的区间重新加入待下载分段"""
+        segments = []
+        for segment in self.segments:
+            parts = [(segment.start, segment.end)]
+            for start, end in ranges:
+                parts = [piece for a, b in parts for piece in
+                         ((a, min(b, start - 1)), (max(a, end + 1), b)) if piece[0] <= piece[1]]
+            segments.extend(Segment(a, b, b + 1) for a, b in parts)
+        for start, end in ranges:
+            segments.append(Segment(start, end))
+            with self._lock:
+                self.downloaded_size -= end - start + 1
+        # 原地替换，续传日志引用的是同一个列表
+        self.segments[:] = sorted(segments, key=lambda s: s.start)
+
+    async def _checkpoint(self):
+        """保存续传进度
+
+        日志记录的位置必须已经落盘，否则崩溃或断电后续传会把预分配文件中的空白当作已下载。
+        先记下当前进度，在工作线程中 fsync 数据文件 (期间其他连接继续写入)，再保存记下的进度。
+        """
+        self._checkpointing = True
+        try:
+            self._writer.flush()
+            segments = self._journal.snapshot()
+            loop = asyncio.get_running_loop()
+            with self._trace_span('checkpoint'):
+                await loop.run_in_executor(None, self._writer.fsync)
+            self._journal.save(segments)
+        finally:
+            self._checkpointing = False
+
+    async def _run_workers(self):
+        """启动下载连接并等待所有分段完成"""
+        # 每个连接一个任务，分段在连接之间动态分配
+        self._active_segments.clear()
+        workers = self.max_workers if self.support_range else 1
+        if self.auto_tune and self.support_range:
+            if self._tuner is None:
+                host = urlparse(self.url).netloc.lower()
+                self._tuner = get_host_profiles().create_tuner(host, self.max_workers)
+            workers = self._tuner.connections
+            self.chunk_size = self._tuner.chunk_size
+            
+        if not any(not s.done for s in self.segments):
+            return
+        tasks = [
+            asyncio.create_task(self._segment_worker(i))
+            for i in range(workers)
+        ]
+        tune_task = asyncio.create_task(self._tune_loop(tasks)) if self._tuner else None
+        
+        # 等待所有任务完成 (自动调优期间可能加入新的连接)
+        try:
+            while True:
+                pending = [t for t in tasks if not t.done()]
+                if not pending:
+                    break
+                await asyncio.wait(pending)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        finally:
+            if tune_task:
+                tune_task.cancel()
+                
+        # 合并暂存的数据写出后才能校验或续传
+        with self._trace_span('flush'):
+            self._writer.flush()
+        if self._is_cancelled:
+            raise Exception("下载已取消")
+        # 以分段是否全部完成为准：某个连接重试用尽退出后，它的分段可能已由其他连接领取并完成
+        if all(segment.done for segment in self.segments):
+            return
+        errors = [t.exception() for t in tasks if not t.cancelled() and t.exception() is not None]
+        if errors:
+            raise Exception(f"部分下载任务失败: {errors[0]}")
+        raise Exception("部分下载任务失败")
+
+    async def _verify(self) -> bool:
+        """完成校验，出错的区间重新加入下载，全部通过时返回 True"""
+        if self._catch_up_future is not None:
+            await self._catch_up_future
+        loop = asyncio.get_running_loop()
+        with self._trace_span('verify'):
+            bad_ranges = await loop.run_in_executor(None, self._checker.finalize)
+        if not bad_ranges:
+            self.digest = self._checker.digest
+            return True
+        print(f"文件校验失败，重新下载 {len(bad_ranges)} 个区间")
+        self._checker.reset_ranges(bad_ranges)
+        self._refetch(bad_ranges)
+        if self._journal_enabled:
+            self._writer.sync()
+            self._journal.save()
+        return False
+
+    async def _verify_unsized(self):
+        """大小未知的下载无法边下载边校验，结束后从文件计算摘要，不一致时删除文件"""
+        parsed = parse_checksum(self.checksum)
+        algorithm = parsed[0] if parsed else self.compute_digest
+        if not algorithm:
+            return
+        self._writer.flush()
+        loop = asyncio.get_running_loop()
+        with self._trace_span('verify'):
+            actual = await loop.run_in_executor(None, file_digest, self.save_path, algorithm)
+        if parsed and actual != parsed[1]:
+            self._writer.close()
+            self.save_path.unlink()
+            raise Exception("文件校验失败，已删除损坏的文件")
+        self.digest = f"{algorithm}:{actual}"
+
     async def _async_download(self):
         """异步下载主函数"""
         # 创建目录
         self.save_path.parent.mkdir(parents=True, exist_ok=True)
         
-        # 创建或打开文件
-        if not self.save_path.exists():
-            async with aiofiles.open(self.save_path, 'wb') as f:
-                if self.total_size > 0:
-                    await f.truncate(self.total_size)
+        # 整个下载只打开一个文件描述符，各分段按偏移直接写入
+        created = not self.save_path.exists()
+        self._writer = FileWriter(self.save_path, self.write_coalesce)
+        if self.total_size > 0:
+            # 预先分配整个文件，空间不足时在开始下载前失败
+            try:
+                with self._trace_span('preallocate', size=self.total_size):
+                    self._writer.preallocate(self.total_size)
+            except Exception:
+                self._writer.close()
+                if created:
+                    self.save_path.unlink()
+                raise
+                    
+        # 文件大小已知时总是记录日志：文件预分配到完整大小后，只有日志能说明它还没下载完。
+        # 服务器没有校验信息时日志不用于续传 (matches 不通过)，下次从头下载
+        self._journal_enabled = self.total_size > 0
+        if self._journal_enabled:
+            self._journal.reset(self.url, self.total_size, self.etag,
+                                self.last_modified, self.segments)
+            self._writer.sync()
+            self._journal.save()
         
         # 创建进度条
         if not self.progress_callback:
@@ -283,55 +828,120 @@ class Downloader:
                 desc=f"下载 {self.save_path.name}"
             )
         
-        # 创建HTTP会话
-        connector = aiohttp.TCPConnector(limit=self.max_workers)
-        timeout = aiohttp.ClientTimeout(total=self.timeout)
-        
-        # 设置会话参数
-        session_kwargs = {
-            'connector': connector,
-            'timeout': timeout,
-            'headers': {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
-        }
+        # 边下载边校验，续传前已写入的数据稍后从文件补读
+        self._checker = None
+        if self.total_size > 0 and (self.checksum or self.blocks or self.compute_digest):
+            checker = IntegrityChecker(self.save_path, self.total_size, self.checksum,
+                                       self.blocks, self.compute_digest)
+            if checker.enabled:
+                for segment in self.segments:
+                    checker.mark_written(segment.start, segment.offset - 1)
+                self._checker = checker
+                self._writer.on_write = self._feed_checker
         
-        # 添加代理配置
-        if self.proxy_config:
-            # aiohttp使用不同的代理格式
-            if 'http' in self.proxy_config:
-                session_kwargs['trust_env'] = True
-                # 设置环境变量代理
-                os.environ['HTTP_PROXY'] = self.proxy_config['http']
-                if 'https' in self.proxy_config:
-                    os.environ['HTTPS_PROXY'] = self.proxy_config['https']
-        
-        async with aiohttp.ClientSession(**session_kwargs) as session:
-            
-            # 创建下载任务
-            tasks = []
-            for i, (start, end) in enumerate(self.ranges):
-                # 跳过已下载的部分
-                if start < self.downloaded_size:
-                    start = max(start, self.downloaded_size)
-                    
-                if start <= end:
-                    task = asyncio.create_task(
-                        self._download_chunk(session, start, end, i)
-                    )
-                    tasks.append(task)
-            
-            # 等待所有任务完成
-            if tasks:
-                results = await asyncio.gather(*tasks, return_exceptions=True)
-                success = all(r is True for r in results if not isinstance(r, Exception))
-                
-                if not success:
-                    raise Exception("部分下载任务失败")
+        try:
+            await self._run_workers()
+            # 校验失败的区间单独重新下载
+            # 没有块哈希时只能重新下载整个文件，最多重试一次，避免反复下载整个文件
+            if self._checker:
+                attempts = 0
+                max_attempts = self.max_retries if self._checker.block_hashes else 1
+                while not await self._verify():
+                    attempts += 1
+                    if attempts > max_attempts:
+                        self._writer.close()
+                        self._journal.remove()
+                        self.save_path.unlink()
+                        raise Exception("文件校验失败，已删除损坏的文件")
+                    await self._run_workers()
+            elif self.total_size == 0:
+                await self._verify_unsized()
+            # 数据落盘后保留日志作为完成标记 (所有分段已完成)，之后为同一文件创建下载器时
+            # 据此跳过；大小未知的下载没有日志
+            if self._journal_enabled:
+                self._writer.sync()
+                self._journal.save()
+        except BaseException:
+            # 保留已写入的进度，下次启动时续传；数据无法落盘时保留上一次的日志
+            if self._journal_enabled and self.save_path.exists() and self._writer.fd >= 0:
+                try:
+                    self._writer.sync()
+                    self._journal.save()
+                except OSError as e:
+                    print(f"保存续传进度失败: {e}")
+            self._writer.close()
+            raise
+        finally:
+            with self._trace_span('finalize'):
+                self._writer.close()
+            # 关闭进度条
+            if self.progress_bar:
+                self.progress_bar.close()
         
-        # 关闭进度条
-        if self.progress_bar:
-            self.progress_bar.close()
-            
         self._download_complete = True
+        
+        # 采样足够时保存调优结果，同一主机的下一次下载从这里开始
+        if self._tuner and self._tuner.samples >= 3:
+            get_host_profiles().update(urlparse(self.url).netloc.lower(), self._tuner)
+
+    async def _run_async(self):
+        """在引擎线程中执行下载，失败或取消时抛出异常
+
+        不清除暂停和取消状态：下载开始前 (如探测期间) 收到的 pause()/cancel() 仍然有效，
+        取消后要重新下载时先调用 reset()。
+        """
+        self._is_running = True
+        self.start_time = time.time()
+        self._meter.reset()
+        self._segment_meters.clear()
+        self._segment_sources.clear()
+        self._retry_budget = self._new_retry_budget()
+        self.events.reset()
+        ticker = asyncio.create_task(self.events.run(self._progress_event))
+        try:
+            if self._is_cancelled:
+                raise Exception("下载已取消")
+            with self._trace_span('download', url=self.url, size=self.total_size):
+                await self._async_download()
+            if self._is_cancelled:
+                raise Exception("下载已取消")
+        except BaseException as e:
+            ticker.cancel()
+            self._is_running = False
+            kind = ProgressEvent.CANCELLED if self._is_cancelled else ProgressEvent.FAILED
+            self._record_result(kind)
+            self.events.publish(self._progress_event(kind, error=str(e)))
+            raise
+        ticker.cancel()
+        self._is_running = False
+        self._record_result(ProgressEvent.COMPLETED)
+        self.events.publish(self._progress_event())
+        self.events.publish(self._progress_event(ProgressEvent.COMPLETED, path=str(self.save_path)))
+
+    def _record_result(self, result: str):
+        metrics.DOWNLOADS.inc(1, result)
+        metrics.DOWNLOAD_SECONDS.observe(time.time() - self.start_time, result)
+
+    def _progress_event(self, kind: str = ProgressEvent.PROGRESS, **kwargs) -> ProgressEvent:
+        """按当前状态生成进度事件"""
+        return ProgressEvent(kind, self.downloaded_size, self.total_size, self.get_progress(),
+                             self.get_speed(), self.get_eta(), **kwargs)
+
+    def _relay_progress(self, event: ProgressEvent):
+        """把进度事件转给 progress_callback，没有回调时更新命令行进度条"""
+        if event.kind != ProgressEvent.PROGRESS:
+            return
+        if self.progress_callback:
+            self.progress_callback(event.progress)
+        elif self.progress_bar is not None:
+            self.progress_bar.update(event.downloaded - self.progress_bar.n)
+
+    def run(self):
+        """同步执行下载直到结束，失败或取消时抛出异常"""
+        if self._download_complete:
+            self.events.publish(self._progress_event(ProgressEvent.COMPLETED, path=str(self.save_path)))
+            return
+        get_engine().run(self._run_async())
 
     def start(self):
         """开始下载"""
@@ -340,26 +950,23 @@ class Downloader:
             
         if self._download_complete:
             print("文件已下载完成")
+            self.events.publish(self._progress_event(ProgressEvent.COMPLETED, path=str(self.save_path)))
             return
             
+        # 在下载引擎线程中运行异步下载
         self._is_running = True
-        self._is_cancelled = False
-        self._is_paused = False
-        self.start_time = time.time()
+        future = get_engine().submit(self._run_async())
         
-        # 在新线程中运行异步下载
-        def run_async():
-            try:
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                loop.run_until_complete(self._async_download())
-            except Exception as e:
-                print(f"下载失败: {e}")
-            finally:
-                self._is_running = False
+        def on_done(f):
+            if not f.cancelled() and f.exception():
+                print(f"下载失败: {f.exception()}")
                 
-        thread = threading.Thread(target=run_async, daemon=True)
-        thread.start()
+        future.add_done_callback(on_done)
+
+    def reset(self):
+        """清除暂停和取消状态，取消后重新开始下载前调用"""
+        self._is_cancelled = False
+        self._is_paused = False
 
     def pause(self):
         """暂停下载"""
@@ -383,13 +990,19 @@ class Downloader:
         return min(100, int(self.downloaded_size * 100 / self.total_size))
 
     def get_speed(self) -> float:
-        """获取下载速度 (bytes/s)"""
-        if not self.start_time or not self._is_running:
+        """获取当前下载速度 (bytes/s)，滑动窗口吞吐量经 EWMA 平滑"""
+        if not self._is_running:
+            return 0
+        return self._meter.speed()
+
+    def get_average_speed(self) -> float:
+        """本次启动以来的平均速度 (bytes/s)，不含续传前已下载的部分"""
+        if not self.start_time:
             return 0
         elapsed = time.time() - self.start_time
-        if elapsed == 0:
+        if elapsed <= 0:
             return 0
-        return self.downloaded_size / elapsed
+        return self._meter.total / elapsed
 
     def get_eta(self) -> int:
         """获取预计剩余时间 (秒)"""
@@ -399,6 +1012,21 @@ class Downloader:
         remaining = self.total_size - self.downloaded_size
         return int(remaining / speed)
 
+    def get_segment_stats(self) -> List[Dict[str, Any]]:
+        """正在下载的分段的位置、来源镜像和当前速度"""
+        stats = []
+        # 在其他线程调用时分段集合可能正在变化，遍历列表而不是集合
+        for segment in [s for s in self.segments if s in self._active_segments]:
+            meter = self._segment_meters.get(segment)
+            stats.append({
+                'start': segment.start,
+                'end': segment.end,
+                'offset': segment.offset,
+                'mirror': self._segment_sources.get(segment),
+                'speed': meter.speed() if meter else 0,
+            })
+        return stats
+
     def get_status(self) -> Dict[str, Any]:
         """获取下载状态"""
         return {
@@ -406,13 +1034,24 @@ class Downloader:
             'downloaded': self.downloaded_size,
             'total': self.total_size,
             'speed': self.get_speed(),
+            'instant_speed': self._meter.rate() if self._is_running else 0,
+            'average_speed': self.get_average_speed(),
             'eta': self.get_eta(),
+            'ttfb': self._ttfb.to_dict(),
+            'segments': self.get_segment_stats(),
+            'retries': self._retry_budget.used,
             'is_running': self._is_running,
             'is_paused': self._is_paused,
             'is_cancelled': self._is_cancelled,
-            'is_complete': self._download_complete
+            'is_complete': self._download_complete,
+            'mirrors': self.mirror_pool.snapshot()
         }
 
+    def set_speed_limit(self, speed_limit: Optional[int]):
+        """修改本下载的速度限制 (bytes/s)，None 表示只受全局限速约束"""
+        self.speed_limit = speed_limit
+        self._limiter.set_rate(speed_limit)
+
     def set_proxy(self, proxy: Union[str, Dict[str, str], None]):
         """设置代理"""
         self.proxy = proxy
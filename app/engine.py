@@ -0,0 +1,168 @@
+import asyncio
+import threading
+import concurrent.futures
+from urllib.parse import urlparse
+from typing import Optional, Dict, Any, Coroutine
+
+import aiohttp
+import httpx
+
+from app import trace
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+
+
+class DownloadEngine:
+    """下载引擎
+
+    进程内只有一个常驻线程运行事件循环，所有下载和 HEAD 探测共用同一个
+    aiohttp.ClientSession。连接池保持长连接，同一镜像站的 TCP/TLS 连接在下载之间复用。
+    支持 HTTP/2 的服务器另用共享的 httpx 客户端，所有分段作为流复用同一个连接。
+    """
+
+    def __init__(self, limit: int = 100, keepalive_timeout: float = 60.0):
+        """
+        初始化下载引擎
+
+        Args:
+            limit: 连接池总连接数上限 (每个主机的连接数由调度器控制)
+            keepalive_timeout: 空闲长连接的保持时间 (秒)
+        """
+        self.limit = limit
+        self.keepalive_timeout = keepalive_timeout
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._http2_clients: Dict[Optional[str], httpx.AsyncClient] = {}
+        self._http2_support: Dict[str, bool] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """引擎事件循环，首次访问时启动引擎线程"""
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                self._loop = asyncio.new_event_loop()
+                ready = threading.Event()
+                self._thread = threading.Thread(target=self._run_loop, args=(ready,),
+                                                name='DownloadEngine', daemon=True)
+                self._thread.start()
+                ready.wait()
+            return self._loop
+
+    def _run_loop(self, ready: threading.Event):
+        asyncio.set_event_loop(self._loop)
+        self._loop.call_soon(ready.set)
+        self._loop.run_forever()
+
+    def in_engine_thread(self) -> bool:
+        """当前线程是否为引擎线程"""
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def submit(self, coro: Coroutine) -> concurrent.futures.Future:
+        """把协程提交到引擎线程执行"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Coroutine, timeout: Optional[float] = None) -> Any:
+        """在引擎线程中执行协程并同步等待结果，不能在引擎线程内调用"""
+        if self.in_engine_thread():
+            coro.close()
+            raise RuntimeError("不能在下载引擎线程中同步等待")
+        return self.submit(coro).result(timeout)
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        """获取共享会话，必须在引擎线程中调用"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=0,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=300,
+            )
+            # 开启跟踪时记录建立连接的各阶段，关闭时不挂回调
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers={'User-Agent': USER_AGENT},
+                trace_configs=[trace.aiohttp_trace_config()] if trace.active() else None,
+            )
+        return self._session
+
+    async def head(self, url: str, headers: Optional[Dict[str, str]] = None,
+                   proxy: Optional[str] = None, timeout: float = 30) -> aiohttp.ClientResponse:
+        """发送 HEAD 请求 (跟随重定向)，返回已读取完毕的响应"""
+        session = await self.get_session()
+        client_timeout = aiohttp.ClientTimeout(total=timeout)
+        async with session.head(url, headers=headers, proxy=proxy,
+                                allow_redirects=True, timeout=client_timeout) as response:
+            return response
+
+    async def get_http2_client(self, proxy: Optional[str] = None) -> httpx.AsyncClient:
+        """获取共享的 HTTP/2 客户端 (每个代理一个)，必须在引擎线程中调用"""
+        client = self._http2_clients.get(proxy)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                http2=True,
+                proxy=proxy,
+                headers={'User-Agent': USER_AGENT},
+                follow_redirects=True,
+                limits=httpx.Limits(max_connections=self.limit,
+                                    keepalive_expiry=self.keepalive_timeout),
+            )
+            self._http2_clients[proxy] = client
+        return client
+
+    async def supports_http2(self, url: str, proxy: Optional[str] = None,
+                             timeout: float = 30) -> bool:
+        """服务器是否支持 HTTP/2 (通过 TLS ALPN 协商)，结果按主机缓存"""
+        parsed = urlparse(url)
+        if parsed.scheme != 'https':
+            # 明文 HTTP/2 (h2c) 很少有服务器支持
+            return False
+        host = parsed.netloc.lower()
+        if host not in self._http2_support:
+            try:
+                client = await self.get_http2_client(proxy)
+                response = await client.head(url, timeout=timeout)
+                self._http2_support[host] = response.http_version == 'HTTP/2'
+            except Exception as e:
+                print(f"HTTP/2 探测失败 {host}: {e}")
+                return False
+        return self._http2_support[host]
+
+    def shutdown(self):
+        """关闭共享会话并停止引擎线程，不能在引擎线程内调用"""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = None
+            self._thread = None
+        if loop is None or loop.is_closed():
+            return
+
+        async def close_session():
+            if self._session is not None and not self._session.closed:
+                await self._session.close()
+            for client in self._http2_clients.values():
+                await client.aclose()
+
+        try:
+            asyncio.run_coroutine_threadsafe(close_session(), loop).result(5)
+        except Exception as e:
+            print(f"关闭下载会话失败: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(5)
+        loop.close()
+        self._session = None
+        self._http2_clients.clear()
+
+
+_engine: Optional[DownloadEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> DownloadEngine:
+    """获取进程内共享的下载引擎"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = DownloadEngine()
+        return _engine
@@ -0,0 +1,286 @@
+import hashlib
+import threading
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Tuple
+
+# 按十六进制摘要长度推断算法
+_DIGEST_LENGTHS = {32: 'md5', 40: 'sha1', 64: 'sha256', 128: 'sha512'}
+_ALGORITHMS = ('sha256', 'sha512', 'sha1', 'md5')
+
+READ_SIZE = 1024 * 1024
+
+
+def parse_checksum(value: Optional[str]) -> Optional[Tuple[str, str]]:
+    """解析 'sha256:<hex>' 或裸十六进制摘要，无法识别时返回 None"""
+    if not value or not isinstance(value, str):
+        return None
+    value = value.strip()
+    if ':' in value:
+        algorithm, digest = value.split(':', 1)
+        algorithm = algorithm.strip().lower().replace('-', '')
+    else:
+        digest = value
+        algorithm = _DIGEST_LENGTHS.get(len(digest))
+    digest = digest.strip().lower()
+    if algorithm not in hashlib.algorithms_available:
+        return None
+    try:
+        int(digest, 16)
+    except ValueError:
+        return None
+    return algorithm, digest
+
+
+def checksum_from_entry(entry: Dict[str, Any]) -> Optional[str]:
+    """从目录条目或更新清单中读取校验和 (checksum 字段或 sha256/sha512 等字段)"""
+    if entry.get('checksum'):
+        return str(entry['checksum'])
+    for algorithm in _ALGORITHMS:
+        if entry.get(algorithm):
+            return f"{algorithm}:{entry[algorithm]}"
+    return None
+
+
+def file_digest(path, algorithm: str = 'sha256',
+                start: int = 0, end: Optional[int] = None) -> str:
+    """计算文件 (或其中 [start, end] 区间) 的摘要"""
+    hasher = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = None if end is None else end - start + 1
+        while remaining is None or remaining > 0:
+            data = f.read(READ_SIZE if remaining is None else min(READ_SIZE, remaining))
+            if not data:
+                break
+            hasher.update(data)
+            if remaining is not None:
+                remaining -= len(data)
+    return hasher.hexdigest()
+
+
+def verify_file(path, checksum: Optional[str]) -> bool:
+    """按校验和验证文件，没有可用校验和时返回 True"""
+    parsed = parse_checksum(checksum)
+    if parsed is None:
+        return True
+    algorithm, expected = parsed
+    return file_digest(path, algorithm) == expected
+
+
+class IntegrityChecker:
+    """边下载边校验
+
+    整文件摘要：分段乱序到达，恰好接在已计算前缀之后的数据直接从内存更新摘要，其他位置的
+    数据只记录区间，等前缀推进到那里时再从文件补读 (刚写入的数据通常还在页缓存中)。
+
+    块校验：提供块哈希列表时，每个块在数据按顺序写满后立即比对，出错的块可以单独重新下载；
+    被拆分或续传打乱顺序的块在下载结束时从文件补算。
+    """
+
+    def __init__(self, path, total_size: int,
+                 checksum: Optional[str] = None,
+                 blocks: Optional[Dict[str, Any]] = None,
+                 digest_algorithm: Optional[str] = None):
+        """
+        初始化校验器
+
+        Args:
+            path: 目标文件路径
+            total_size: 文件大小
+            checksum: 整文件校验和，'sha256:<hex>' 或裸摘要
+            blocks: 块哈希 {'size': 块大小, 'algorithm': 'sha256', 'hashes': [...]}
+            digest_algorithm: 没有校验和时仍然计算整文件摘要所用的算法 (只计算不比对)
+        """
+        self.path = Path(path)
+        self.total_size = total_size
+        self._lock = threading.Lock()
+
+        parsed = parse_checksum(checksum)
+        self.algorithm, self.expected = parsed if parsed else (digest_algorithm, None)
+        self._hasher = hashlib.new(self.algorithm) if self.algorithm else None
+        self._watermark = 0
+        self._pending: List[List[int]] = []  # 已写入但尚未计入摘要的区间 [start, end)
+        self._catching_up = False
+        self._read_lock = threading.Lock()
+
+        self.block_size = 0
+        self.block_hashes: List[str] = []
+        self.block_algorithm = None
+        if blocks and blocks.get('size') and blocks.get('hashes'):
+            self.block_size = int(blocks['size'])
+            self.block_hashes = [h.lower() for h in blocks['hashes']]
+            self.block_algorithm = blocks.get('algorithm', 'sha256')
+        self.digest = None  # 校验通过后的 '<算法>:<摘要>'
+        self._block_state: Dict[int, Tuple[Any, int]] = {}
+        self._dirty_blocks = set()
+        self.bad_blocks = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self._hasher is not None or bool(self.block_hashes)
+
+    # ---- 数据写入 ----
+
+    def feed(self, offset: int, data: bytes):
+        """记录在 offset 处写入的数据"""
+        if self._hasher is not None:
+            self._feed_digest(offset, data)
+        if self.block_hashes:
+            self._feed_blocks(offset, data)
+
+    def mark_written(self, start: int, end: int):
+        """记录续传前已写入文件的区间 [start, end]，内容稍后从文件读取"""
+        if end < start:
+            return
+        if self._hasher is not None:
+            with self._lock:
+                self._add_pending(start, end + 1)
+        if self.block_hashes:
+            for index in range(start // self.block_size, end // self.block_size + 1):
+                self._block_state.pop(index, None)
+                self._dirty_blocks.add(index)
+
+    def _feed_digest(self, offset: int, data: bytes):
+        with self._lock:
+            if offset == self._watermark and not self._catching_up:
+                self._hasher.update(data)
+                self._watermark += len(data)
+            else:
+                self._add_pending(offset, offset + len(data))
+
+    def _add_pending(self, start: int, end: int):
+        """合并待补读区间"""
+        merged = []
+        for s, e in sorted(self._pending + [[start, end]]):
+            if merged and s <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], e)
+            else:
+                merged.append([s, e])
+        self._pending = merged
+
+    def _feed_blocks(self, offset: int, data: bytes):
+        view = memoryview(data)
+        pos = 0
+        while pos < len(view):
+            absolute = offset + pos
+            index = absolute // self.block_size
+            block_start = index * self.block_size
+            block_end = min(block_start + self.block_size, self.total_size)
+            take = min(len(view) - pos, block_end - absolute)
+            if index not in self._dirty_blocks and index < len(self.block_hashes):
+                hasher, expected_offset = self._block_state.get(
+                    index, (None, block_start))
+                if absolute != expected_offset:
+                    # 块内数据乱序，结束时从文件补算
+                    self._block_state.pop(index, None)
+                    self._dirty_blocks.add(index)
+                else:
+                    if hasher is None:
+                        hasher = hashlib.new(self.block_algorithm)
+                    hasher.update(view[pos:pos + take])
+                    if absolute + take == block_end:
+                        self._block_state.pop(index, None)
+                        if hasher.hexdigest() != self.block_hashes[index]:
+                            self.bad_blocks.add(index)
+                    else:
+                        self._block_state[index] = (hasher, absolute + take)
+            pos += take
+
+    # ---- 补读与最终校验 (可能读文件，应在线程池中执行) ----
+
+    def needs_catch_up(self) -> bool:
+        """已计算前缀之后是否有可以补读的数据"""
+        with self._lock:
+            return (not self._catching_up and bool(self._pending) and
+                    self._pending[0][0] <= self._watermark)
+
+    def catch_up(self):
+        """从文件补读紧接在已计算前缀之后的数据"""
+        if self._hasher is None:
+            return
+        # 同一时间只有一个线程补读，补读期间新数据一律记为待补读区间
+        with self._read_lock:
+            with self._lock:
+                self._catching_up = True
+            try:
+                self._read_pending()
+            finally:
+                with self._lock:
+                    self._catching_up = False
+
+    def _read_pending(self):
+        with open(self.path, 'rb') as f:
+            while True:
+                with self._lock:
+                    if not self._pending or self._pending[0][0] > self._watermark:
+                        break
+                    end = self._pending[0][1]
+                    self._pending.pop(0)
+                    start = self._watermark
+                if end <= start:
+                    continue
+                f.seek(start)
+                remaining = end - start
+                while remaining > 0:
+                    data = f.read(min(READ_SIZE, remaining))
+                    if not data:
+                        raise IOError("文件长度不足，无法校验")
+                    self._hasher.update(data)
+                    remaining -= len(data)
+                with self._lock:
+                    self._watermark = end
+
+    def finalize(self) -> List[Tuple[int, int]]:
+        """下载结束后完成校验，返回需要重新下载的区间列表 (闭区间)，为空表示校验通过"""
+        bad_ranges = []
+        if self.block_hashes:
+            for index in sorted(self._dirty_blocks | set(self._block_state)):
+                if index >= len(self.block_hashes):
+                    continue
+                start, end = self._block_range(index)
+                if file_digest(self.path, self.block_algorithm, start, end) != self.block_hashes[index]:
+                    self.bad_blocks.add(index)
+            self._dirty_blocks.clear()
+            self._block_state.clear()
+            bad_ranges = [self._block_range(i) for i in sorted(self.bad_blocks)]
+
+        if self._hasher is not None:
+            self.catch_up()
+            actual = self._hasher.hexdigest()
+            digest_ok = (self._watermark >= self.total_size and
+                         (self.expected is None or actual == self.expected))
+            if digest_ok:
+                self.digest = f"{self.algorithm}:{actual}"
+            if not digest_ok and not bad_ranges:
+                if self.block_hashes:
+                    # 块全部正确但整体摘要不符，说明块哈希本身不可信
+                    raise Exception("文件校验失败：块校验通过但整体摘要不一致")
+                bad_ranges = [(0, self.total_size - 1)]
+        return bad_ranges
+
+    def _block_range(self, index: int) -> Tuple[int, int]:
+        start = index * self.block_size
+        return start, min(start + self.block_size, self.total_size) - 1
+
+    def reset_ranges(self, ranges: List[Tuple[int, int]]):
+        """准备重新下载出错的区间"""
+        if self.block_hashes:
+            for start, end in ranges:
+                for index in range(start // self.block_size, end // self.block_size + 1):
+                    self.bad_blocks.discard(index)
+                    self._block_state.pop(index, None)
+                    self._dirty_blocks.discard(index)
+        if self._hasher is not None:
+            # 摘要状态无法回退，重新下载后从头补读整个文件
+            # 重新下载的区间写入时才会加入待补读列表，避免读到旧数据
+            with self._lock:
+                self._hasher = hashlib.new(self.algorithm)
+                self._watermark = 0
+                self._pending = []
+                cursor = 0
+                for start, end in sorted(ranges):
+                    if start > cursor:
+                        self._pending.append([cursor, start])
+                    cursor = max(cursor, end + 1)
+                if cursor < self.total_size:
+                    self._pending.append([cursor, self.total_size])
@@ -0,0 +1,186 @@
+import os
+import json
+import time
+from pathlib import Path
+from typing import Optional, List, Dict, Any
+
+
+class Segment:
+    """下载分段，[start, end] 为闭区间，offset 为下一个待写入字节的位置"""
+
+    __slots__ = ('start', 'end', 'offset')
+
+    def __init__(self, start: int, end: Optional[int], offset: Optional[int] = None):
+        self.start = start
+        self.end = end  # None 表示长度未知，一直读到流结束
+        self.offset = start if offset is None else offset
+
+    @property
+    def written(self) -> int:
+        """已写入的字节数"""
+        return self.offset - self.start
+
+    @property
+    def remaining(self) -> int:
+        """剩余字节数 (长度未知时返回 0)"""
+        if self.end is None:
+            return 0
+        return max(0, self.end - self.offset + 1)
+
+    @property
+    def done(self) -> bool:
+        """是否已下载完成"""
+        return self.end is not None and self.offset > self.end
+
+    def to_dict(self) -> Dict[str, int]:
+        return {'start': self.start, 'end': self.end, 'offset': self.offset}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'Segment':
+        return cls(int(data['start']), int(data['end']), int(data['offset']))
+
+    def __repr__(self):
+        return f"Segment({self.start}-{self.end}, offset={self.offset})"
+
+
+class DownloadJournal:
+    """分段续传日志
+
+    与目标文件同目录的 sidecar 文件 (``<文件名>.journal``)，记录每个分段已写入的位置
+    以及下载时服务器返回的校验信息 (ETag/Last-Modified)。写入采用临时文件 + 原子替换，
+    进程在任意时刻崩溃都不会留下半截日志。下载完成后日志保留，所有分段标记为已完成，
+    作为文件已下载完整的标记。
+    """
+
+    SUFFIX = '.journal'
+    VERSION = 1
+
+    def __init__(self, save_path, flush_interval: float = 1.0):
+        """
+        初始化续传日志
+
+        Args:
+            save_path: 下载目标文件路径
+            flush_interval: 两次落盘之间的最小间隔 (秒)
+        """
+        self.path = Path(str(save_path) + self.SUFFIX)
+        self.flush_interval = flush_interval
+        self.url = None
+        self.total_size = 0
+        self.etag = None
+        self.last_modified = None
+        self.segments: List[Segment] = []
+        self._last_save = 0.0
+
+    def load(self) -> bool:
+        """读取日志文件，成功返回 True"""
+        if not self.path.exists():
+            return False
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') != self.VERSION:
+                return False
+            self.url = data.get('url')
+            self.total_size = int(data.get('total_size', 0))
+            self.etag = data.get('etag')
+            self.last_modified = data.get('last_modified')
+            self.segments = [Segment.from_dict(s) for s in data.get('segments', [])]
+            return True
+        except Exception as e:
+            print(f"读取续传日志失败: {e}")
+            return False
+
+    @classmethod
+    def in_progress(cls, save_path) -> bool:
+        """save_path 是否有未下载完的日志 (下载完成后保留的完成标记不算)"""
+        journal = cls(save_path)
+        return journal.load() and not journal.complete
+
+    @property
+    def complete(self) -> bool:
+        """日志中的所有分段是否都已下载完成"""
+        return bool(self.segments) and all(s.done for s in self.segments)
+
+    def matches(self, url: str, total_size: int,
+                etag: Optional[str], last_modified: Optional[str]) -> bool:
+        """判断日志是否与服务器上的当前文件一致，可以续传"""
+        # 没有任何校验信息时无法确认远端文件未变更，不允许续传
+        if not etag and not last_modified:
+            return False
+        return self._same_file(url, total_size, etag, last_modified)
+
+    def completed(self, url: str, total_size: int,
+                  etag: Optional[str], last_modified: Optional[str]) -> bool:
+        """日志是否记录了同一文件已下载完成
+
+        下载完成后日志保留为完成标记。服务器没有校验信息时只比较 URL 和大小，
+        与没有日志时按大小判断已下载完成的做法一致。
+        """
+        return self.complete and self._same_file(url, total_size, etag, last_modified)
+
+    def _same_file(self, url: str, total_size: int,
+                   etag: Optional[str], last_modified: Optional[str]) -> bool:
+        if self.url != url or self.total_size != total_size or not self.segments:
+            return False
+        if etag and self.etag != etag:
+            return False
+        if last_modified and self.last_modified != last_modified:
+            return False
+        # 分段必须完整覆盖整个文件
+        covered = sorted((s.start, s.end) for s in self.segments)
+        expected = 0
+        for start, end in covered:
+            if start != expected:
+                return False
+            expected = end + 1
+        return expected == total_size
+
+    def reset(self, url: str, total_size: int,
+              etag: Optional[str], last_modified: Optional[str],
+              segments: List[Segment]):
+        """以新的下载信息重建日志"""
+        self.url = url
+        self.total_size = total_size
+        self.etag = etag
+        self.last_modified = last_modified
+        self.segments = segments
+
+    def due(self) -> bool:
+        """距离上次落盘是否已超过刷新间隔"""
+        return time.monotonic() - self._last_save >= self.flush_interval
+
+    def snapshot(self) -> List[Dict[str, int]]:
+        """当前各分段的写入位置，用于先落盘数据、再保存这一时刻的进度"""
+        return [s.to_dict() for s in self.segments]
+
+    def save(self, segments: Optional[List[Dict[str, int]]] = None):
+        """原子写入日志文件，segments 为 snapshot() 的结果，默认为当前进度"""
+        data = {
+            'version': self.VERSION,
+            'url': self.url,
+            'total_size': self.total_size,
+            'etag': self.etag,
+            'last_modified': self.last_modified,
+            'segments': self.snapshot() if segments is None else segments,
+        }
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self._last_save = time.monotonic()
+        except Exception as e:
+            print(f"写入续传日志失败: {e}")
+
+    def remove(self):
+        """删除日志文件"""
+        for path in (self.path, self.path.with_name(self.path.name + '.tmp')):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"删除续传日志失败: {e}")
@@ -0,0 +1,90 @@
+import time
+import asyncio
+import threading
+from typing import Optional
+
+
+class TokenBucket:
+    """令牌桶限速器
+
+    线程安全，可以在多个分段、多个下载器 (甚至多个事件循环) 之间共享。
+    消耗令牌时允许透支，透支部分按速率折算为等待时间，因此长期平均速率是准确的，
+    短时突发不超过 burst。
+    """
+
+    def __init__(self, rate: Optional[float] = None, burst: Optional[int] = None):
+        """
+        初始化令牌桶
+
+        Args:
+            rate: 速率 (bytes/s)，None 或 0 表示不限速
+            burst: 桶容量 (bytes)，默认等于一秒的流量
+        """
+        self._lock = threading.Lock()
+        self.rate = None
+        self.burst = 0
+        self._tokens = 0.0
+        self._last = time.monotonic()
+        self.set_rate(rate, burst)
+
+    @property
+    def unlimited(self) -> bool:
+        return not self.rate
+
+    def set_rate(self, rate: Optional[float], burst: Optional[int] = None):
+        """修改速率和桶容量，立即生效"""
+        with self._lock:
+            self.rate = float(rate) if rate else None
+            if self.rate:
+                self.burst = int(burst) if burst else max(int(self.rate), 64 * 1024)
+            else:
+                self.burst = 0
+            # 修改速率后重新从满桶开始，避免沿用旧速率下的透支
+            self._tokens = float(self.burst)
+            self._last = time.monotonic()
+
+    def reserve(self, nbytes: int) -> float:
+        """消耗 nbytes 个令牌，返回需要等待的秒数"""
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            if not self.rate:
+                return 0.0
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= nbytes
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    async def acquire(self, nbytes: int):
+        """异步消耗令牌，不足时等待"""
+        delay = self.reserve(nbytes)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+async def throttle(nbytes: int, *buckets: Optional[TokenBucket]) -> float:
+    """同时从多个令牌桶扣除流量，按最慢的一个等待，返回等待的秒数"""
+    delay = 0.0
+    for bucket in buckets:
+        if bucket is not None:
+            delay = max(delay, bucket.reserve(nbytes))
+    if delay > 0:
+        await asyncio.sleep(delay)
+    return delay
+
+
+# 进程级全局限速器，所有下载共享
+_global_limiter = TokenBucket()
+
+
+def get_global_limiter() -> TokenBucket:
+    """获取全局限速器"""
+    return _global_limiter
+
+
+def set_global_speed_limit(rate: Optional[float], burst: Optional[int] = None):
+    """设置所有下载的总速率上限 (bytes/s)，None 表示不限速"""
+    _global_limiter.set_rate(rate, burst)
@@ -0,0 +1,273 @@
+import os
+import json
+import math
+import time
+import threading
+from typing import Optional, Dict, Any, List, Tuple, Iterable
+
+# 延迟类直方图的默认分桶 (秒)
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# 排队等待等较长耗时的分桶 (秒)
+DURATION_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+
+
+class _Metric:
+    """指标基类：按标签值分别保存样本"""
+
+    type = 'untyped'
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], Any] = {}
+
+    def _key(self, labels: Tuple[Any, ...]) -> Tuple[str, ...]:
+        if len(labels) != len(self.labelnames):
+            raise Exception(f"指标 {self.name} 需要标签 {self.labelnames}")
+        return tuple(str(value) for value in labels)
+
+    def samples(self) -> List[Tuple[Dict[str, str], Any]]:
+        with self._lock:
+            items = list(self._values.items())
+        return [(dict(zip(self.labelnames, key)), self._export(value)) for key, value in items]
+
+    def _export(self, value):
+        return value
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(_Metric):
+    """只增不减的计数"""
+
+    type = 'counter'
+
+    def inc(self, amount: float = 1, *labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """可增可减的当前值 (如活动连接数)"""
+
+    type = 'gauge'
+
+    def set(self, value: float, *labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, *labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, *labels):
+        self.inc(-amount, *labels)
+
+    def value(self, *labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Histogram(_Metric):
+    """分桶直方图，记录样本数、总和以及落在各上界以内的数量"""
+
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def _export(self, state):
+        # 内部按桶计数，导出时累加成 Prometheus 的累计形式
+        counts, total, count = state
+        cumulative, running = {}, 0
+        for bound, n in zip(self.buckets, counts):
+            running += n
+            cumulative[_format_value(bound)] = running
+        cumulative['+Inf'] = count
+        return {'buckets': cumulative, 'sum': total, 'count': count}
+
+
+class MetricsRegistry:
+    """指标注册表
+
+    下载器、调度器和缓存在关键位置更新指标，可以随时取快照，或导出为
+    Prometheus 文本格式和 JSON lines，用于分析下载时间花在哪里。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, _Metric] = {}
+
+    def counter(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter, name, help, labelnames)
+
+    def gauge(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge, name, help, labelnames)
+
+    def histogram(self, name: str, help: str, labelnames: Iterable[str] = (),
+                  buckets: Iterable[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, help, labelnames, buckets=buckets)
+
+    def _register(self, cls, name, help, labelnames, **kwargs):
+        """同名指标只注册一次，重复注册返回已有的对象"""
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, labelnames, **kwargs)
+            elif not isinstance(metric, cls):
+                raise Exception(f"指标 {name} 已注册为 {metric.type}")
+            return metric
+
+    def metrics(self) -> List[_Metric]:
+        with self._lock:
+            return list(self._metrics.values())
+
+    def snapshot(self) -> Dict[str, Any]:
+        """所有指标的当前值 {名称: {'type', 'help', 'samples': [{'labels', 'value'}]}}"""
+        return {
+            metric.name: {
+                'type': metric.type,
+                'help': metric.help,
+                'samples': [{'labels': labels, 'value': value}
+                            for labels, value in metric.samples()],
+            }
+            for metric in self.metrics()
+        }
+
+    def reset(self):
+        for metric in self.metrics():
+            metric.reset()
+
+    def to_prometheus(self) -> str:
+        """Prometheus 文本格式 (text/plain; version=0.0.4)"""
+        lines = []
+        for metric in self.metrics():
+            lines.append(f"# HELP {metric.name} {_escape_help(metric.help)}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for labels, value in metric.samples():
+                if metric.type == 'histogram':
+                    for bound, count in value['buckets'].items():
+                        lines.append(f"{metric.name}_bucket{_format_labels(labels, le=bound)} {count}")
+                    lines.append(f"{metric.name}_sum{_format_labels(labels)} {_format_value(value['sum'])}")
+                    lines.append(f"{metric.name}_count{_format_labels(labels)} {value['count']}")
+                else:
+                    lines.append(f"{metric.name}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+    def to_json_lines(self, timestamp: Optional[float] = None) -> str:
+        """每个样本一行 JSON，便于追加到日志文件后按时间分析"""
+        timestamp = time.time() if timestamp is None else timestamp
+        lines = []
+        for metric in self.metrics():
+            for labels, value in metric.samples():
+                lines.append(json.dumps({
+                    'timestamp': timestamp,
+                    'name': metric.name,
+                    'type': metric.type,
+                    'labels': labels,
+                    'value': value,
+                }, ensure_ascii=False))
+        return ''.join(line + '\n' for line in lines)
+
+    def write_prometheus(self, path):
+        """原子写入 Prometheus 文本文件 (可供 node_exporter 的 textfile collector 读取)"""
+        path = os.fspath(path)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+    def append_json_lines(self, path):
+        """把当前快照追加到 JSON lines 文件"""
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(self.to_json_lines())
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        if value.is_integer():
+            return str(int(value)) if abs(value) < 1e15 else repr(value)
+        return repr(value)
+    return str(value)
+
+
+def _escape_help(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def _format_labels(labels: Dict[str, str], **extra) -> str:
+    labels = dict(labels, **extra)
+    if not labels:
+        return ''
+    parts = []
+    for name, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        parts.append(f'{name}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+_registry: Optional[MetricsRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_metrics() -> MetricsRegistry:
+    """获取进程内共享的指标注册表"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = MetricsRegistry()
+        return _registry
+
+
+# ---- 下载相关指标 ----
+
+_metrics = get_metrics()
+
+BYTES_DOWNLOADED = _metrics.counter(
+    'downloader_bytes_total', '从各主机收到的字节数', ['host'])
+ACTIVE_CONNECTIONS = _metrics.gauge(
+    'downloader_active_connections', '正在进行的分段连接数', ['host'])
+SEGMENT_SECONDS = _metrics.histogram(
+    'downloader_segment_request_seconds', '一次分段请求从发出到结束的耗时', ['host'])
+TTFB_SECONDS = _metrics.histogram(
+    'downloader_ttfb_seconds', '分段请求的首字节时间', ['host'])
+RETRIES = _metrics.counter(
+    'downloader_retries_total', '分段请求失败次数 (按原因)', ['host', 'cause'])
+DOWNLOADS = _metrics.counter(
+    'downloader_downloads_total', '结束的下载任务数 (按结果)', ['result'])
+DOWNLOAD_SECONDS = _metrics.histogram(
+    'downloader_download_seconds', '下载任务从开始到结束的耗时', ['result'], DURATION_BUCKETS)
+CACHE_LOOKUPS = _metrics.counter(
+    'downloader_cache_lookups_total', '制品缓存查找次数 (hit/miss/stale)', ['result'])
+QUEUE_WAIT_SECONDS = _metrics.histogram(
+    'downloader_queue_wait_seconds', '任务在调度队列中等待的时间', [], DURATION_BUCKETS)
+QUEUED_TASKS = _metrics.gauge(
+    'downloader_queued_tasks', '调度队列中等待的任务数')
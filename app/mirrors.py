@@ -0,0 +1,168 @@
+from typing import Optional, List, Dict, Any
+
+from app.stats import LatencyStats
+
+
+class Mirror:
+    """下载镜像及其实测表现"""
+
+    def __init__(self, url: str, etag: Optional[str] = None, last_modified: Optional[str] = None):
+        self.url = url
+        self.etag = etag
+        self.last_modified = last_modified
+
+        # 统计信息
+        self.bytes = 0
+        self.elapsed = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.active = 0
+        self.disabled = False
+        self.ttfb = LatencyStats()
+
+    @property
+    def throughput(self) -> float:
+        """实测吞吐量 (bytes/s)，尚无数据时返回 0"""
+        if self.elapsed <= 0:
+            return 0.0
+        return self.bytes / self.elapsed
+
+    @property
+    def error_rate(self) -> float:
+        """请求失败率"""
+        if self.requests == 0:
+            return 0.0
+        return self.errors / self.requests
+
+    @property
+    def score(self) -> float:
+        """综合评分：吞吐量按失败率折算"""
+        return self.throughput * (1.0 - self.error_rate) ** 2
+
+    def record_request(self):
+        """记录一次请求"""
+        self.requests += 1
+
+    def record_bytes(self, nbytes: int, seconds: float):
+        """记录一次数据到达"""
+        self.bytes += nbytes
+        self.elapsed += max(seconds, 0.0)
+        self.consecutive_errors = 0
+
+    def record_ttfb(self, seconds: float):
+        """记录一次请求的首字节时间"""
+        self.ttfb.record(seconds)
+
+    def record_error(self):
+        """记录一次请求失败"""
+        self.errors += 1
+        self.consecutive_errors += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'url': self.url,
+            'throughput': self.throughput,
+            'error_rate': self.error_rate,
+            'requests': self.requests,
+            'ttfb': self.ttfb.average,
+            'active': self.active,
+            'disabled': self.disabled,
+        }
+
+
+class MirrorPool:
+    """镜像调度：按评分为分段挑选镜像，并把工作从表现差的镜像上移走"""
+
+    def __init__(self, mirrors: List[Mirror],
+                 max_consecutive_errors: int = 3,
+                 max_error_rate: float = 0.5,
+                 min_sample_bytes: int = 1024 * 1024,
+                 slow_ratio: float = 0.25):
+        """
+        初始化镜像池
+
+        Args:
+            mirrors: 已确认内容一致的镜像列表，第一个为主地址
+            max_consecutive_errors: 连续失败多少次后停用镜像
+            max_error_rate: 失败率超过该值 (至少 4 次请求) 后停用镜像
+            min_sample_bytes: 参与速度比较前至少需要的实测字节数
+            slow_ratio: 评分低于最佳镜像该比例时视为慢镜像
+        """
+        self.mirrors = mirrors
+        self.max_consecutive_errors = max_consecutive_errors
+        self.max_error_rate = max_error_rate
+        self.min_sample_bytes = min_sample_bytes
+        self.slow_ratio = slow_ratio
+
+    def __len__(self):
+        return len(self.mirrors)
+
+    def _usable(self) -> List[Mirror]:
+        usable = [m for m in self.mirrors if not m.disabled]
+        # 全部停用时仍然返回全部镜像，由重试次数决定最终成败
+        return usable or self.mirrors
+
+    def _best_score(self, exclude: Optional[Mirror] = None) -> float:
+        scores = [m.score for m in self._usable()
+                  if m is not exclude and m.bytes >= self.min_sample_bytes]
+        return max(scores, default=0.0)
+
+    def pick(self) -> Mirror:
+        """为新的请求挑选镜像"""
+        usable = self._usable()
+        # 还没有实测数据的镜像优先试用
+        for mirror in usable:
+            if mirror.requests == 0 and mirror.active == 0:
+                return mirror
+        # 按评分分摊并发，避免所有连接挤在同一个镜像上
+        return max(usable, key=lambda m: m.score / (m.active + 1))
+
+    def acquire(self) -> Mirror:
+        """挑选镜像并计入活动连接"""
+        mirror = self.pick()
+        mirror.active += 1
+        mirror.record_request()
+        return mirror
+
+    def release(self, mirror: Mirror):
+        """释放活动连接"""
+        mirror.active = max(0, mirror.active - 1)
+
+    def report_error(self, mirror: Mirror):
+        """记录失败并在必要时停用镜像"""
+        mirror.record_error()
+        if len(self.mirrors) < 2:
+            return
+        if (mirror.consecutive_errors >= self.max_consecutive_errors or
+                (mirror.requests >= 4 and mirror.error_rate > self.max_error_rate)):
+            if not mirror.disabled:
+                print(f"停用镜像: {mirror.url}")
+            mirror.disabled = True
+
+    def should_leave(self, mirror: Mirror) -> bool:
+        """当前镜像是否应当让出正在下载的分段"""
+        if len(self.mirrors) < 2:
+            return False
+        if mirror.disabled:
+            return any(not m.disabled for m in self.mirrors)
+        if mirror.bytes < self.min_sample_bytes:
+            return False
+        best = self._best_score(exclude=mirror)
+        if best <= 0 or mirror.score >= best * self.slow_ratio:
+            return False
+        # 只有确实会换到其他镜像时才让出，避免反复重连同一个镜像
+        return self.pick() is not mirror
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """镜像统计快照"""
+        return [m.to_dict() for m in self.mirrors]
+
+
+def validators_agree(a: Mirror, b: Mirror) -> bool:
+    """两个镜像是否有相同的 ETag 或 Last-Modified"""
+    if a.etag and a.etag == b.etag:
+        return True
+    if a.last_modified and a.last_modified == b.last_modified:
+        return True
+    return False
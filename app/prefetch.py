@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import threading
+from pathlib import Path
+from typing import Optional, Callable, Dict, Any, List
+
+from app.catalog import CatalogEntry, select, read_selectors
+from app.limiter import TokenBucket
+from app.scheduler import get_scheduler, DownloadScheduler, DownloadTask
+
+# 预取任务的优先级，低于界面和命令行提交的下载 (默认 0)
+PREFETCH_PRIORITY = -10
+# 每个预取下载最多占用的连接数，主机的其余连接名额留给用户的下载
+PREFETCH_CONNECTIONS = 2
+# 所有预取下载共享的默认速度上限 (bytes/s)
+DEFAULT_SPEED_LIMIT = 2 * 1024 * 1024
+MANIFEST_NAME = 'prefetch_manifest.json'
+# 固定预取的版本，每行一个选择条件；文件不存在时预取整个目录
+PINS_PATH = 'resource/prefetch.txt'
+
+
+def pinned_entries(software: Dict[str, Any], pins_path: str = PINS_PATH) -> List[CatalogEntry]:
+    """固定清单选中的版本，清单不存在或为空时返回整个目录"""
+    selectors = read_selectors(pins_path) if os.path.exists(pins_path) else []
+    return select(software, selectors)
+
+
+class Prefetcher:
+    """预取软件目录，提前填充制品缓存
+
+    按目录顺序逐个提交低优先级任务，同一时刻最多 max_parallel 个预取下载，每个最多占用
+    PREFETCH_CONNECTIONS 个连接，其余调度名额留给用户的下载；所有预取下载共用一个限速器。缓存中已有且远端未变的版本由
+    调度器直接判为缓存命中，不再下载。
+
+    结果记录在缓存目录下的清单中 {'updated_at', 'entries': {'分类/名称/版本': {...}}}，
+    state 为 warm 表示已在缓存中，可用 warm_entries() 查询。
+    """
+
+    def __init__(self, scheduler: Optional[DownloadScheduler] = None,
+                 speed_limit: Optional[int] = DEFAULT_SPEED_LIMIT,
+                 max_parallel: int = 1,
+                 manifest_path: Optional[str] = None,
+                 progress_callback: Optional[Callable[[int, int, CatalogEntry, Dict[str, Any]], None]] = None):
+        """
+        Args:
+            scheduler: 下载调度器，默认使用进程共享的调度器，必须启用缓存
+            speed_limit: 所有预取下载合计的速度上限 (bytes/s)，None 或 0 表示只受全局限速约束
+            max_parallel: 同时进行的预取下载数
+            manifest_path: 清单文件，默认放在缓存目录下
+            progress_callback: 每个版本处理完后调用 (已完成数, 总数, 版本, 清单记录)
+        """
+        self.scheduler = scheduler or get_scheduler()
+        if not self.scheduler.cache:
+            raise Exception("预取需要启用制品缓存")
+        self.limiter = TokenBucket(speed_limit)
+        self.max_parallel = max(1, max_parallel)
+        self.manifest_path = Path(manifest_path or self.scheduler.cache.root / MANIFEST_NAME)
+        self.progress_callback = progress_callback
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._tasks: List[DownloadTask] = []
+        self.manifest = self._load()
+
+    # ---- 清单 ----
+
+    def _load(self) -> Dict[str, Any]:
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if isinstance(manifest.get('entries'), dict):
+                return manifest
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"读取预取清单失败，重新记录: {e}")
+        return {'updated_at': None, 'entries': {}}
+
+    def _save(self):
+        with self._lock:
+            self.manifest['updated_at'] = time.time()
+            data = json.dumps(self.manifest, ensure_ascii=False, indent=2)
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = str(self.manifest_path) + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, self.manifest_path)
+
+    def warm_entries(self) -> Dict[str, Dict[str, Any]]:
+        """清单中已在缓存里的版本 (文件被淘汰或删除的不算)"""
+        with self._lock:
+            entries = dict(self.manifest['entries'])
+        return {key: record for key, record in entries.items()
+                if record.get('state') == 'warm' and record.get('path') and os.path.exists(record['path'])}
+
+    # ---- 执行 ----
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, entries: List[CatalogEntry]):
+        """在后台线程中预取，已在运行时忽略"""
+        if self.running:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.run, args=(entries,), daemon=True)
+        self._thread.start()
+
+    def stop(self, wait: bool = False):
+        """停止预取，取消正在进行的预取下载 (已下载部分按续传日志保留)"""
+        self._stop_event.set()
+        with self._lock:
+            tasks = list(self._tasks)
+        for task in tasks:
+            self.scheduler.cancel(task.id)
+        if wait and self._thread is not None:
+            self._thread.join()
+
+    def run(self, entries: List[CatalogEntry]) -> Dict[str, Dict[str, Any]]:
+        """预取 entries 并等待结束，返回本次各版本的清单记录"""
+        entries = [entry for entry in entries if entry.url]
+        results: Dict[str, Dict[str, Any]] = {}
+        pending = list(entries)
+        active: List[tuple] = []
+        while (pending or active) and not self._stop_event.is_set():
+            while pending and len(active) < self.max_parallel:
+                entry = pending.pop(0)
+                task = self._submit(entry)
+                active.append((entry, task))
+            for entry, task in list(active):
+                if task.wait(0.2 / len(active)):
+                    active.remove((entry, task))
+                    results[entry.key] = self._record(entry, task)
+                    if self.progress_callback:
+                        self.progress_callback(len(results), len(entries), entry, results[entry.key])
+        # 被 stop() 打断时收尾已取消的任务
+        for entry, task in active:
+            if task.wait(10):
+                results[entry.key] = self._record(entry, task)
+        return results
+
+    def _submit(self, entry: CatalogEntry) -> DownloadTask:
+        save_path = self.scheduler.cache.download_path(entry.filename)
+        task = self.scheduler.submit(entry.url, save_path, mirrors=entry.mirrors,
+                                     name=f"预取 {entry.name} {entry.version}",
+                                     priority=PREFETCH_PRIORITY, max_connections=PREFETCH_CONNECTIONS,
+                                     checksum=entry.checksum,
+                                     limiter=self.limiter, progress_callback=lambda progress: None)
+        # 同一文件已由用户提交时调度器返回已有任务，只跟踪结果，停止预取时不取消它
+        if task.priority == PREFETCH_PRIORITY:
+            with self._lock:
+                self._tasks.append(task)
+        return task
+
+    def _record(self, entry: CatalogEntry, task: DownloadTask) -> Dict[str, Any]:
+        """把任务结果写入清单"""
+        with self._lock:
+            if task in self._tasks:
+                self._tasks.remove(task)
+        record = {
+            'url': entry.url,
+            'checksum': entry.checksum,
+            'checked_at': time.time(),
+        }
+        if task.state == DownloadTask.COMPLETED:
+            record.update(state='warm', path=str(task.result_path), fetched=not task.cache_hit,
+                          size=os.path.getsize(task.result_path) if os.path.exists(task.result_path) else None)
+        else:
+            record.update(state=task.state, error=task.error)
+        with self._lock:
+            previous = self.manifest['entries'].get(entry.key)
+            if task.state == DownloadTask.CANCELLED and previous and previous.get('state') == 'warm':
+                # 取消只说明这次没有确认，之前记录的缓存仍然可用
+                return previous
+            self.manifest['entries'][entry.key] = record
+        self._save()
+        return record
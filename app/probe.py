@@ -0,0 +1,176 @@
+import os
+import json
+import time
+import threading
+from pathlib import Path
+from typing import Optional, Dict, Any
+
+from app.engine import get_engine
+
+DEFAULT_PROBE_CACHE = os.path.join('data', 'probe_cache.json')
+
+
+class ProbeResult:
+    """一次 HEAD 探测得到的文件元数据"""
+
+    def __init__(self, url: str, total_size: int = 0,
+                 etag: Optional[str] = None,
+                 last_modified: Optional[str] = None,
+                 accept_ranges: bool = False,
+                 checked_at: Optional[float] = None):
+        self.url = url
+        self.total_size = total_size
+        self.etag = etag
+        self.last_modified = last_modified
+        self.accept_ranges = accept_ranges
+        self.checked_at = checked_at or time.time()
+        self.revalidated = False  # 本次是否由 304 确认
+
+    @classmethod
+    def from_headers(cls, url: str, headers) -> 'ProbeResult':
+        return cls(
+            url,
+            total_size=int(headers.get('content-length', 0)),
+            etag=headers.get('etag'),
+            last_modified=headers.get('last-modified'),
+            accept_ranges='bytes' in headers.get('accept-ranges', '').lower(),
+        )
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.checked_at
+
+    def conditional_headers(self) -> Dict[str, str]:
+        """用于重新验证的条件请求头"""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def same_content(self, etag: Optional[str], last_modified: Optional[str],
+                     total_size: Optional[int] = None) -> bool:
+        """与记录的校验信息比较，判断远端是否仍是同一个文件"""
+        if self.etag and etag:
+            return self.etag == etag
+        if self.last_modified and last_modified:
+            return self.last_modified == last_modified
+        # 服务器没有提供校验信息时只能比较大小
+        return total_size is not None and total_size > 0 and self.total_size == total_size
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'total_size': self.total_size,
+            'etag': self.etag,
+            'last_modified': self.last_modified,
+            'accept_ranges': self.accept_ranges,
+            'checked_at': self.checked_at,
+        }
+
+
+class ProbeCache:
+    """URL 元数据缓存
+
+    持久化保存每个 URL 最近一次的 Content-Length/ETag/Last-Modified。TTL 内的探测
+    直接使用缓存结果，不发请求；过期后带 If-None-Match/If-Modified-Since 重新验证，
+    文件未变时只花一次 304 往返。
+    """
+
+    def __init__(self, path: str = DEFAULT_PROBE_CACHE, ttl: float = 600):
+        """
+        初始化探测缓存
+
+        Args:
+            path: 持久化文件路径
+            ttl: 探测结果的有效期 (秒)
+        """
+        self.path = Path(path)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: Dict[str, ProbeResult] = {}
+        self._load()
+
+    def get(self, url: str) -> Optional[ProbeResult]:
+        """读取记录，不论是否过期"""
+        with self._lock:
+            return self._entries.get(url)
+
+    def fresh(self, url: str) -> Optional[ProbeResult]:
+        """读取 TTL 内的记录"""
+        result = self.get(url)
+        if result is not None and result.age < self.ttl:
+            return result
+        return None
+
+    def put(self, result: ProbeResult):
+        with self._lock:
+            self._entries[result.url] = result
+            self._save()
+
+    def invalidate(self, url: str):
+        """远端文件已变更时清除记录"""
+        with self._lock:
+            if self._entries.pop(url, None) is not None:
+                self._save()
+
+    async def probe(self, url: str, proxy: Optional[str] = None,
+                    timeout: float = 30, use_cache: bool = True) -> ProbeResult:
+        """探测 URL 元数据 (在引擎线程中调用)"""
+        cached = self.get(url) if use_cache else None
+        if cached is not None and cached.age < self.ttl:
+            return cached
+
+        headers = cached.conditional_headers() if cached else None
+        response = await get_engine().head(url, headers=headers, proxy=proxy, timeout=timeout)
+        if response.status == 304 and cached is not None:
+            cached.checked_at = time.time()
+            cached.revalidated = True
+            self.put(cached)
+            return cached
+
+        response.raise_for_status()
+        result = ProbeResult.from_headers(url, response.headers)
+        self.put(result)
+        return result
+
+    def probe_sync(self, url: str, proxy: Optional[str] = None, timeout: float = 30) -> ProbeResult:
+        """同步探测，TTL 内直接返回而不经过引擎线程"""
+        cached = self.fresh(url)
+        if cached is not None:
+            return cached
+        return get_engine().run(self.probe(url, proxy, timeout))
+
+    def _load(self):
+        try:
+            if self.path.exists():
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                for url, item in data.items():
+                    self._entries[url] = ProbeResult(url, **item)
+        except Exception as e:
+            print(f"读取探测缓存失败: {e}")
+
+    def _save(self):
+        """原子写入 (调用方持有锁)"""
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_name(self.path.name + '.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({url: r.to_dict() for url, r in self._entries.items()}, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"写入探测缓存失败: {e}")
+
+
+_probe_cache: Optional[ProbeCache] = None
+_probe_cache_lock = threading.Lock()
+
+
+def get_probe_cache() -> ProbeCache:
+    """获取进程内共享的探测缓存"""
+    global _probe_cache
+    with _probe_cache_lock:
+        if _probe_cache is None:
+            _probe_cache = ProbeCache()
+        return _probe_cache
@@ -0,0 +1,113 @@
+import time
+import asyncio
+import threading
+from typing import Optional, Callable, List, Dict, Any
+
+
+class ProgressEvent:
+    """下载进度事件"""
+
+    PROGRESS = 'progress'
+    STATE = 'state'          # 排队、暂停等状态变化
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+    TERMINAL = (COMPLETED, FAILED, CANCELLED)
+
+    __slots__ = ('kind', 'downloaded', 'total', 'progress', 'speed', 'eta',
+                 'state', 'error', 'path', 'timestamp')
+
+    def __init__(self, kind: str, downloaded: int = 0, total: int = 0,
+                 progress: int = 0, speed: float = 0, eta: int = 0,
+                 state: Optional[str] = None, error: Optional[str] = None,
+                 path: Optional[str] = None):
+        self.kind = kind
+        self.downloaded = downloaded
+        self.total = total
+        self.progress = progress
+        self.speed = speed
+        self.eta = eta
+        self.state = state
+        self.error = error
+        self.path = path
+        self.timestamp = time.time()
+
+    @property
+    def terminal(self) -> bool:
+        """是否为结束事件 (完成、失败或取消)"""
+        return self.kind in self.TERMINAL
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f"ProgressEvent({self.kind}, {self.progress}%, {self.downloaded}/{self.total})"
+
+
+class ProgressStream:
+    """进度事件流
+
+    下载过程中只更新计数，不再每个数据块回调一次；由 run() 按固定频率采样，
+    有变化时合并成一个 progress 事件发出。完成、失败、取消作为结束事件立即发出，
+    结束之后才订阅的回调也会收到结束事件。
+
+    回调在发布事件的线程 (通常是下载引擎线程) 中执行，应尽快返回。
+    """
+
+    def __init__(self, interval: float = 0.2):
+        """
+        Args:
+            interval: progress 事件的最短间隔 (秒)
+        """
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._subscribers: List[Callable[[ProgressEvent], None]] = []
+        self.last_event: Optional[ProgressEvent] = None
+        self.final_event: Optional[ProgressEvent] = None
+
+    def subscribe(self, callback: Callable[[ProgressEvent], None]) -> Callable[[ProgressEvent], None]:
+        """订阅事件，返回回调本身便于取消订阅"""
+        with self._lock:
+            self._subscribers.append(callback)
+            final = self.final_event
+        if final is not None:
+            self._deliver(callback, final)
+        return callback
+
+    def unsubscribe(self, callback: Callable[[ProgressEvent], None]):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def publish(self, event: ProgressEvent):
+        """发出事件"""
+        with self._lock:
+            self.last_event = event
+            if event.terminal:
+                self.final_event = event
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            self._deliver(callback, event)
+
+    def reset(self):
+        """重新开始 (例如失败后重试) 时清除结束状态"""
+        with self._lock:
+            self.final_event = None
+
+    async def run(self, sample: Callable[[], ProgressEvent]):
+        """按固定频率采样进度并在有变化时发出，由调用方取消"""
+        last = None
+        while True:
+            event = sample()
+            if last is None or (event.downloaded, event.total) != (last.downloaded, last.total):
+                self.publish(event)
+                last = event
+            await asyncio.sleep(self.interval)
+
+    @staticmethod
+    def _deliver(callback: Callable[[ProgressEvent], None], event: ProgressEvent):
+        try:
+            callback(event)
+        except Exception as e:
+            print(f"进度回调异常: {e}")
@@ -0,0 +1,116 @@
+import time
+import random
+import asyncio
+import threading
+import aiohttp
+import httpx
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+
+class HTTPStatusError(Exception):
+    """服务器返回错误状态码，带上 Retry-After 便于重试时遵守"""
+
+    def __init__(self, status: int, retry_after: Optional[float] = None):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str], now: Optional[float] = None) -> Optional[float]:
+    """解析 Retry-After 头 (秒数或 HTTP 日期)，返回需要等待的秒数"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    now = time.time() if now is None else now
+    return max(0.0, date.timestamp() - now)
+
+
+def retry_cause(error: BaseException) -> str:
+    """失败原因的分类，用作重试指标的标签"""
+    if isinstance(error, HTTPStatusError):
+        return f"http_{error.status}"
+    if isinstance(error, (asyncio.TimeoutError, httpx.TimeoutException)):
+        return 'timeout'
+    if isinstance(error, (aiohttp.ClientPayloadError, httpx.RemoteProtocolError)):
+        return 'incomplete'
+    if isinstance(error, (aiohttp.ClientConnectionError, httpx.TransportError, ConnectionError)):
+        return 'connection'
+    return 'other'
+
+
+class RetryPolicy:
+    """指数退避
+
+    第 n 次重试前等待 base * 2^(n-1) 秒 (不超过 max_delay)，实际等待时间在 [0, 上限]
+    之间随机取值 (full jitter)，避免多个连接在同一时刻一起重连。
+    服务器给出 Retry-After 时至少等待该时长，但不超过 max_retry_after。
+    """
+
+    def __init__(self, base: float = 0.5, max_delay: float = 30.0,
+                 max_retry_after: float = 300.0):
+        """
+        Args:
+            base: 第一次重试的退避上限 (秒)
+            max_delay: 退避上限的最大值 (秒)
+            max_retry_after: 最多遵守多长的 Retry-After (秒)
+        """
+        self.base = base
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """第 attempt 次 (从 1 开始) 重试前的等待时间"""
+        cap = min(self.max_delay, self.base * (2 ** max(0, attempt - 1)))
+        delay = random.uniform(0, cap)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_retry_after))
+        return delay
+
+
+class RetryBudget:
+    """整个下载共享的重试预算
+
+    每次重试消耗一个令牌，令牌用完后不再重试。成功收到数据会按比例返还令牌
+    (不超过初始额度)，网络时断时续但一直有进展的下载不会因为累计重试次数而失败；
+    持续失败则很快耗尽预算，不会在多个分段上反复重试。
+    """
+
+    def __init__(self, tokens: int, refill_bytes: int = 4 * 1024 * 1024):
+        """
+        Args:
+            tokens: 初始 (也是最大) 重试次数
+            refill_bytes: 每成功收到多少字节返还一个令牌，0 表示不返还
+        """
+        self._lock = threading.Lock()
+        self.capacity = max(0, tokens)
+        self.refill_bytes = refill_bytes
+        self._tokens = float(self.capacity)
+        self.used = 0
+
+    @property
+    def remaining(self) -> int:
+        with self._lock:
+            return int(self._tokens)
+
+    def acquire(self) -> bool:
+        """申请一次重试，预算不足时返回 False"""
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            self.used += 1
+            return True
+
+    def deposit(self, nbytes: int):
+        """记录成功收到的数据"""
+        if not self.refill_bytes or nbytes <= 0:
+            return
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + nbytes / self.refill_bytes)
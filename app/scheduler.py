@@ -0,0 +1,519 @@
+import time
+import threading
+import itertools
+from pathlib import Path
+from urllib.parse import urlparse
+from typing import Optional, Callable, Dict, Any, List
+
+from app.download import Downloader
+from app.journal import DownloadJournal
+from app.cache import get_cache
+from app.probe import get_probe_cache
+from app.progress import ProgressStream, ProgressEvent
+from app.diskspace import free_space, device_of, format_size
+from app import metrics
+
+
+class DownloadTask:
+    """调度队列中的一个下载任务"""
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    PAUSED = 'paused'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+    STATE_NAMES = {
+        QUEUED: '等待中',
+        RUNNING: '下载中',
+        PAUSED: '已暂停',
+        COMPLETED: '已完成',
+        FAILED: '失败',
+        CANCELLED: '已取消',
+    }
+
+    _ids = itertools.count(1)
+
+    def __init__(self, url: str, save_path: str,
+                 mirrors: Optional[List[str]] = None,
+                 name: Optional[str] = None,
+                 priority: int = 0,
+                 downloader_kwargs: Optional[Dict[str, Any]] = None,
+                 max_connections: Optional[int] = None):
+        self.id = next(self._ids)
+        self.url = url
+        self.save_path = save_path
+        self.result_path = save_path  # 完成后文件的实际位置 (移入缓存后会变化)
+        self.cache_hit = False
+        self.mirrors = mirrors or []
+        self.name = name or Path(save_path).name
+        self.priority = priority
+        self.host = urlparse(url).netloc.lower()
+        self.downloader_kwargs = downloader_kwargs or {}
+
+        self.state = self.QUEUED
+        self.error = None
+        self.connections = 0
+        self.max_connections = max_connections  # 本任务最多占用的连接数，None 表示按调度器设置
+        self.required_space = 0  # 探测到文件大小后还需要的磁盘空间
+        self.downloader: Optional[Downloader] = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel_requested = False
+        self._done_event = threading.Event()
+        # 进度、状态变化和结束事件
+        self.events = ProgressStream()
+
+    @property
+    def finished(self) -> bool:
+        """任务是否已结束 (完成、失败或取消)"""
+        return self.state in (self.COMPLETED, self.FAILED, self.CANCELLED)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """等待任务结束，超时返回 False"""
+        return self._done_event.wait(timeout)
+
+    def get_progress(self) -> int:
+        """下载进度百分比"""
+        if self.state == self.COMPLETED:
+            return 100
+        if self.downloader:
+            return self.downloader.get_progress()
+        return 0
+
+    def progress_event(self, kind: str = ProgressEvent.STATE) -> ProgressEvent:
+        """按任务当前状态生成事件"""
+        status = self.downloader.get_status() if self.downloader else {}
+        return ProgressEvent(kind, status.get('downloaded', 0), status.get('total', 0),
+                             self.get_progress(), status.get('speed', 0), status.get('eta', 0),
+                             state=self.state, error=self.error, path=self.result_path)
+
+    def to_dict(self) -> Dict[str, Any]:
+        status = self.downloader.get_status() if self.downloader else {}
+        return {
+            'id': self.id,
+            'name': self.name,
+            'url': self.url,
+            'host': self.host,
+            'save_path': self.save_path,
+            'result_path': self.result_path,
+            'cache_hit': self.cache_hit,
+            'priority': self.priority,
+            'state': self.state,
+            'state_name': self.STATE_NAMES[self.state],
+            'progress': self.get_progress(),
+            'downloaded': status.get('downloaded', 0),
+            'total': status.get('total', 0),
+            'speed': status.get('speed', 0),
+            'eta': status.get('eta', 0),
+            'segments': len(status.get('segments', [])),
+            'retries': status.get('retries', 0),
+            'connections': self.connections,
+            'required_space': self.required_space,
+            'error': self.error,
+            'wait_time': (self.started_at or time.time()) - self.created_at,
+        }
+
+
+class DownloadScheduler:
+    """全局下载调度器
+
+    所有下载先进入队列，按优先级依次启动。同时进行的下载数量和每个主机的连接总数
+    都有上限，避免大量点击把同一个镜像站的连接占满而被限流。
+
+    启动前检查磁盘空间：同一磁盘上正在进行的下载还没分配的空间视为已占用，
+    放不下时任务回到队列等待，磁盘本身的空间都不够时任务直接失败。
+    """
+
+    def __init__(self, max_concurrent: int = 3,
+                 max_connections_per_host: int = 8,
+                 connections_per_download: int = 8,
+                 cache=None,
+                 auto_tune: bool = True,
+                 http2: bool = True,
+                 min_free_space: int = 256 * 1024 * 1024):
+        """
+        初始化调度器
+
+        Args:
+            max_concurrent: 同时进行的下载数
+            max_connections_per_host: 同一主机上所有下载的连接总数上限
+            connections_per_download: 单个下载最多使用的连接数
+            cache: 制品缓存，默认使用进程共享缓存；传入 False 表示不使用缓存
+            auto_tune: 下载按实测吞吐量自动调整连接数，connections_per_download 为上限
+            http2: 服务器支持时使用 HTTP/2，一个下载的所有分段只占用一个连接
+            min_free_space: 下载完成后磁盘至少保留的可用空间 (bytes)
+        """
+        self.cache = get_cache() if cache is None else cache
+        self.max_concurrent = max_concurrent
+        self.max_connections_per_host = max_connections_per_host
+        self.connections_per_download = connections_per_download
+        self.auto_tune = auto_tune
+        self.http2 = http2
+        self.min_free_space = min_free_space
+
+        self._lock = threading.RLock()
+        self._queue: List[DownloadTask] = []
+        self._running: List[DownloadTask] = []
+        self._history: List[DownloadTask] = []
+        self._host_connections: Dict[str, int] = {}
+        self._listeners: List[Callable[[DownloadTask], None]] = []
+
+    # ---- 提交与查询 ----
+
+    def submit(self, url: str, save_path: str,
+               mirrors: Optional[List[str]] = None,
+               name: Optional[str] = None,
+               priority: int = 0,
+               max_connections: Optional[int] = None,
+               **downloader_kwargs) -> DownloadTask:
+        """提交下载任务，返回任务对象
+
+        max_connections 限制该任务最多占用的连接数 (不超过 connections_per_download)，
+        用于预取等后台下载，避免占满主机的连接名额。
+        """
+        task = DownloadTask(url, save_path, mirrors, name, priority, downloader_kwargs, max_connections)
+        
+        # 缓存命中时立即完成，不启动下载
+        cached = self._lookup_cache(url, downloader_kwargs) if self.cache else None
+        if cached is not None:
+            task.result_path = str(cached)
+            task.cache_hit = True
+            self._finish(task, DownloadTask.COMPLETED)
+            return task
+            
+        with self._lock:
+            # 同一文件正在下载或排队时直接复用
+            for existing in self._running + self._queue:
+                if existing.save_path == task.save_path:
+                    return existing
+            self._insert(task)
+        self._notify(task)
+        self._dispatch()
+        return task
+
+    def get_task(self, task_id: int) -> Optional[DownloadTask]:
+        with self._lock:
+            for task in self._running + self._queue + self._history:
+                if task.id == task_id:
+                    return task
+        return None
+
+    def tasks(self) -> List[DownloadTask]:
+        """按显示顺序返回所有任务：进行中、排队中、已结束"""
+        with self._lock:
+            return list(self._running) + list(self._queue) + list(self._history)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """所有任务的状态快照"""
+        return [task.to_dict() for task in self.tasks()]
+
+    def clear_finished(self):
+        """清除已结束的任务记录"""
+        with self._lock:
+            self._history.clear()
+
+    def add_listener(self, callback: Callable[[DownloadTask], None]):
+        """注册任务状态变化回调，回调可能在任意线程中执行"""
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback: Callable[[DownloadTask], None]):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    # ---- 队列调整 ----
+
+    def set_priority(self, task_id: int, priority: int):
+        """修改排队任务的优先级"""
+        with self._lock:
+            task = self._find_queued(task_id)
+            if task is None:
+                return
+            self._queue.remove(task)
+            task.priority = priority
+            self._insert(task)
+        self._dispatch()
+
+    def move(self, task_id: int, delta: int):
+        """在队列中前后移动任务，delta < 0 表示提前"""
+        with self._lock:
+            task = self._find_queued(task_id)
+            if task is None:
+                return
+            index = self._queue.index(task)
+            new_index = max(0, min(len(self._queue) - 1, index + delta))
+            if new_index == index:
+                return
+            self._queue.remove(task)
+            self._queue.insert(new_index, task)
+            # 采用相邻任务的优先级，保证队列始终按优先级有序
+            neighbour = self._queue[new_index + 1] if delta < 0 else self._queue[new_index - 1]
+            task.priority = neighbour.priority
+        self._dispatch()
+
+    def set_max_concurrent(self, max_concurrent: int):
+        """修改同时下载数"""
+        self.max_concurrent = max(1, max_concurrent)
+        self._dispatch()
+
+    def set_max_connections_per_host(self, max_connections: int):
+        """修改每个主机的连接总数上限"""
+        self.max_connections_per_host = max(1, max_connections)
+        self._dispatch()
+
+    # ---- 任务控制 ----
+
+    def pause(self, task_id: int):
+        """暂停任务，排队中的任务暂停后不会被启动"""
+        task = self.get_task(task_id)
+        if task is None or task.finished:
+            return
+        if task.downloader and task.state == DownloadTask.RUNNING:
+            task.downloader.pause()
+        task.state = DownloadTask.PAUSED
+        self._notify(task)
+
+    def resume(self, task_id: int):
+        """恢复暂停的任务"""
+        task = self.get_task(task_id)
+        if task is None or task.state != DownloadTask.PAUSED:
+            return
+        with self._lock:
+            running = task in self._running
+        if running:
+            if task.downloader:
+                task.downloader.resume()
+            task.state = DownloadTask.RUNNING
+        else:
+            task.state = DownloadTask.QUEUED
+        self._notify(task)
+        self._dispatch()
+
+    def cancel(self, task_id: int):
+        """取消任务"""
+        task = self.get_task(task_id)
+        if task is None or task.finished:
+            return
+        task._cancel_requested = True
+        with self._lock:
+            queued = task in self._queue
+            if queued:
+                self._queue.remove(task)
+        if queued:
+            self._finish(task, DownloadTask.CANCELLED)
+        elif task.downloader:
+            task.downloader.cancel()
+
+    # ---- 内部实现 ----
+
+    def _insert(self, task: DownloadTask):
+        """按优先级插入队列，同优先级先来先服务"""
+        index = len(self._queue)
+        for i, queued in enumerate(self._queue):
+            if queued.priority < task.priority:
+                index = i
+                break
+        self._queue.insert(index, task)
+
+    def _lookup_cache(self, url: str, downloader_kwargs: Dict[str, Any]) -> Optional[Path]:
+        """查找缓存制品
+
+        按 SHA-256 命中时内容一定正确；只按 URL 命中时先确认远端文件未变，
+        探测结果在有效期内不发请求，否则最多一次 304 往返。
+        """
+        checksum = downloader_kwargs.get('checksum')
+        path = self.cache.lookup(url, checksum)
+        if path is None or self.cache.sha256_of(checksum):
+            metrics.CACHE_LOOKUPS.inc(1, 'miss' if path is None else 'hit')
+            return path
+
+        validators = self.cache.validators(url)
+        try:
+            probe = get_probe_cache().probe_sync(url, proxy=downloader_kwargs.get('proxy'))
+        except Exception as e:
+            # 无法连接服务器时使用已有的缓存
+            print(f"确认缓存是否最新失败，使用缓存文件: {e}")
+            metrics.CACHE_LOOKUPS.inc(1, 'hit')
+            return path
+        if validators and probe.same_content(validators['etag'], validators['last_modified'],
+                                             validators['size']):
+            metrics.CACHE_LOOKUPS.inc(1, 'hit')
+            return path
+        print(f"远端文件已更新，重新下载: {url}")
+        metrics.CACHE_LOOKUPS.inc(1, 'stale')
+        self.cache.forget_url(url)
+        return None
+
+    def _find_queued(self, task_id: int) -> Optional[DownloadTask]:
+        for task in self._queue:
+            if task.id == task_id:
+                return task
+        return None
+
+    def _free_connections(self, host: str) -> int:
+        return self.max_connections_per_host - self._host_connections.get(host, 0)
+
+    def _dispatch(self):
+        """在并发数和主机连接数允许的范围内启动排队任务"""
+        started = []
+        with self._lock:
+            for task in list(self._queue):
+                if len(self._running) >= self.max_concurrent:
+                    break
+                if task.state != DownloadTask.QUEUED:
+                    continue
+                # 因磁盘空间回到队列的任务等其他下载释放预留后再启动
+                if task.required_space and not self._space_available(task):
+                    continue
+                free = self._free_connections(task.host)
+                if free <= 0:
+                    continue
+                limit = self.connections_per_download
+                if task.max_connections:
+                    limit = min(limit, max(1, task.max_connections))
+                task.connections = min(limit, free)
+                self._host_connections[task.host] = self._host_connections.get(task.host, 0) + task.connections
+                self._queue.remove(task)
+                self._running.append(task)
+                task.state = DownloadTask.RUNNING
+                task.started_at = time.time()
+                started.append(task)
+
+        for task in started:
+            self._notify(task)
+            thread = threading.Thread(target=self._run_task, args=(task,), daemon=True)
+            thread.start()
+
+    def _reserved_space(self, task: DownloadTask) -> int:
+        """同一磁盘上其他正在进行的下载还需要的空间"""
+        device = device_of(task.save_path)
+        reserved = 0
+        for other in self._running:
+            if other is not task and other.downloader and device_of(other.save_path) == device:
+                reserved += other.downloader.required_space()
+        return reserved
+
+    def _space_available(self, task: DownloadTask) -> bool:
+        free = free_space(task.save_path) - self.min_free_space
+        return task.required_space <= free - self._reserved_space(task)
+
+    def _admit(self, task: DownloadTask) -> bool:
+        """检查磁盘空间，放不下时把任务放回队列并返回 False"""
+        with self._lock:
+            needed = task.required_space
+            if needed <= 0:
+                return True
+            free = free_space(task.save_path) - self.min_free_space
+            if needed > free:
+                raise Exception(f"磁盘空间不足：需要 {format_size(needed)}，"
+                                f"可用 {format_size(max(0, free))}")
+            if needed <= free - self._reserved_space(task):
+                return True
+            # 空间被其他下载预留，等它们结束后再试
+            self._running.remove(task)
+            self._release_connections(task, task.connections)
+            task.downloader = None
+            if task.state == DownloadTask.RUNNING:
+                task.state = DownloadTask.QUEUED
+            task.started_at = None
+            self._insert(task)
+        print(f"磁盘空间不足，等待其他下载完成: {task.name}")
+        self._notify(task)
+        self._dispatch()
+        return False
+
+    def _release_connections(self, task: DownloadTask, count: int):
+        with self._lock:
+            remaining = self._host_connections.get(task.host, 0) - count
+            if remaining > 0:
+                self._host_connections[task.host] = remaining
+            else:
+                self._host_connections.pop(task.host, None)
+            task.connections -= count
+
+    def _run_task(self, task: DownloadTask):
+        """在工作线程中执行下载"""
+        try:
+            kwargs = dict(task.downloader_kwargs)
+            kwargs['max_workers'] = task.connections
+            kwargs.setdefault('auto_tune', self.auto_tune)
+            kwargs.setdefault('http2', self.http2)
+            if self.cache:
+                # 边下载边计算 SHA-256，存入缓存时不必再读一遍文件
+                kwargs.setdefault('compute_digest', 'sha256')
+            downloader = Downloader(task.url, task.save_path, mirrors=task.mirrors, **kwargs)
+            task.downloader = downloader
+            # 下载器的进度事件转发给任务，结束事件等存入缓存后由任务自己发出
+            downloader.events.subscribe(
+                lambda event: event.kind == ProgressEvent.PROGRESS and task.events.publish(event))
+
+            # 服务器不支持分段时归还多申请的连接；HTTP/2 下所有分段复用一个连接
+            used = 1 if downloader.multiplexed else downloader.max_workers
+            unused = task.connections - used
+            if unused > 0:
+                self._release_connections(task, unused)
+                self._dispatch()
+
+            if task._cancel_requested:
+                raise Exception("下载已取消")
+            task.required_space = downloader.required_space()
+            if not self._admit(task):
+                return
+            # 排队等待的时间包括因磁盘空间回到队列后再次等待的时间
+            metrics.QUEUE_WAIT_SECONDS.observe(time.time() - task.created_at)
+            if task.state == DownloadTask.PAUSED:
+                downloader.pause()
+            downloader.run()
+            if self.cache:
+                # 只使用下载时实际算出的摘要，没有时由缓存读取文件计算，不信任目录给出的校验和
+                task.result_path = str(self.cache.store(task.url, task.save_path, downloader.digest,
+                                                        downloader.etag, downloader.last_modified))
+                # 文件已移入缓存，下载目录中的完成标记不再需要
+                DownloadJournal(task.save_path).remove()
+            self._finish(task, DownloadTask.COMPLETED)
+        except Exception as e:
+            if task._cancel_requested:
+                self._finish(task, DownloadTask.CANCELLED)
+            else:
+                print(f"下载任务失败 {task.name}: {e}")
+                self._finish(task, DownloadTask.FAILED, str(e))
+
+    def _finish(self, task: DownloadTask, state: str, error: Optional[str] = None):
+        with self._lock:
+            if task in self._running:
+                self._running.remove(task)
+                self._release_connections(task, task.connections)
+            task.state = state
+            task.error = error
+            task.finished_at = time.time()
+            self._history.insert(0, task)
+        # 任务的结束状态与事件类型同名；先发出结束事件再唤醒等待者
+        task.events.publish(task.progress_event(state))
+        task._done_event.set()
+        self._notify(task)
+        self._dispatch()
+
+    def _notify(self, task: DownloadTask):
+        metrics.QUEUED_TASKS.set(len(self._queue))
+        if not task.finished:
+            task.events.publish(task.progress_event())
+        for callback in list(self._listeners):
+            try:
+                callback(task)
+            except Exception as e:
+                print(f"下载任务回调异常: {e}")
+
+
+_scheduler: Optional[DownloadScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> DownloadScheduler:
+    """获取进程内共享的下载调度器"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = DownloadScheduler()
+        return _scheduler
@@ -0,0 +1,107 @@
+import math
+import time
+import threading
+from collections import deque
+from typing import Optional, Dict, Any
+
+
+class RateMeter:
+    """滑动窗口吞吐量
+
+    字节数按固定时间片累加，只保留最近 window 秒；窗口吞吐量再做指数加权平滑 (EWMA)，
+    平滑的时间常数为 smoothing 秒，避免显示的速度随每个数据块跳动。
+    只统计本次实际收到的字节，续传前已下载的部分不计入。
+    """
+
+    def __init__(self, window: float = 5.0, smoothing: float = 2.0, resolution: float = 0.25):
+        """
+        Args:
+            window: 滑动窗口长度 (秒)
+            smoothing: EWMA 时间常数 (秒)
+            resolution: 时间片长度 (秒)
+        """
+        self.window = window
+        self.smoothing = smoothing
+        self.resolution = resolution
+        self._lock = threading.Lock()
+        self._buckets = deque()  # [时间片开始时间, 字节数]
+        self._started: Optional[float] = None
+        self._ewma: Optional[float] = None
+        self._ewma_time = 0.0
+        self.total = 0
+
+    def add(self, nbytes: int, now: Optional[float] = None):
+        """记录收到的字节数"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if self._started is None:
+                self._started = now
+            if self._buckets and now - self._buckets[-1][0] < self.resolution:
+                self._buckets[-1][1] += nbytes
+            else:
+                self._buckets.append([now, nbytes])
+            self.total += nbytes
+
+    def rate(self, now: Optional[float] = None) -> float:
+        """窗口内的平均吞吐量 (bytes/s)"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            return self._rate(now)
+
+    def _rate(self, now: float) -> float:
+        while self._buckets and now - self._buckets[0][0] > self.window:
+            self._buckets.popleft()
+        if self._started is None:
+            return 0.0
+        # 刚开始时窗口还没填满，按实际经过的时间计算
+        span = min(self.window, now - self._started)
+        if span < self.resolution:
+            return 0.0
+        return sum(b[1] for b in self._buckets) / span
+
+    def speed(self, now: Optional[float] = None) -> float:
+        """平滑后的吞吐量 (bytes/s)"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            current = self._rate(now)
+            if not self._ewma:
+                # 第一次有数据时直接取窗口值，不从 0 开始爬升
+                self._ewma = current
+            else:
+                weight = 1 - math.exp(-(now - self._ewma_time) / self.smoothing)
+                self._ewma += weight * (current - self._ewma)
+            self._ewma_time = now
+            return self._ewma
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+            self._started = None
+            self._ewma = None
+            self.total = 0
+
+
+class LatencyStats:
+    """请求延迟统计 (如首字节时间)，记录最近值、最小值和 EWMA"""
+
+    def __init__(self, alpha: float = 0.3):
+        self.alpha = alpha
+        self.last: Optional[float] = None
+        self.min: Optional[float] = None
+        self.average: Optional[float] = None
+        self.count = 0
+
+    def record(self, seconds: float):
+        self.last = seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.average = seconds if self.average is None else (
+            self.alpha * seconds + (1 - self.alpha) * self.average)
+        self.count += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'last': self.last,
+            'min': self.min,
+            'average': self.average,
+            'count': self.count,
+        }
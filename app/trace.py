@@ -0,0 +1,204 @@
+import os
+import json
+import time
+import atexit
+import itertools
+import threading
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, List
+
+import aiohttp
+
+# 设置该环境变量 (输出文件路径) 时在启动时开启跟踪，退出时写出
+TRACE_ENV = 'DOWNLOADER_TRACE'
+
+
+class Tracer:
+    """下载过程的时间线记录
+
+    按 Chrome trace-event 格式记录区间 (ph='X') 和瞬时事件 (ph='i')，导出的 JSON
+    可以直接在 Perfetto (ui.perfetto.dev) 或 chrome://tracing 中打开。每个下载和
+    它的每个连接各占一条轨道 (tid)，探测、建立连接、TLS、首字节、写入、重试、
+    收尾等阶段在轨道上按时间排列。
+
+    时间戳使用 time.monotonic()，调用方可以直接传入已有的 monotonic 时间。
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.pid = os.getpid()
+        self._origin = time.monotonic()
+        self._lock = threading.Lock()
+        self._events: List[Dict[str, Any]] = []
+        self._tids = itertools.count(1)
+
+    def _us(self, t: float) -> float:
+        return round((t - self._origin) * 1e6, 3)
+
+    def _add(self, event: Dict[str, Any]):
+        with self._lock:
+            self._events.append(event)
+
+    def track(self, name: str) -> int:
+        """新建一条轨道，返回其 tid"""
+        tid = next(self._tids)
+        self._add({'ph': 'M', 'name': 'thread_name', 'pid': self.pid, 'tid': tid,
+                   'args': {'name': name}})
+        self._add({'ph': 'M', 'name': 'thread_sort_index', 'pid': self.pid, 'tid': tid,
+                   'args': {'sort_index': tid}})
+        return tid
+
+    def complete(self, name: str, start: float, end: Optional[float] = None,
+                 tid: int = 0, cat: str = 'download', **args):
+        """记录 [start, end] 区间，end 默认为当前时间"""
+        end = time.monotonic() if end is None else end
+        event = {'ph': 'X', 'name': name, 'cat': cat, 'pid': self.pid, 'tid': tid,
+                 'ts': self._us(start), 'dur': round(max(0.0, end - start) * 1e6, 3)}
+        if args:
+            event['args'] = args
+        self._add(event)
+
+    def instant(self, name: str, tid: int = 0, cat: str = 'download', **args):
+        """记录瞬时事件"""
+        event = {'ph': 'i', 'name': name, 'cat': cat, 'pid': self.pid, 'tid': tid,
+                 's': 't', 'ts': self._us(time.monotonic())}
+        if args:
+            event['args'] = args
+        self._add(event)
+
+    @contextmanager
+    def span(self, name: str, tid: int = 0, cat: str = 'download', **args):
+        """用 with 记录一段代码的耗时"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.complete(name, start, tid=tid, cat=cat, **args)
+
+    def events(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._events)
+
+    def to_json(self) -> Dict[str, Any]:
+        return {'traceEvents': self.events(), 'displayTimeUnit': 'ms'}
+
+    def export(self, path: Optional[str] = None) -> str:
+        """原子写入 trace JSON，返回文件路径"""
+        path = os.fspath(path or self.path or 'download_trace.json')
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_json(), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        return path
+
+
+_tracer: Optional[Tracer] = None
+_tracer_lock = threading.Lock()
+
+
+def active() -> Optional[Tracer]:
+    """当前的跟踪器，未开启跟踪时为 None
+
+    埋点处只做一次 None 判断，关闭时没有其他开销。
+    """
+    return _tracer
+
+
+def enable(path: Optional[str] = None) -> Tracer:
+    """开启跟踪
+
+    应在开始下载前调用：下载器在创建时取得跟踪器，建立连接的事件需要引擎会话在
+    跟踪开启后创建才会记录。
+    """
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer(path)
+        elif path:
+            _tracer.path = path
+        return _tracer
+
+
+def disable(export: bool = True) -> Optional[Tracer]:
+    """关闭跟踪，指定了输出路径时写出记录"""
+    global _tracer
+    with _tracer_lock:
+        tracer, _tracer = _tracer, None
+    if tracer is not None and export and tracer.path:
+        try:
+            print(f"下载跟踪已写入: {tracer.export()}")
+        except Exception as e:
+            print(f"写入下载跟踪失败: {e}")
+    return tracer
+
+
+# ---- HTTP 客户端的连接阶段 ----
+
+def _request_ctx(trace_config_ctx) -> Optional[Dict[str, Any]]:
+    ctx = trace_config_ctx.trace_request_ctx
+    return ctx if isinstance(ctx, dict) and _tracer is not None else None
+
+
+def _on_stage_start(stage: str):
+    async def callback(session, trace_config_ctx, params):
+        ctx = _request_ctx(trace_config_ctx)
+        if ctx is not None:
+            ctx[stage] = time.monotonic()
+    return callback
+
+
+def _on_stage_end(stage: str, name: str):
+    async def callback(session, trace_config_ctx, params):
+        ctx = _request_ctx(trace_config_ctx)
+        if ctx is not None and stage in ctx:
+            _tracer.complete(name, ctx.pop(stage), tid=ctx['tid'], cat='http')
+    return callback
+
+
+async def _on_connection_reuse(session, trace_config_ctx, params):
+    ctx = _request_ctx(trace_config_ctx)
+    if ctx is not None:
+        _tracer.instant('reuse connection', tid=ctx['tid'], cat='http')
+
+
+def aiohttp_trace_config() -> aiohttp.TraceConfig:
+    """aiohttp 的连接阶段回调，请求通过 trace_request_ctx={'tid': ...} 指定轨道
+
+    aiohttp 不单独报告 TLS 握手，'connect' 区间包含 TCP 连接和 TLS 握手。
+    """
+    config = aiohttp.TraceConfig()
+    config.on_connection_queued_start.append(_on_stage_start('queued'))
+    config.on_connection_queued_end.append(_on_stage_end('queued', 'wait for connection'))
+    config.on_dns_resolvehost_start.append(_on_stage_start('dns'))
+    config.on_dns_resolvehost_end.append(_on_stage_end('dns', 'dns'))
+    config.on_connection_create_start.append(_on_stage_start('connect'))
+    config.on_connection_create_end.append(_on_stage_end('connect', 'connect'))
+    config.on_connection_reuseconn.append(_on_connection_reuse)
+    return config
+
+
+def httpx_trace(tid: int):
+    """httpx 请求的 extensions['trace'] 回调，记录 TCP 连接、TLS 握手和 HTTP/2 各阶段"""
+    starts: Dict[str, float] = {}
+
+    async def callback(event_name: str, info: Dict[str, Any]):
+        tracer = _tracer
+        if tracer is None:
+            return
+        # 事件名形如 'connection.start_tls.started' / '.complete' / '.failed'
+        prefix, _, stage = event_name.rpartition('.')
+        if stage == 'started':
+            starts[prefix] = time.monotonic()
+        elif prefix in starts:
+            name = prefix.split('.', 1)[-1]
+            if stage == 'failed':
+                tracer.complete(name, starts.pop(prefix), tid=tid, cat='http', failed=True)
+            else:
+                tracer.complete(name, starts.pop(prefix), tid=tid, cat='http')
+
+    return callback
+
+
+if os.environ.get(TRACE_ENV):
+    enable(os.environ[TRACE_ENV])
+    atexit.register(disable)
@@ -0,0 +1,78 @@
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, AsyncIterator
+
+import aiohttp
+import httpx
+
+from app.engine import get_engine
+from app import trace
+from app.retry import HTTPStatusError, parse_retry_after
+
+
+class RangeResponse:
+    """分段请求的响应，屏蔽 aiohttp 和 httpx 的差异"""
+
+    def __init__(self, status: int, headers, http_version: str, chunks):
+        self.status = status
+        self.headers = headers
+        self.http_version = http_version
+        self._chunks = chunks
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise HTTPStatusError(self.status, parse_retry_after(self.headers.get('Retry-After')))
+
+    def iter_chunks(self, chunk_size: int) -> AsyncIterator[bytes]:
+        """按块读取响应内容"""
+        return self._chunks(chunk_size)
+
+
+class Http11Transport:
+    """HTTP/1.1 传输：每个分段占用连接池中的一个 TCP 连接"""
+
+    name = 'HTTP/1.1'
+    multiplexed = False
+
+    @asynccontextmanager
+    async def get(self, url: str, headers: Dict[str, str],
+                  proxy: Optional[str] = None, timeout: float = 30,
+                  trace_tid: Optional[int] = None) -> AsyncIterator[RangeResponse]:
+        session = await get_engine().get_session()
+        # 只限制连接和读取间隔，不限制大分段的总耗时
+        client_timeout = aiohttp.ClientTimeout(total=None, connect=timeout, sock_read=timeout)
+        trace_ctx = {'tid': trace_tid} if trace_tid is not None else None
+        async with session.get(url, headers=headers, proxy=proxy, timeout=client_timeout,
+                               trace_request_ctx=trace_ctx) as response:
+            yield RangeResponse(response.status, response.headers, self.name,
+                                response.content.iter_chunked)
+
+
+class Http2Transport:
+    """HTTP/2 传输：同一主机的所有分段作为流复用一个连接，新分段不需要再握手"""
+
+    name = 'HTTP/2'
+    multiplexed = True
+
+    @asynccontextmanager
+    async def get(self, url: str, headers: Dict[str, str],
+                  proxy: Optional[str] = None, timeout: float = 30,
+                  trace_tid: Optional[int] = None) -> AsyncIterator[RangeResponse]:
+        client = await get_engine().get_http2_client(proxy)
+        request_timeout = httpx.Timeout(None, connect=timeout, read=timeout)
+        extensions = {'trace': trace.httpx_trace(trace_tid)} if trace_tid is not None else None
+        async with client.stream('GET', url, headers=headers, timeout=request_timeout,
+                                 extensions=extensions) as response:
+            yield RangeResponse(response.status_code, response.headers, response.http_version,
+                                response.aiter_bytes)
+
+
+HTTP11 = Http11Transport()
+HTTP2 = Http2Transport()
+
+
+async def select_transport(url: str, proxy: Optional[str] = None,
+                           timeout: float = 30, http2: bool = True):
+    """按服务器是否支持 HTTP/2 选择传输方式，不支持时退回 HTTP/1.1"""
+    if http2 and await get_engine().supports_http2(url, proxy, timeout):
+        return HTTP2
+    return HTTP11
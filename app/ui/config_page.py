@@ -25,6 +25,13 @@ class ConfigPage(QWidget):
         cache_layout.addWidget(self.cache_dir_edit)
         cache_layout.addWidget(browse_btn)
         form.addRow(QLabel("缓存目录："), cache_layout)
+        # 缓存上限
+        self.cache_size_edit = QLineEdit(str(self.config.get('cache_max_size', 20)))
+        form.addRow(QLabel("缓存上限 (GB)："), self.cache_size_edit)
+        # 全局限速
+        self.speed_limit_edit = QLineEdit(str(self.config.get('speed_limit', '') or ''))
+        self.speed_limit_edit.setPlaceholderText("所有下载合计，留空或 0 表示不限速")
+        form.addRow(QLabel("全局限速 (KB/s)："), self.speed_limit_edit)
         layout.addLayout(form)
         # 保存按钮
         save_btn = QPushButton("保存配置")
@@ -40,6 +47,16 @@ class ConfigPage(QWidget):
     def save_config(self):
         self.config['download_url'] = self.download_url_edit.text().strip()
         self.config['cache_dir'] = self.cache_dir_edit.text().strip()
+        speed_limit = self.speed_limit_edit.text().strip()
+        if speed_limit and not speed_limit.isdigit():
+            QMessageBox.warning(self, "错误", "全局限速必须是整数")
+            return
+        self.config['speed_limit'] = int(speed_limit) if speed_limit else 0
+        cache_size = self.cache_size_edit.text().strip()
+        if not cache_size.isdigit() or int(cache_size) <= 0:
+            QMessageBox.warning(self, "错误", "缓存上限必须是正整数")
+            return
+        self.config['cache_max_size'] = int(cache_size)
         if self.on_save_callback:
             self.on_save_callback(self.config)
         QMessageBox.information(self, "提示", "配置已保存！") 
\ No newline at end of file
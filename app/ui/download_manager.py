@@ -1,40 +1,251 @@
-from PySide6.QtWidgets import QWidget, QVBoxLayout, QTableWidget, QTableWidgetItem, QHeaderView, QAbstractItemView, QProgressBar, QLabel
-from PySide6.QtCore import Qt
+from PySide6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QTableView, QHeaderView, QAbstractItemView, QLabel, QPushButton, QSpinBox, QStyledItemDelegate, QStyleOptionProgressBar, QStyle, QApplication
+from PySide6.QtCore import Qt, QTimer, QAbstractTableModel, QModelIndex, Signal
+from app.scheduler import get_scheduler, DownloadTask
+
+# 调度器快照的刷新间隔 (毫秒)
+REFRESH_INTERVAL = 500
+
+TaskIdRole = Qt.UserRole
+ProgressRole = Qt.UserRole + 1
+
+FINISHED_STATES = (DownloadTask.COMPLETED, DownloadTask.FAILED, DownloadTask.CANCELLED)
+
+
+def format_speed(speed):
+    """格式化下载速度"""
+    for unit in ('B/s', 'KB/s', 'MB/s'):
+        if speed < 1024:
+            return f"{speed:.1f} {unit}"
+        speed /= 1024
+    return f"{speed:.1f} GB/s"
+
+
+def format_eta(seconds):
+    """格式化剩余时间"""
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    return f"{seconds // 60:02d}:{seconds % 60:02d}"
+
+
+class DownloadTableModel(QAbstractTableModel):
+    """下载任务表格模型
+
+    每次刷新接收调度器的完整快照，只保存格式化后的显示内容。任务列表不变时
+    只对内容有变化的行发出一次 dataChanged；任务在进行中、排队、已结束之间移动
+    只调整行顺序 (选中状态跟随任务)，只有任务增减时才整体重置。
+    """
+
+    COLUMNS = ("名称", "主机", "优先级", "进度", "速度", "剩余时间", "分段", "重试", "状态")
+    PROGRESS_COLUMN = 3
 
-class DownloadManagerPage(QWidget):
     def __init__(self, parent=None):
+        super().__init__(parent)
+        self._ids = []
+        self._rows = []      # 每行各列的显示文本
+        self._progress = []  # 每行的进度百分比
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.COLUMNS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = index.row()
+        if role == Qt.DisplayRole:
+            return self._rows[row][index.column()]
+        if role == TaskIdRole:
+            return self._ids[row]
+        if role == ProgressRole:
+            return self._progress[row]
+        return None
+
+    def task_id(self, row):
+        return self._ids[row] if 0 <= row < len(self._ids) else None
+
+    def row_of(self, task_id):
+        try:
+            return self._ids.index(task_id)
+        except ValueError:
+            return -1
+
+    def update(self, tasks):
+        """按新的快照更新，返回是否整体重置了模型"""
+        ids = [task['id'] for task in tasks]
+        rows = [self._format(task) for task in tasks]
+        progress = [task['progress'] for task in tasks]
+        if ids != self._ids:
+            if set(ids) != set(self._ids):
+                self.beginResetModel()
+                self._ids, self._rows, self._progress = ids, rows, progress
+                self.endResetModel()
+                return True
+            self._reorder(ids, rows, progress)
+            return False
+
+        changed = [row for row in range(len(rows))
+                   if rows[row] != self._rows[row] or progress[row] != self._progress[row]]
+        self._rows, self._progress = rows, progress
+        if changed:
+            # 合并成一个区间通知视图，不逐行刷新
+            self.dataChanged.emit(self.index(changed[0], 0),
+                                  self.index(changed[-1], len(self.COLUMNS) - 1),
+                                  [Qt.DisplayRole, ProgressRole])
+        return False
+
+    def _reorder(self, ids, rows, progress):
+        """同一批任务换了顺序，更新持久索引让视图保持选中的任务"""
+        self.layoutAboutToBeChanged.emit()
+        old_ids = self._ids
+        self._ids, self._rows, self._progress = ids, rows, progress
+        new_rows = {task_id: row for row, task_id in enumerate(ids)}
+        old_indexes = self.persistentIndexList()
+        new_indexes = [self.index(new_rows[old_ids[index.row()]], index.column())
+                       for index in old_indexes]
+        self.changePersistentIndexList(old_indexes, new_indexes)
+        self.layoutChanged.emit()
+
+    @staticmethod
+    def _format(task):
+        running = task['state'] == DownloadTask.RUNNING
+        status = task['state_name']
+        if task['error']:
+            status = f"{status}: {task['error']}"
+        return (
+            task['name'],
+            task['host'],
+            str(task['priority']),
+            f"{task['progress']}%",
+            format_speed(task['speed']) if running else '',
+            format_eta(task['eta']) if running and task['eta'] else '',
+            str(task['segments']) if running else '',
+            str(task['retries']) if task['retries'] else '',
+            status,
+        )
+
+
+class ProgressDelegate(QStyledItemDelegate):
+    """在单元格内绘制进度条，不需要为每行创建控件"""
+
+    def paint(self, painter, option, index):
+        option_bar = QStyleOptionProgressBar()
+        option_bar.rect = option.rect.adjusted(2, 2, -2, -2)
+        option_bar.minimum = 0
+        option_bar.maximum = 100
+        option_bar.progress = index.data(ProgressRole) or 0
+        option_bar.text = index.data(Qt.DisplayRole)
+        option_bar.textVisible = True
+        option_bar.state = option.state
+        QApplication.style().drawControl(QStyle.CE_ProgressBar, option_bar, painter)
+
+
+class DownloadManagerPage(QWidget):
+    # 任务结束时发出 (任务快照)，用于在状态栏提示，不弹出模态对话框
+    task_finished = Signal(dict)
+
+    def __init__(self, scheduler=None, parent=None):
         super().__init__(parent)
         self.setObjectName("DownloadManagerPage")
         self.setWindowTitle("下载进度管理")
         self.setMinimumSize(700, 400)
+        self.scheduler = scheduler or get_scheduler()
+        self._states = {}  # 任务 id -> 上次刷新时的状态
         self.init_ui()
-        self.downloads = []  # [(name, version, progress, status)]
+        # 按固定频率从调度器取一次快照，批量更新模型
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.refresh_timer.start(REFRESH_INTERVAL)
 
     def init_ui(self):
         layout = QVBoxLayout()
-        self.table = QTableWidget(0, 4)
-        self.table.setHorizontalHeaderLabels(["名称", "版本", "进度", "状态"])
+        # 并发设置
+        settings_layout = QHBoxLayout()
+        self.concurrent_spin = QSpinBox()
+        self.concurrent_spin.setRange(1, 32)
+        self.concurrent_spin.setValue(self.scheduler.max_concurrent)
+        self.concurrent_spin.valueChanged.connect(self.scheduler.set_max_concurrent)
+        self.host_spin = QSpinBox()
+        self.host_spin.setRange(1, 64)
+        self.host_spin.setValue(self.scheduler.max_connections_per_host)
+        self.host_spin.valueChanged.connect(self.scheduler.set_max_connections_per_host)
+        settings_layout.addWidget(QLabel("同时下载数："))
+        settings_layout.addWidget(self.concurrent_spin)
+        settings_layout.addWidget(QLabel("每个主机连接数："))
+        settings_layout.addWidget(self.host_spin)
+        settings_layout.addStretch()
+        layout.addLayout(settings_layout)
+        # 任务列表
+        self.model = DownloadTableModel(self)
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        self.table.setItemDelegateForColumn(DownloadTableModel.PROGRESS_COLUMN, ProgressDelegate(self.table))
         self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.table.verticalHeader().setVisible(False)
         self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.summary_label = QLabel()
         layout.addWidget(QLabel("所有下载任务："))
         layout.addWidget(self.table)
+        layout.addWidget(self.summary_label)
+        # 队列操作
+        button_layout = QHBoxLayout()
+        for text, handler in (("上移", lambda: self.move_selected(-1)),
+                              ("下移", lambda: self.move_selected(1)),
+                              ("暂停", lambda: self._control(self.scheduler.pause)),
+                              ("继续", lambda: self._control(self.scheduler.resume)),
+                              ("取消", lambda: self._control(self.scheduler.cancel)),
+                              ("清除已结束", self.clear_finished)):
+            btn = QPushButton(text)
+            btn.clicked.connect(handler)
+            button_layout.addWidget(btn)
+        layout.addLayout(button_layout)
         self.setLayout(layout)
 
-    def add_download(self, name, version):
-        row = self.table.rowCount()
-        self.table.insertRow(row)
-        self.table.setItem(row, 0, QTableWidgetItem(name))
-        self.table.setItem(row, 1, QTableWidgetItem(version))
-        progress_bar = QProgressBar()
-        progress_bar.setValue(0)
-        self.table.setCellWidget(row, 2, progress_bar)
-        self.table.setItem(row, 3, QTableWidgetItem("等待中"))
-        self.downloads.append((name, version, progress_bar))
-        return progress_bar, row
-
-    def update_progress(self, row, value, status=None):
-        progress_bar = self.table.cellWidget(row, 2)
-        if progress_bar:
-            progress_bar.setValue(value)
-        if status:
-            self.table.setItem(row, 3, QTableWidgetItem(status)) 
\ No newline at end of file
+    def selected_task_id(self):
+        index = self.table.currentIndex()
+        return self.model.task_id(index.row()) if index.isValid() else None
+
+    def _control(self, action):
+        task_id = self.selected_task_id()
+        if task_id is not None:
+            action(task_id)
+            self.refresh()
+
+    def move_selected(self, delta):
+        self._control(lambda task_id: self.scheduler.move(task_id, delta))
+
+    def clear_finished(self):
+        self.scheduler.clear_finished()
+        self.refresh()
+
+    def refresh(self):
+        """取一次调度器快照更新模型，保持当前选中的任务"""
+        selected = self.selected_task_id()
+        tasks = self.scheduler.snapshot()
+        if self.model.update(tasks) and selected is not None:
+            row = self.model.row_of(selected)
+            if row >= 0:
+                self.table.selectRow(row)
+
+        running = sum(task['state'] == DownloadTask.RUNNING for task in tasks)
+        queued = sum(task['state'] == DownloadTask.QUEUED for task in tasks)
+        speed = sum(task['speed'] for task in tasks if task['state'] == DownloadTask.RUNNING)
+        self.summary_label.setText(f"下载中 {running} 个，等待中 {queued} 个，总速度 {format_speed(speed)}")
+
+        # 上次刷新时还未结束的任务现在结束了
+        states = {}
+        for task in tasks:
+            states[task['id']] = task['state']
+            previous = self._states.get(task['id'])
+            if task['state'] in FINISHED_STATES and previous not in FINISHED_STATES:
+                self.task_finished.emit(task)
+        self._states = states
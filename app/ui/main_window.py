@@ -1,5 +1,6 @@
+import threading
 from PySide6.QtWidgets import QMainWindow, QApplication, QVBoxLayout, QHBoxLayout, QWidget, QPushButton, QStackedWidget, QFrame, QMenuBar, QMenu
-from PySide6.QtCore import Qt
+from PySide6.QtCore import Qt, Signal, Slot
 from PySide6.QtGui import QIcon, QAction
 
 from .main_page import MainPage
@@ -7,8 +8,17 @@ from .search_page import SearchDialog
 from .download_manager import DownloadManagerPage
 from .config_page import ConfigPage
 from app.update import Updater
+from app.limiter import set_global_speed_limit
+from app.cache import get_cache
+from app.scheduler import get_scheduler, DownloadTask
+from app.integrity import checksum_from_entry
+from app.catalog import load_catalog, save_name
+from app.prefetch import Prefetcher, pinned_entries
 
 class MainWindow(QMainWindow):
+    # 预取进度 (已完成数, 总数, 提示)，从预取线程转到界面线程
+    prefetch_progress = Signal(int, int, str)
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle('软件下载管理器')
@@ -41,8 +51,8 @@ class MainWindow(QMainWindow):
         # 默认显示主页
         self.switch_page(0)
         
-        # 暂时禁用自动更新检查，避免启动时的线程问题
-        # self.check_update()
+        # 后台检查更新，不阻塞启动
+        self.updater.start_background_checks()
     
     def create_menu_bar(self):
         """创建菜单栏"""
@@ -90,6 +100,15 @@ class MainWindow(QMainWindow):
         update_action.triggered.connect(self.check_update)
         tools_menu.addAction(update_action)
         
+        # 预取动作：在后台把常用软件提前下载到缓存
+        self.prefetch_action = QAction('预取常用软件(&P)', self)
+        self.prefetch_action.setStatusTip('低速在后台下载常用软件到缓存，之后安装直接使用缓存')
+        self.prefetch_action.setCheckable(True)
+        self.prefetch_action.toggled.connect(self.toggle_prefetch)
+        tools_menu.addAction(self.prefetch_action)
+        self.prefetcher = None
+        self.prefetch_progress.connect(self.on_prefetch_progress)
+        
         # 帮助菜单
         help_menu = menubar.addMenu('帮助(&H)')
         
@@ -104,22 +123,17 @@ class MainWindow(QMainWindow):
 
     def init_interface(self):
         # 加载软件配置
-        import yaml
         try:
-            with open('resource/link_config.yaml', 'r', encoding='utf-8') as f:
-                software_tabs = yaml.safe_load(f)
-        except:
+            software_tabs = load_catalog()
+        except Exception:
             software_tabs = {}
-        
-        # 创建下载工作器工厂
-        from main import DownloadWorker
-        def download_worker_factory(url, save_path):
-            return DownloadWorker(url, save_path)
+        self.software_tabs = software_tabs
         
         # 创建页面
-        self.main_page = MainPage(software_tabs, download_worker_factory)
-        self.search_page = SearchDialog(software_tabs, download_worker_factory, self)
+        self.main_page = MainPage(software_tabs, self.submit_download)
+        self.search_page = SearchDialog(software_tabs, self.submit_download, self)
         self.download_manager = DownloadManagerPage()
+        self.download_manager.task_finished.connect(self.on_task_finished)
         self.config_page = ConfigPage({}, self.on_config_save)
         
         # 添加页面到堆叠窗口部件
@@ -138,9 +152,62 @@ class MainWindow(QMainWindow):
         if 0 <= index < len(page_names):
             self.statusBar().showMessage(f'当前页面: {page_names[index]}')
         
+    def submit_download(self, name, version, entry):
+        """把选中的版本提交给下载调度器，进度在下载管理页查看"""
+        url = entry.get('url')
+        if not url:
+            self.statusBar().showMessage(f'{name} {version}: 未找到下载链接', 5000)
+            return
+        save_path = get_cache().download_path(save_name(name, version))
+        # 提交时可能要确认缓存是否最新 (一次 HEAD 请求)，不在界面线程中等待
+        threading.Thread(target=get_scheduler().submit, args=(url, save_path),
+                         kwargs={'mirrors': entry.get('mirrors') or [],
+                                 'checksum': checksum_from_entry(entry)},
+                         daemon=True).start()
+        self.statusBar().showMessage(f'已加入下载队列: {name} {version} (Ctrl+D 查看进度)', 5000)
+        
+    def on_task_finished(self, task):
+        """下载结束时在状态栏提示"""
+        if task['state'] == DownloadTask.COMPLETED:
+            self.statusBar().showMessage(f"下载完成: {task['name']}，已保存到 {task['result_path']}")
+        elif task['state'] == DownloadTask.FAILED:
+            self.statusBar().showMessage(f"下载失败: {task['name']}: {task['error']}")
+        
+    def toggle_prefetch(self, checked):
+        """开始或停止预取"""
+        if not checked:
+            if self.prefetcher is not None:
+                self.prefetcher.stop()
+            self.statusBar().showMessage('已停止预取', 5000)
+            return
+        if self.prefetcher is None:
+            self.prefetcher = Prefetcher(progress_callback=self._prefetch_callback)
+        entries = [entry for entry in pinned_entries(self.software_tabs) if entry.url]
+        if not entries:
+            self.prefetch_action.setChecked(False)
+            return
+        self.prefetcher.start(entries)
+        self.statusBar().showMessage(f'正在后台预取 {len(entries)} 个版本', 5000)
+        
+    def _prefetch_callback(self, done, total, entry, record):
+        # 在预取线程中调用，通过信号交给界面线程
+        state = '已缓存' if record['state'] == 'warm' else '失败'
+        self.prefetch_progress.emit(done, total, f'{entry.name} {entry.version} {state}')
+        
+    @Slot(int, int, str)
+    def on_prefetch_progress(self, done, total, message):
+        self.statusBar().showMessage(f'预取 {done}/{total}: {message}', 5000)
+        if done >= total:
+            self.prefetch_action.setChecked(False)
+            self.statusBar().showMessage(f'预取完成，共 {total} 个版本', 5000)
+        
     def on_config_save(self, config):
         # 处理配置保存
-        pass
+        set_global_speed_limit((config.get('speed_limit') or 0) * 1024)
+        cache = get_cache()
+        if config.get('cache_dir'):
+            cache.set_root(config['cache_dir'])
+        cache.set_max_size(config.get('cache_max_size', 20) * 1024 ** 3)
         
     def check_update(self):
         """检查更新"""
@@ -157,5 +224,7 @@ class MainWindow(QMainWindow):
         
     def closeEvent(self, event):
         """关闭窗口时清理临时文件"""
+        if self.prefetcher is not None:
+            self.prefetcher.stop()
         self.updater.cleanup()
         super().closeEvent(event) 
\ No newline at end of file
@@ -1,19 +1,14 @@
-from PySide6.QtWidgets import QDialog, QWidget, QVBoxLayout, QTableWidget, QTableWidgetItem, QHeaderView, QAbstractItemView, QComboBox, QPushButton, QMessageBox, QLineEdit, QHBoxLayout, QLabel
+from PySide6.QtWidgets import QDialog, QWidget, QVBoxLayout, QTableWidget, QTableWidgetItem, QHeaderView, QAbstractItemView, QComboBox, QPushButton, QLineEdit, QHBoxLayout, QLabel
 from PySide6.QtGui import QIcon
-from PySide6.QtCore import QTimer
-import os
-
-CACHE_DIR = os.path.join('data', 'cache')
 
 class SearchDialog(QDialog):
-    def __init__(self, all_softwares, download_worker_factory, parent=None):
+    def __init__(self, all_softwares, submit_download, parent=None):
         super().__init__(parent)
         self.setObjectName("SearchDialog")
         self.setWindowTitle("软件搜索")
         self.setMinimumSize(700, 400)
         self.all_softwares = all_softwares
-        self.download_worker_factory = download_worker_factory
-        self.workers = []
+        self.submit_download = submit_download
         self.init_ui()
 
     def init_ui(self):
@@ -45,44 +40,10 @@ class SearchDialog(QDialog):
             self.result_table.setItem(row, 2, QTableWidgetItem(desc))
             combo = QComboBox()
             for ver in versions:
-                combo.addItem(str(ver.get('version', '')), ver.get('url', ''))
+                combo.addItem(str(ver.get('version', '')), ver)
             self.result_table.setCellWidget(row, 3, combo)
             btn = QPushButton("下载")
             self.result_table.setCellWidget(row, 4, btn)
-            def make_download_func(cmb, name, btn):
-                def download():
-                    url = cmb.currentData()
-                    if not url:
-                        QMessageBox.warning(self, "错误", "未找到下载链接")
-                        return
-                    filename = f"{name}_{cmb.currentText()}.exe"
-                    save_path = os.path.join(CACHE_DIR, filename)
-                    btn.setEnabled(False)
-                    anim_states = ["下载中", "下载中.", "下载中..", "下载中..."]
-                    anim_idx = [0]
-                    timer = QTimer()
-                    def update_anim():
-                        btn.setText(f"{anim_states[anim_idx[0]]} 0%")
-                        anim_idx[0] = (anim_idx[0] + 1) % len(anim_states)
-                    timer.timeout.connect(update_anim)
-                    timer.start(400)
-                    worker = self.download_worker_factory(url, save_path)
-                    self.workers.append(worker)
-                    def on_progress(val):
-                        btn.setText(f"{anim_states[anim_idx[0]]} {val}%")
-                    def on_finish(path):
-                        timer.stop()
-                        btn.setText("下载")
-                        btn.setEnabled(True)
-                        QMessageBox.information(self, "下载完成", f"已保存到: {path}")
-                    def on_error(msg):
-                        timer.stop()
-                        btn.setText("下载")
-                        btn.setEnabled(True)
-                        QMessageBox.critical(self, "下载失败", msg)
-                    worker.progress.connect(on_progress)
-                    worker.finished.connect(on_finish)
-                    worker.error.connect(on_error)
-                    worker.start()
-                return download
-            btn.clicked.connect(make_download_func(combo, name, btn)) 
\ No newline at end of file
+            # 下载交给调度器排队，进度在下载管理页查看
+            btn.clicked.connect(lambda _=False, cmb=combo, name=name:
+                                self.submit_download(name, cmb.currentText(), cmb.currentData() or {}))
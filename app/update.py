@@ -1,36 +1,102 @@
 import os
 import sys
 import json
+import time
 import shutil
 import requests
 import subprocess
 from pathlib import Path
-from PySide6.QtCore import QObject, Signal, QThread
+from PySide6.QtCore import QObject, Signal, Slot, QThread, QTimer
 from PySide6.QtWidgets import QMessageBox, QProgressDialog, QApplication
+from app.integrity import parse_checksum
+from app.download import Downloader
+from app.journal import DownloadJournal
+from app.delta import apply_delta, index_usable
+
+DEFAULT_MANIFEST_CACHE = os.path.join('data', 'update_manifest.json')
+# 后台检查更新的间隔 (秒)
+CHECK_INTERVAL = 6 * 3600
+
 
 class UpdateChecker(QObject):
-    """更新检查器"""
-    update_available = Signal(dict)  # 发现新版本信号
-    check_finished = Signal()  # 检查完成信号
-    error = Signal(str)  # 错误信号
+    """更新检查器
+
+    运行在 Updater 的常驻工作线程中。上次取得的清单连同 ETag/Last-Modified 保存在磁盘上，
+    之后的检查带 If-None-Match/If-Modified-Since，清单未变时服务器只返回 304。
+    信号的 bool 参数表示是否为用户手动检查。
+    """
+    update_available = Signal(dict, bool)  # 发现新版本信号
+    check_finished = Signal(bool)  # 检查完成 (没有新版本) 信号
+    error = Signal(str, bool)  # 错误信号
 
-    def __init__(self, current_version, update_url):
+    def __init__(self, current_version, update_url,
+                 cache_path=DEFAULT_MANIFEST_CACHE, timeout=(5, 15)):
         super().__init__()
         self.current_version = current_version
         self.update_url = update_url
+        self.cache_path = Path(cache_path)
+        self.timeout = timeout
+        self._session = None
 
-    def check_update(self):
+    @Slot(bool)
+    def check_update(self, manual=False):
         """检查更新"""
         try:
-            response = requests.get(self.update_url)
-            response.raise_for_status()
-            update_info = response.json()
-            
+            update_info = self.fetch_manifest()
             if self._compare_versions(update_info['version'], self.current_version) > 0:
-                self.update_available.emit(update_info)
-            self.check_finished.emit()
+                self.update_available.emit(update_info, manual)
+            else:
+                self.check_finished.emit(manual)
+        except Exception as e:
+            self.error.emit(f"检查更新失败: {str(e)}", manual)
+
+    def fetch_manifest(self):
+        """获取更新清单，未变化时使用磁盘缓存"""
+        if self._session is None:
+            # 会话在工作线程中创建，重复检查时复用连接
+            self._session = requests.Session()
+        cached = self._load_cache()
+        headers = {}
+        if cached:
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached['last_modified']
+        response = self._session.get(self.update_url, headers=headers, timeout=self.timeout)
+        if response.status_code == 304 and cached:
+            return cached['manifest']
+        response.raise_for_status()
+        update_info = response.json()
+        self._save_cache({
+            'url': self.update_url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'manifest': update_info,
+            'checked_at': time.time(),
+        })
+        return update_info
+
+    def _load_cache(self):
+        try:
+            if self.cache_path.exists():
+                with open(self.cache_path, 'r', encoding='utf-8') as f:
+                    cached = json.load(f)
+                if cached.get('url') == self.update_url and cached.get('manifest'):
+                    return cached
+        except Exception as e:
+            print(f"读取更新清单缓存失败: {e}")
+        return None
+
+    def _save_cache(self, cached):
+        """原子写入"""
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.cache_path.with_name(self.cache_path.name + '.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(cached, f, ensure_ascii=False)
+            os.replace(tmp_path, self.cache_path)
         except Exception as e:
-            self.error.emit(f"检查更新失败: {str(e)}")
+            print(f"写入更新清单缓存失败: {e}")
 
     def _compare_versions(self, version1, version2):
         """比较版本号"""
@@ -48,62 +114,161 @@ class UpdateChecker(QObject):
         return 0
 
 class UpdateDownloader(QThread):
-    """更新下载器"""
+    """更新下载器
+
+    使用与软件下载相同的 Downloader：多连接分段下载，中断或退出后从日志续传，
+    边下载边按更新清单的校验和校验。进度按固定间隔采样，百分比变化时才发出信号。
+
+    清单提供块索引且本地有旧版本安装包时先尝试增量更新，只下载变化的块。
+    """
     progress = Signal(int)
     finished = Signal(str)
     error = Signal(str)
 
-    def __init__(self, download_url, save_path):
+    def __init__(self, download_url, save_path, checksum=None, mirrors=None,
+                 blocks=None, seed_path=None):
         super().__init__()
         self.download_url = download_url
         self.save_path = save_path
+        self.checksum = checksum
+        self.mirrors = mirrors or []
+        self.blocks = blocks if index_usable(blocks) else None
+        self.seed_path = seed_path
+        self._downloader = None
+        self._cancelled = False
+        self._last_progress = -1
 
     def run(self):
         try:
-            response = requests.get(self.download_url, stream=True)
-            response.raise_for_status()
-            
-            total_size = int(response.headers.get('content-length', 0))
-            block_size = 1024
-            downloaded = 0
-            
-            with open(self.save_path, 'wb') as f:
-                for data in response.iter_content(block_size):
-                    downloaded += len(data)
-                    f.write(data)
-                    if total_size:
-                        progress = int(downloaded * 100 / total_size)
-                        self.progress.emit(progress)
-            
+            if self._try_delta():
+                self.finished.emit(self.save_path)
+                return
+            # 创建下载器时会探测服务器，必须在工作线程中进行
+            # 块索引同时用于完整下载时的分块校验，出错只重新下载损坏的块
+            self._downloader = Downloader(self.download_url, self.save_path,
+                                          mirrors=self.mirrors,
+                                          checksum=self.checksum,
+                                          blocks=self.blocks,
+                                          progress_callback=self._on_progress)
+            if self._cancelled:
+                return
+            self._downloader.run()
+            self.progress.emit(100)
             self.finished.emit(self.save_path)
         except Exception as e:
+            if self._cancelled:
+                # 已下载的部分保留，下次检查更新时续传
+                print(f"更新下载已取消: {self.save_path}")
+                return
             self.error.emit(f"下载更新失败: {str(e)}")
 
-class Updater:
-    """更新管理器"""
-    def __init__(self, parent=None):
-        self.parent = parent
+    def _try_delta(self):
+        """尝试增量更新，不可用或不划算时返回 False 由调用方完整下载"""
+        # 已有下载到一半的文件时续传更快
+        if not (self.blocks and self.seed_path) or os.path.exists(self.save_path):
+            return False
+        try:
+            return apply_delta(self.download_url, self.seed_path, self.blocks, self.save_path,
+                               self.checksum, progress_callback=self._on_progress,
+                               should_stop=lambda: self._cancelled)
+        except Exception as e:
+            if self._cancelled:
+                raise
+            print(f"增量更新失败，改为完整下载: {e}")
+            return False
+
+    def cancel(self):
+        """取消下载，已下载的部分保留用于续传"""
+        self._cancelled = True
+        if self._downloader:
+            self._downloader.cancel()
+
+    def _on_progress(self, progress):
+        if progress != self._last_progress:
+            self._last_progress = progress
+            self.progress.emit(progress)
+
+class Updater(QObject):
+    """更新管理器
+
+    检查更新在常驻的工作线程中进行，结果通过信号回到界面线程处理。
+    后台检查不打扰用户：出错只记录日志，本次运行中拒绝过的版本不再提示。
+    """
+    check_requested = Signal(bool)
+
+    def __init__(self, parent=None, check_interval=CHECK_INTERVAL):
+        super().__init__(parent)
+        self.window = parent
         self.current_version = "1.0.0"  # 当前版本
         self.update_url = "https://api.example.com/updates"  # 更新检查API
         self.temp_dir = Path("temp")
         self.temp_dir.mkdir(exist_ok=True)
+        self.downloader = None
+        self._prompting = False
+        self._declined_version = None
+
+        self._thread = QThread()
+        self._checker = UpdateChecker(self.current_version, self.update_url)
+        self._checker.moveToThread(self._thread)
+        self.check_requested.connect(self._checker.check_update)
+        self._checker.update_available.connect(self._on_update_available)
+        self._checker.check_finished.connect(self._on_check_finished)
+        self._checker.error.connect(self._on_check_error)
+
+        self._timer = QTimer(self)
+        self._timer.setInterval(int(check_interval * 1000))
+        self._timer.timeout.connect(lambda: self.check_requested.emit(False))
+
+    def start_background_checks(self):
+        """启动后台定期检查，第一次检查在事件循环开始后进行，不影响启动速度"""
+        self._ensure_thread()
+        QTimer.singleShot(0, lambda: self.check_requested.emit(False))
+        self._timer.start()
 
     def check_for_updates(self):
-        """检查更新"""
-        checker = UpdateChecker(self.current_version, self.update_url)
-        checker.update_available.connect(self._on_update_available)
-        checker.error.connect(self._on_error)
-        checker.check_finished.connect(lambda: print("检查完成"))
-        
-        # 在新线程中检查更新
-        thread = QThread()
-        checker.moveToThread(thread)
-        thread.started.connect(checker.check_update)
-        thread.start()
+        """检查更新 (用户手动触发)"""
+        self._ensure_thread()
+        self.check_requested.emit(True)
+
+    def _ensure_thread(self):
+        if not self._thread.isRunning():
+            self._thread.start()
+            QApplication.instance().aboutToQuit.connect(self._stop_thread)
+
+    def _stop_thread(self):
+        self._timer.stop()
+        if self._thread.isRunning():
+            self._thread.quit()
+            self._thread.wait(5000)
 
-    def _on_update_available(self, update_info):
+    @Slot(bool)
+    def _on_check_finished(self, manual):
+        if manual:
+            QMessageBox.information(self.window, "检查更新", f"当前已是最新版本 ({self.current_version})")
+
+    @Slot(str, bool)
+    def _on_check_error(self, error_msg, manual):
+        if manual:
+            self._on_error(error_msg)
+        else:
+            print(error_msg)
+
+    @Slot(dict, bool)
+    def _on_update_available(self, update_info, manual=True):
         """发现新版本"""
-        msg = QMessageBox(self.parent)
+        # 正在提示或下载时不重复打扰；后台检查不再提示用户拒绝过的版本
+        if self._prompting or (self.downloader and self.downloader.isRunning()):
+            return
+        if not manual and update_info['version'] == self._declined_version:
+            return
+        self._prompting = True
+        try:
+            self._prompt_update(update_info)
+        finally:
+            self._prompting = False
+
+    def _prompt_update(self, update_info):
+        msg = QMessageBox(self.window)
         msg.setWindowTitle("发现新版本")
         msg.setText(f"当前版本: {self.current_version}\n"
                    f"新版本: {update_info['version']}\n\n"
@@ -114,32 +279,57 @@ class Updater:
         
         if msg.exec() == QMessageBox.Yes:
             self._start_update(update_info)
+        else:
+            self._declined_version = update_info['version']
 
     def _start_update(self, update_info):
         """开始更新"""
         download_url = update_info['download_url']
         save_path = self.temp_dir / f"update_{update_info['version']}.exe"
         
+        checksum = update_info.get('checksum')
+        if parse_checksum(checksum) is None:
+            print(f"更新清单没有可用的校验和，跳过校验: {checksum}")
+            checksum = None
+        
         # 创建进度对话框
-        progress_dialog = QProgressDialog("正在下载更新...", "取消", 0, 100, self.parent)
+        progress_dialog = QProgressDialog("正在下载更新...", "取消", 0, 100, self.window)
         progress_dialog.setWindowTitle("下载更新")
         progress_dialog.setWindowModality(2)  # Qt.WindowModal
+        progress_dialog.setAutoClose(False)
+        progress_dialog.setAutoReset(False)
         progress_dialog.show()
         
-        # 创建下载器
-        downloader = UpdateDownloader(download_url, str(save_path))
+        # 创建下载器，同一版本的安装包保存在同一位置，再次下载时续传
+        downloader = UpdateDownloader(download_url, str(save_path), checksum,
+                                      update_info.get('mirrors'), update_info.get('blocks'),
+                                      self._delta_seed(save_path))
+        self.downloader = downloader
         downloader.progress.connect(progress_dialog.setValue)
-        downloader.finished.connect(lambda path: self._on_download_finished(path, update_info))
+        downloader.finished.connect(progress_dialog.close)
+        downloader.error.connect(progress_dialog.close)
+        # 连接到本对象的方法，下载线程发出的信号在界面线程中处理
+        downloader.finished.connect(self._on_download_finished)
         downloader.error.connect(self._on_error)
+        progress_dialog.canceled.connect(downloader.cancel)
         downloader.start()
 
-    def _on_download_finished(self, update_file, update_info):
+    def _delta_seed(self, exclude=None):
+        """增量更新的基准文件：最近一次下载完成的安装包，打包运行时也可以用程序本身"""
+        candidates = [path for path in self.temp_dir.glob('update_*.exe')
+                      if path != exclude and
+                      not DownloadJournal.in_progress(path)]
+        if candidates:
+            return str(max(candidates, key=lambda path: path.stat().st_mtime))
+        if getattr(sys, 'frozen', False):
+            return sys.executable
+        return None
+
+    @Slot(str)
+    def _on_download_finished(self, update_file):
         """下载完成"""
         try:
-            # 验证下载文件
-            if not self._verify_update_file(update_file, update_info['checksum']):
-                raise Exception("更新文件验证失败")
-            
+            # 下载过程中已按清单的校验和校验，校验失败不会走到这里
             # 启动更新程序
             self._launch_updater(update_file)
             
@@ -148,11 +338,6 @@ class Updater:
         except Exception as e:
             self._on_error(str(e))
 
-    def _verify_update_file(self, file_path, expected_checksum):
-        """验证更新文件"""
-        # TODO: 实现文件校验
-        return True
-
     def _launch_updater(self, update_file):
         """启动更新程序"""
         try:
@@ -160,13 +345,35 @@ class Updater:
         except Exception as e:
             raise Exception(f"启动更新程序失败: {str(e)}")
 
+    @Slot(str)
     def _on_error(self, error_msg):
         """处理错误"""
-        QMessageBox.critical(self.parent, "更新错误", error_msg)
+        QMessageBox.critical(self.window, "更新错误", error_msg)
 
     def cleanup(self):
-        """清理临时文件"""
-        try:
-            shutil.rmtree(self.temp_dir)
-        except:
-            pass
+        """清理临时文件
+
+        未下载完的安装包 (有续传日志) 保留，下次更新时继续下载；
+        最近一次下载完成的安装包保留作为下次增量更新的基准。
+        """
+        self._stop_thread()
+        if self.downloader and self.downloader.isRunning():
+            self.downloader.cancel()
+            self.downloader.wait(5000)
+        if not self.temp_dir.exists():
+            return
+        seed = self._delta_seed()
+        for path in self.temp_dir.iterdir():
+            if path.name.endswith(DownloadJournal.SUFFIX) or str(path) == seed:
+                continue
+            if DownloadJournal.in_progress(path):
+                continue
+            try:
+                if path.is_dir():
+                    shutil.rmtree(path)
+                else:
+                    path.unlink()
+                    # 连同下载完成时保留的日志一起删除
+                    DownloadJournal(path).remove()
+            except OSError:
+                pass
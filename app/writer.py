@@ -0,0 +1,150 @@
+import os
+import errno
+import threading
+from typing import Optional, Callable, Dict, List
+
+# Windows 没有 os.pwrite，退回到 lseek + write
+HAS_PWRITE = hasattr(os, 'pwrite')
+HAS_PWRITEV = hasattr(os, 'pwritev')
+# macOS 和 Windows 没有 posix_fallocate
+HAS_FALLOCATE = hasattr(os, 'posix_fallocate')
+# pwritev 一次最多提交的缓冲区数量 (IOV_MAX)
+MAX_IOV = 1024
+
+
+class FileWriter:
+    """定位写入器
+
+    一个文件只打开一个描述符，所有分段用 pwrite 按偏移直接写入收到的缓冲区，
+    不经过线程池，也不需要每个分段各自打开文件。写入页缓存通常只需几微秒，
+    直接在事件循环中完成比切换到工作线程更省。
+
+    coalesce_size > 0 时合并写入：同一分段连续到达的数据先暂存，累计到该大小后用
+    pwritev 一次写出，减少系统调用次数。暂存的数据在 flush() 之前不会出现在文件中。
+    """
+
+    def __init__(self, path, coalesce_size: int = 0,
+                 on_write: Optional[Callable[[int, bytes], None]] = None):
+        """
+        打开文件 (不存在时创建)
+
+        Args:
+            path: 文件路径
+            coalesce_size: 合并写入的阈值 (bytes)，0 表示每次直接写出
+            on_write: 数据真正写入文件后的回调 (offset, data)，用于边下载边校验
+        """
+        flags = os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+        self.fd = os.open(path, flags, 0o644)
+        self.coalesce_size = coalesce_size
+        self.on_write = on_write
+        self._lock = threading.Lock()
+        # 按结束偏移索引的暂存区: end -> (start, [chunks], size)
+        self._runs: Dict[int, list] = {}
+
+    def truncate(self, size: int):
+        """设置文件长度"""
+        os.ftruncate(self.fd, size)
+
+    def preallocate(self, size: int) -> bool:
+        """
+        为文件预先分配 size 字节的磁盘空间
+
+        文件系统支持 fallocate 时一次分配连续的块，避免多个分段乱序写入稀疏文件造成碎片，
+        空间不足也能在下载开始前发现。不支持时退回到设置文件长度 (Windows 上会实际分配，
+        其他系统得到稀疏文件)。已有的数据不受影响，文件不会被截短。
+
+        Returns:
+            是否真正分配了空间
+        """
+        if HAS_FALLOCATE:
+            try:
+                os.posix_fallocate(self.fd, 0, size)
+                return True
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    raise Exception("磁盘空间不足，无法预分配文件") from e
+                # 文件系统不支持 (如部分网络文件系统)
+        if os.fstat(self.fd).st_size < size:
+            os.ftruncate(self.fd, size)
+        return False
+
+    def write(self, offset: int, data: bytes):
+        """在 offset 处写入数据"""
+        if not self.coalesce_size:
+            self._write_run(offset, [data])
+            return
+        run = self._runs.pop(offset, None)
+        if run is None:
+            run = [offset, [], 0]
+        run[1].append(data)
+        run[2] += len(data)
+        if run[2] >= self.coalesce_size:
+            self._write_run(run[0], run[1])
+        else:
+            self._runs[offset + len(data)] = run
+
+    def flush(self):
+        """写出所有暂存的数据"""
+        runs, self._runs = self._runs, {}
+        for start, chunks, _ in runs.values():
+            self._write_run(start, chunks)
+
+    def sync(self):
+        """写出暂存数据并落盘"""
+        self.flush()
+        self.fsync()
+
+    def fsync(self):
+        """把已写出的数据落盘 (不包括暂存的数据)，可以在工作线程中调用"""
+        os.fsync(self.fd)
+
+    def close(self):
+        if self.fd < 0:
+            return
+        try:
+            self.flush()
+        finally:
+            os.close(self.fd)
+            self.fd = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _write_run(self, offset: int, chunks: List[bytes]):
+        """把连续的若干缓冲区写到 offset 处"""
+        if HAS_PWRITEV and len(chunks) > 1:
+            position = offset
+            for i in range(0, len(chunks), MAX_IOV):
+                batch = chunks[i:i + MAX_IOV]
+                size = sum(len(c) for c in batch)
+                written = os.pwritev(self.fd, batch, position)
+                if written < size:
+                    # 短写时剩余部分逐段补写
+                    self._write_all(position + written, b''.join(batch)[written:])
+                position += size
+        else:
+            position = offset
+            for chunk in chunks:
+                self._write_all(position, chunk)
+                position += len(chunk)
+
+        if self.on_write:
+            position = offset
+            for chunk in chunks:
+                self.on_write(position, chunk)
+                position += len(chunk)
+
+    def _write_all(self, offset: int, data: bytes):
+        view = memoryview(data)
+        while view:
+            if HAS_PWRITE:
+                written = os.pwrite(self.fd, view, offset)
+            else:
+                with self._lock:
+                    os.lseek(self.fd, offset, os.SEEK_SET)
+                    written = os.write(self.fd, view)
+            view = view[written:]
+            offset += written
@@ -0,0 +1,197 @@
+"""
+下载引擎基准测试
+
+在本进程内启动测试服务器 (benchmarks/range_server.py)，每个用例在独立的子进程中运行
+Downloader，分别统计耗时、吞吐量、CPU 时间、峰值内存和重复下载的字节数，
+结果写成 JSON 文件便于比较不同版本和配置。
+
+场景 (服务器行为):
+    fast        不限速
+    throttled   每个连接限速 4MB/s
+    latency     每个请求延迟 50ms，每个连接限速 8MB/s
+    no-ranges   不支持 Range 请求
+    resets      每 3 个请求有一个在传输中途被断开
+
+配置 (下载器参数):
+    w1 / w4 / w8          max_workers = 1 / 4 / 8
+    w8-chunk64k           max_workers = 8, chunk_size = 64KB
+    w8-nocoalesce         max_workers = 8, 不合并写入
+    autotune              auto_tune，最多 8 个连接
+
+用法:
+    python benchmarks/bench_download.py [--size MB] [--scenarios a,b] [--configs x,y]
+                                        [--repeat N] [--output results.json]
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import platform
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from range_server import RangeServer, ServerConfig
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+MB = 1024 * 1024
+
+SCENARIOS = {
+    'fast': {},
+    'throttled': {'rate': 4 * MB},
+    'latency': {'latency': 0.05, 'rate': 8 * MB},
+    'no-ranges': {'accept_ranges': False},
+    'resets': {'reset_every': 3},
+}
+
+CONFIGS = {
+    'w1': {'max_workers': 1},
+    'w4': {'max_workers': 4},
+    'w8': {'max_workers': 8},
+    'w8-chunk64k': {'max_workers': 8, 'chunk_size': 64 * 1024},
+    'w8-nocoalesce': {'max_workers': 8, 'write_coalesce': 0},
+    'autotune': {'max_workers': 8, 'auto_tune': True},
+}
+
+
+def run_child(spec: dict) -> dict:
+    """子进程：执行一次下载并输出测量结果"""
+    # 探测缓存、主机调优记录等写到临时目录，不影响用例之间的结果
+    os.chdir(spec['workdir'])
+    from app.download import Downloader
+    from app.integrity import file_digest
+
+    save_path = os.path.join(spec['workdir'], 'bench.bin')
+    result = {'ok': False, 'error': None}
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        downloader = Downloader(spec['url'], save_path, use_system_proxy=False,
+                                progress_callback=lambda progress: None, **spec['params'])
+        downloader.run()
+    except Exception as e:
+        result['error'] = str(e)
+    # 先记录测量结果，核对文件内容的耗时和内存不计入下载
+    result['seconds'] = time.perf_counter() - wall
+    result['cpu_seconds'] = time.process_time() - cpu
+    result['peak_rss_kb'] = peak_rss_kb()
+    if result['error'] is None:
+        result['ok'] = file_digest(save_path, 'sha256') == spec['sha256']
+        if not result['ok']:
+            result['error'] = '文件内容不一致'
+    return result
+
+
+def peak_rss_kb():
+    """本进程的峰值常驻内存 (KB)，平台不支持时返回 None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 的单位是字节，Linux 是 KB
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def run_case(server: RangeServer, scenario: str, config: str, sha256: str, timeout: float) -> dict:
+    """在子进程中运行一个用例"""
+    with tempfile.TemporaryDirectory() as workdir:
+        spec = {
+            'url': server.url,
+            'workdir': workdir,
+            'params': CONFIGS[config],
+            'sha256': sha256,
+        }
+        server.reset_stats()
+        try:
+            proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', json.dumps(spec)],
+                                  capture_output=True, text=True, timeout=timeout)
+            lines = proc.stdout.strip().splitlines()
+            result = json.loads(lines[-1]) if lines else {'ok': False, 'error': proc.stderr[-500:]}
+        except subprocess.TimeoutExpired:
+            result = {'ok': False, 'error': f'超时 ({timeout}s)'}
+
+    stats = server.stats()
+    size = server.config.size
+    seconds = result.get('seconds')
+    result.update({
+        'scenario': scenario,
+        'config': config,
+        'params': CONFIGS[config],
+        'throughput': size / seconds if result.get('ok') and seconds else None,
+        'served_bytes': stats['bytes_sent'],
+        'refetched_bytes': max(0, stats['bytes_sent'] - size),
+        'requests': stats['requests'],
+        'resets': stats['resets'],
+    })
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='下载引擎基准测试')
+    parser.add_argument('--size', type=int, default=64, help='文件大小 (MB)')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='场景，逗号分隔')
+    parser.add_argument('--configs', default=','.join(CONFIGS), help='配置，逗号分隔')
+    parser.add_argument('--repeat', type=int, default=1, help='每个用例的重复次数')
+    parser.add_argument('--timeout', type=float, default=300, help='单个用例的超时时间 (秒)')
+    parser.add_argument('--output', default='bench_results.json', help='结果文件')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(json.loads(args.child))))
+        return
+
+    scenarios = [s for s in args.scenarios.split(',') if s]
+    configs = [c for c in args.configs.split(',') if c]
+    for name in scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"未知场景: {name}")
+    for name in configs:
+        if name not in CONFIGS:
+            parser.error(f"未知配置: {name}")
+
+    results = []
+    for scenario in scenarios:
+        config = ServerConfig(size=args.size * MB, **SCENARIOS[scenario])
+        server = RangeServer(config).start()
+        sha256 = hashlib.sha256(server.data).hexdigest()
+        try:
+            for name in configs:
+                for run in range(args.repeat):
+                    result = run_case(server, scenario, name, sha256, args.timeout)
+                    result['run'] = run
+                    results.append(result)
+                    throughput = result['throughput']
+                    print(f"{scenario:<10} {name:<14} "
+                          f"{'失败' if not result['ok'] else f'{throughput / MB:8.1f} MB/s'}  "
+                          f"CPU {result.get('cpu_seconds', 0):.2f}s  "
+                          f"重复 {result['refetched_bytes'] / MB:.1f}MB"
+                          + (f"  {result['error']}" if result['error'] else ''))
+        finally:
+            server.stop()
+
+    report = {
+        'meta': {
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'size': args.size * MB,
+            'scenarios': {name: SCENARIOS[name] for name in scenarios},
+        },
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+写入路径基准测试
+
+比较下载时三种写文件方式的耗时和 CPU 占用：
+    aiofiles   每个分段各自打开文件，每次写入切换到线程池 (原实现)
+    pwrite     单个描述符，在事件循环中直接定位写入
+    coalesce   单个描述符，同一分段的连续数据合并后用 pwritev 写出
+
+用法:
+    python benchmarks/bench_writer.py [--size MB] [--segments N] [--chunk KB] [--coalesce KB]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+
+import aiofiles
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.writer import FileWriter
+
+
+def make_segments(total_size: int, segments: int):
+    size = total_size // segments
+    return [(i * size, total_size - 1 if i == segments - 1 else (i + 1) * size - 1)
+            for i in range(segments)]
+
+
+async def write_aiofiles(path, total_size, ranges, payload):
+    async with aiofiles.open(path, 'wb') as f:
+        await f.truncate(total_size)
+
+    async def worker(start, end):
+        async with aiofiles.open(path, 'r+b') as f:
+            await f.seek(start)
+            offset = start
+            while offset <= end:
+                chunk = payload[:end - offset + 1]
+                await f.write(chunk)
+                offset += len(chunk)
+                await asyncio.sleep(0)
+
+    await asyncio.gather(*(worker(s, e) for s, e in ranges))
+
+
+async def write_pwrite(path, total_size, ranges, payload, coalesce_size=0):
+    writer = FileWriter(path, coalesce_size)
+    writer.truncate(total_size)
+
+    async def worker(start, end):
+        offset = start
+        while offset <= end:
+            chunk = payload[:end - offset + 1]
+            writer.write(offset, chunk)
+            offset += len(chunk)
+            await asyncio.sleep(0)
+
+    try:
+        await asyncio.gather(*(worker(s, e) for s, e in ranges))
+    finally:
+        writer.close()
+
+
+def run_case(name, coro_factory, path):
+    if os.path.exists(path):
+        os.remove(path)
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    asyncio.run(coro_factory())
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+    return name, wall, cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description='写入路径基准测试')
+    parser.add_argument('--size', type=int, default=512, help='文件大小 (MB)')
+    parser.add_argument('--segments', type=int, default=8, help='分段数')
+    parser.add_argument('--chunk', type=int, default=64, help='每次写入大小 (KB)')
+    parser.add_argument('--coalesce', type=int, default=1024, help='合并写入阈值 (KB)')
+    parser.add_argument('--repeat', type=int, default=3, help='重复次数，取最好成绩')
+    args = parser.parse_args()
+
+    total_size = args.size * 1024 * 1024
+    ranges = make_segments(total_size, args.segments)
+    payload = os.urandom(args.chunk * 1024)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.bin')
+        cases = [
+            ('aiofiles', lambda: write_aiofiles(path, total_size, ranges, payload)),
+            ('pwrite', lambda: write_pwrite(path, total_size, ranges, payload)),
+            ('coalesce', lambda: write_pwrite(path, total_size, ranges, payload,
+                                              args.coalesce * 1024)),
+        ]
+        print(f"文件 {args.size}MB, {args.segments} 个分段, 每次写入 {args.chunk}KB")
+        print(f"{'方式':<10}{'耗时(s)':>10}{'CPU(s)':>10}{'MB/s':>10}")
+        for name, factory in cases:
+            results = [run_case(name, factory, path) for _ in range(args.repeat)]
+            _, wall, cpu = min(results, key=lambda r: r[1])
+            print(f"{name:<10}{wall:>10.3f}{cpu:>10.3f}{args.size / wall:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+"""
+基准测试用的本地 HTTP 服务器
+
+在当前进程的后台线程中运行，支持:
+    Range 请求 (可以关闭 Accept-Ranges 模拟不支持分段的服务器)
+    每个连接的带宽限制
+    响应前的附加延迟
+    传输中途断开连接 (发送 RST)
+
+统计实际发出的字节数和请求数，用来计算重复下载的数据量。
+"""
+import re
+import time
+import random
+import socket
+import struct
+import threading
+import http.server
+import socketserver
+from typing import Optional, Dict, Any
+
+WRITE_SIZE = 16 * 1024
+
+
+class ServerConfig:
+    """服务器行为配置"""
+
+    def __init__(self, size: int = 64 * 1024 * 1024,
+                 accept_ranges: bool = True,
+                 rate: Optional[int] = None,
+                 latency: float = 0.0,
+                 reset_every: int = 0,
+                 reset_after: int = 256 * 1024,
+                 seed: int = 1):
+        """
+        Args:
+            size: 文件大小 (bytes)
+            accept_ranges: 是否支持 Range 请求
+            rate: 每个连接的带宽上限 (bytes/s)，None 表示不限制
+            latency: 每个请求在发送响应头前的延迟 (秒)
+            reset_every: 每隔多少个 GET 请求中途断开一次，0 表示不断开
+            reset_after: 断开前发送的字节数
+            seed: 生成文件内容的随机种子
+        """
+        self.size = size
+        self.accept_ranges = accept_ranges
+        self.rate = rate
+        self.latency = latency
+        self.reset_every = reset_every
+        self.reset_after = reset_after
+        self.seed = seed
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.__dict__)
+
+
+class RangeServer:
+    """后台线程运行的测试服务器"""
+
+    def __init__(self, config: ServerConfig):
+        self.config = config
+        self.data = random.Random(config.seed).randbytes(config.size)
+        self.etag = f'"bench-{config.seed}-{config.size}"'
+        self._lock = threading.Lock()
+        self.bytes_sent = 0
+        self.requests = 0
+        self.resets = 0
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f'http://{host}:{port}/bench.bin'
+
+    def start(self) -> 'RangeServer':
+        handler = type('Handler', (_Handler,), {'bench': self})
+        self._server = _ThreadingServer(('127.0.0.1', 0), handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def reset_stats(self):
+        with self._lock:
+            self.bytes_sent = 0
+            self.requests = 0
+            self.resets = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'bytes_sent': self.bytes_sent,
+                'requests': self.requests,
+                'resets': self.resets,
+            }
+
+    def _next_request(self) -> bool:
+        """记录一次 GET 请求，返回本次是否应中途断开"""
+        with self._lock:
+            self.requests += 1
+            every = self.config.reset_every
+            return bool(every) and self.requests % every == 0
+
+    def _count(self, nbytes: int):
+        with self._lock:
+            self.bytes_sent += nbytes
+
+    def _count_reset(self):
+        with self._lock:
+            self.resets += 1
+
+
+class _ThreadingServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    # 默认的 listen 队列只有 5，多个连接同时建立时会丢 SYN，客户端要等 1 秒重传
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        # 客户端主动断开 (取消、分段被拆走) 是正常情况
+        pass
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    bench: RangeServer = None
+
+    def log_message(self, *args):
+        pass
+
+    def _headers(self, status: int, length: int, content_range: Optional[str] = None):
+        config = self.bench.config
+        self.send_response(status)
+        self.send_header('Content-Length', str(length))
+        self.send_header('ETag', self.bench.etag)
+        self.send_header('Last-Modified', 'Mon, 01 Jan 2024 00:00:00 GMT')
+        if config.accept_ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        if content_range:
+            self.send_header('Content-Range', content_range)
+        self.end_headers()
+
+    def do_HEAD(self):
+        if self.bench.config.latency:
+            time.sleep(self.bench.config.latency)
+        self._headers(200, len(self.bench.data))
+
+    def do_GET(self):
+        bench = self.bench
+        config = bench.config
+        reset = bench._next_request()
+        if config.latency:
+            time.sleep(config.latency)
+
+        data = bench.data
+        start, end = 0, len(data) - 1
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match and config.accept_ranges:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or end), end)
+            self._headers(206, end - start + 1, f'bytes {start}-{end}/{len(data)}')
+        else:
+            self._headers(200, len(data))
+
+        view = memoryview(data)[start:end + 1]
+        sent = 0
+        began = time.monotonic()
+        while sent < len(view):
+            if reset and sent >= config.reset_after:
+                self._reset()
+                return
+            block = view[sent:sent + WRITE_SIZE]
+            try:
+                self.wfile.write(block)
+            except OSError:
+                return
+            sent += len(block)
+            bench._count(len(block))
+            if config.rate:
+                # 按目标速率控制发送节奏
+                delay = sent / config.rate - (time.monotonic() - began)
+                if delay > 0:
+                    time.sleep(delay)
+
+    def _reset(self):
+        """立即关闭连接并发送 RST，模拟网络中断"""
+        self.bench._count_reset()
+        try:
+            self.wfile.flush()
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            self.connection.close()
+        except OSError:
+            pass
+        self.close_connection = True
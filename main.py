@@ -1,7 +1,8 @@
 import sys
 import os
 import yaml
-from app.download import Downloader
+from app.scheduler import get_scheduler, DownloadTask
+from app.progress import ProgressEvent
 from PySide6.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QTabWidget, QTableWidget, QTableWidgetItem, QHeaderView, QAbstractItemView, QPushButton, QComboBox, QMessageBox, QLineEdit, QHBoxLayout, QDialog, QLabel
 )
@@ -25,26 +26,37 @@ class DownloadWorker(QThread):
     finished = Signal(str)
     error = Signal(str)
 
-    def __init__(self, url, save_path):
+    def __init__(self, url, save_path, mirrors=None, **options):
         super().__init__()
         self.url = url
         self.save_path = save_path
-        self.downloader = Downloader(url, save_path)
+        self.mirrors = mirrors
+        self.options = options  # 传给 Downloader 的其他参数，如 checksum
+        self.task = None
 
     def run(self):
         try:
-            self.downloader.start()
-            while True:
-                progress = self.downloader.get_progress()
-                self.progress.emit(progress)
-                if progress >= 100:
-                    break
-                self.msleep(200)
-            self.finished.emit(self.save_path)
+            # 交给全局调度器排队，由调度器决定何时开始以及使用多少连接
+            self.task = get_scheduler().submit(self.url, self.save_path, mirrors=self.mirrors,
+                                              **self.options)
         except Exception as e:
             tb = traceback.format_exc()
             print(f"下载线程异常: {e}\n{tb}")
             self.error.emit(f"{e}\n{tb}")
+            return
+        # 进度和结束事件转成 Qt 信号，线程只阻塞等待任务结束
+        self.task.events.subscribe(self.on_event)
+        self.task.wait()
+        self.task.events.unsubscribe(self.on_event)
+
+    def on_event(self, event: ProgressEvent):
+        if event.kind == ProgressEvent.PROGRESS:
+            self.progress.emit(event.progress)
+        elif event.kind == ProgressEvent.COMPLETED:
+            self.progress.emit(100)
+            self.finished.emit(event.path)
+        elif event.terminal:
+            self.error.emit(event.error or DownloadTask.STATE_NAMES[event.state])
 
 class SearchDialog(QDialog):
     def __init__(self, all_softwares, parent=None):